@@ -1,9 +1,15 @@
 from .base import BaseAnalyzer, ThreatInfo
+from .state import IPStateTable
+from .sketch import SlidingCountMinSketch, HyperLogLog
 from .frequency import FrequencyAnalyzer
 from .pattern import PatternAnalyzer
 from .status_code import StatusCodeAnalyzer
+from .distinct_path import DistinctPathAnalyzer
+from .ssh_bruteforce import SSHBruteforceAnalyzer
+from .prefilter import StaticAssetFilter
 
 __all__ = [
-    'BaseAnalyzer', 'ThreatInfo',
-    'FrequencyAnalyzer', 'PatternAnalyzer', 'StatusCodeAnalyzer'
+    'BaseAnalyzer', 'ThreatInfo', 'IPStateTable', 'SlidingCountMinSketch', 'HyperLogLog',
+    'FrequencyAnalyzer', 'PatternAnalyzer', 'StatusCodeAnalyzer', 'DistinctPathAnalyzer',
+    'SSHBruteforceAnalyzer', 'StaticAssetFilter'
 ]
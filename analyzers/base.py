@@ -1,11 +1,18 @@
 """分析器基类"""
 from abc import ABC, abstractmethod
+from collections import deque
 from dataclasses import dataclass, field
-from datetime import datetime, timezone
-from typing import Dict, List, Optional, Any
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Any, Callable, Iterable, Tuple
 
 from utils.log_parser import LogEntry
 from utils.logger import get_logger
+from . import columnar
+from .state import IPStateTable
+
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
 
 
 def _utc_now() -> datetime:
@@ -13,6 +20,60 @@ def _utc_now() -> datetime:
     return datetime.now(timezone.utc).replace(tzinfo=None)
 
 
+def to_epoch(dt: datetime):
+    """UTC时间（无时区标记）转换为时间戳，整秒时返回int使快照更紧凑"""
+    ts = (dt - _EPOCH).total_seconds()
+    return int(ts) if ts.is_integer() else round(ts, 3)
+
+
+def from_epoch(ts) -> datetime:
+    """时间戳转换为UTC时间（无时区标记）"""
+    return _EPOCH + timedelta(seconds=ts)
+
+
+def to_epoch_microseconds(dt: datetime) -> int:
+    """UTC时间（无时区标记）转换为微秒时间戳（与datetime比较结果一致）"""
+    return (dt - _EPOCH) // _MICROSECOND
+
+
+def from_epoch_microseconds(stamp: int) -> datetime:
+    """微秒时间戳转换为UTC时间（无时区标记）"""
+    return _EPOCH + stamp * _MICROSECOND
+
+
+def group_by_ip(entries: Iterable[LogEntry]) -> Dict[str, List[LogEntry]]:
+    """按IP分组（保持每个IP内记录的原始顺序，跳过没有IP的记录）"""
+    groups: Dict[str, List[LogEntry]] = {}
+    for entry in entries:
+        if not entry.ip:
+            continue
+        group = groups.get(entry.ip)
+        if group is None:
+            groups[entry.ip] = [entry]
+        else:
+            group.append(entry)
+    return groups
+
+
+# 样本中请求路径和UA保留的最大长度
+SAMPLE_FIELD_LENGTH = 512
+
+
+def make_sample(entry: LogEntry, rule: str) -> Tuple:
+    """
+    证据样本：(日志时间, 请求路径, 状态码, UA, 命中规则)
+
+    路径和UA截断到 SAMPLE_FIELD_LENGTH，每条样本的大小有上限
+    """
+    return (
+        entry.timestamp,
+        (entry.path or '')[:SAMPLE_FIELD_LENGTH],
+        entry.status,
+        (entry.user_agent or '')[:SAMPLE_FIELD_LENGTH],
+        rule
+    )
+
+
 @dataclass
 class ThreatInfo:
     """威胁信息"""
@@ -23,6 +84,8 @@ class ThreatInfo:
     first_seen: datetime = None
     last_seen: datetime = None
     details: Dict[str, Any] = field(default_factory=dict)
+    # 最近命中的证据样本（环形缓冲，maxlen 为每个IP保留的样本数）
+    samples: deque = field(default_factory=lambda: deque(maxlen=0))
 
     def __post_init__(self):
         if self.first_seen is None:
@@ -36,6 +99,19 @@ class ThreatInfo:
             self.reasons.append(reason)
         self.score += score
 
+    def copy(self) -> 'ThreatInfo':
+        """复制威胁信息（分析器会继续修改自己持有的对象）"""
+        return ThreatInfo(
+            ip=self.ip,
+            score=self.score,
+            reasons=list(self.reasons),
+            hit_count=self.hit_count,
+            first_seen=self.first_seen,
+            last_seen=self.last_seen,
+            details=dict(self.details),
+            samples=deque(self.samples, maxlen=self.samples.maxlen)
+        )
+
     def merge(self, other: 'ThreatInfo'):
         """合并威胁信息"""
         self.score += other.score
@@ -48,6 +124,14 @@ class ThreatInfo:
         if other.last_seen and (not self.last_seen or other.last_seen > self.last_seen):
             self.last_seen = other.last_seen
         self.details.update(other.details)
+        if other.samples:
+            # 按日志时间保留两边最近的样本
+            limit = max(self.samples.maxlen or 0, other.samples.maxlen or 0)
+            merged = sorted(
+                list(self.samples) + list(other.samples),
+                key=lambda sample: sample[0] or _EPOCH
+            )
+            self.samples = deque(merged, maxlen=limit)
 
     def get_level(self, thresholds: Dict[str, int]) -> str:
         """根据分数获取威胁等级"""
@@ -65,10 +149,36 @@ class ThreatInfo:
 class BaseAnalyzer(ABC):
     """分析器基类"""
 
-    def __init__(self, config: Dict = None):
+    # 处理的日志来源（None表示全部来源）
+    sources: Optional[Tuple[str, ...]] = None
+    # 需要的 LogEntry 字段，日志源不提供这些字段时不路由到该分析器
+    fields: Tuple[str, ...] = ('ip',)
+
+    def __init__(self, config: Dict = None, state_table: IPStateTable = None):
+        """
+        Args:
+            config: 配置
+            state_table: 共享的IP状态表（未提供时使用独立的状态表）
+        """
         self.config = config or {}
         self.logger = get_logger()
         self._threats: Dict[str, ThreatInfo] = {}
+        # 已分析到的最新日志时间，窗口裁剪以日志时间为准
+        self._latest: Optional[datetime] = None
+
+        state_config = self.config.get('analyzer_state', {})
+        # 无时间窗口的计数在IP多久无活动后丢弃（秒）
+        self.state_ttl = state_config.get('ttl_seconds', 86400)
+        if state_table is None:
+            state_table = IPStateTable(max_memory_mb=state_config.get('max_memory_mb', 512))
+        self.state_table = state_table
+
+        # 批量分析使用NumPy向量化实现（未安装NumPy时使用Python实现）
+        self.columnar = self.config.get('batch_analysis', {}).get('numpy', True) and columnar.HAS_NUMPY
+
+        # 每个威胁IP保留的最近命中样本数（0表示不保留）
+        evidence_config = self.config.get('evidence', {})
+        self.max_samples = evidence_config.get('samples_per_ip', 10) if evidence_config.get('enabled', True) else 0
 
     @property
     @abstractmethod
@@ -89,6 +199,47 @@ class BaseAnalyzer(ABC):
         """
         pass
 
+    def analyze_batch(self, entries: List[LogEntry]) -> List[ThreatInfo]:
+        """
+        批量分析一批日志记录
+
+        默认逐条调用 analyze；子类可按IP分组等方式优化，但每个IP的判定结果须与逐条分析一致。
+
+        Args:
+            entries: 日志记录（按读取顺序）
+
+        Returns:
+            本批新增威胁原因的IP的威胁信息（每个IP一项，为分析器持有的累计对象）
+        """
+        found: Dict[str, ThreatInfo] = {}
+        for entry in entries:
+            threat = self.analyze(entry)
+            if threat:
+                found[threat.ip] = threat
+        return list(found.values())
+
+    def accepts(self, source: str, fields: Iterable[str] = None) -> bool:
+        """
+        是否处理该来源的日志
+
+        Args:
+            source: 日志来源
+            fields: 该来源提供的字段（None表示不检查）
+        """
+        if self.sources is not None and source not in self.sources:
+            return False
+        if fields is not None and not set(self.fields) <= set(fields):
+            return False
+        return True
+
+    def screen(self, entry: LogEntry) -> bool:
+        """
+        廉价的规则预筛：记录是否命中本分析器的规则
+
+        降载采样时命中任一分析器预筛的记录始终保留；默认不命中
+        """
+        return False
+
     def get_threats(self) -> Dict[str, ThreatInfo]:
         """获取所有检测到的威胁"""
         return self._threats
@@ -96,6 +247,42 @@ class BaseAnalyzer(ABC):
     def clear(self):
         """清除威胁记录"""
         self._threats.clear()
+        self._latest = None
+
+    def reset_threats(self):
+        """只清除本次扫描（实时模式下为已写入数据库）的威胁记录，保留时间窗口状态继续累计"""
+        self._threats.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        导出时间窗口状态快照（可JSON序列化，已裁剪到窗口内）
+
+        Returns:
+            快照字典，没有跨扫描状态时返回空字典
+        """
+        return {}
+
+    def restore(self, state: Dict[str, Any]):
+        """从快照恢复时间窗口状态"""
+        pass
+
+    def trim(self):
+        """丢弃窗口外的状态，控制跨扫描保留的内存"""
+        self.state_table.sweep()
+
+    @property
+    def latest(self) -> Optional[datetime]:
+        """已分析到的最新日志时间"""
+        return self._latest
+
+    def advance(self, timestamp: datetime):
+        """把已分析到的最新日志时间推进到 timestamp（多进程分析时各分片同步到同一条时间线）"""
+        self._observe(timestamp)
+
+    def _observe(self, timestamp: datetime):
+        """记录已分析到的最新日志时间"""
+        if timestamp and (self._latest is None or timestamp > self._latest):
+            self._latest = timestamp
 
     def _add_threat(self, ip: str, reason: str, score: int, entry: LogEntry):
         """添加威胁记录"""
@@ -103,7 +290,8 @@ class BaseAnalyzer(ABC):
             self._threats[ip] = ThreatInfo(
                 ip=ip,
                 first_seen=entry.timestamp,
-                last_seen=entry.timestamp
+                last_seen=entry.timestamp,
+                samples=deque(maxlen=self.max_samples)
             )
 
         threat = self._threats[ip]
@@ -114,5 +302,105 @@ class BaseAnalyzer(ABC):
                 threat.first_seen = entry.timestamp
             if not threat.last_seen or entry.timestamp > threat.last_seen:
                 threat.last_seen = entry.timestamp
+        if self.max_samples:
+            threat.samples.append(make_sample(entry, reason))
 
         return threat
+
+    def _add_hits(self, ip: str, hits: int, last_seen: datetime, entry: LogEntry = None, reason: str = None):
+        """
+        已报告的IP再次命中：累计命中次数并更新最后访问时间
+
+        威胁记录已释放时（实时模式写入数据库后）重新建立只累计命中的记录；
+        提供 entry 时记入证据样本（reason 默认为该IP最近报告的原因）
+        """
+        threat = self._threats.get(ip)
+        if threat is None:
+            threat = self._threats[ip] = ThreatInfo(
+                ip=ip,
+                first_seen=last_seen,
+                last_seen=last_seen,
+                samples=deque(maxlen=self.max_samples)
+            )
+        threat.hit_count += hits
+        if last_seen is not None:
+            threat.last_seen = last_seen
+        if entry is not None:
+            self._add_sample(ip, entry, reason)
+
+    def _add_sample(self, ip: str, entry: LogEntry, reason: str = None):
+        """把已报告IP的一条命中记录放入证据样本（reason 默认为该IP最近报告的原因）"""
+        threat = self._threats.get(ip)
+        if threat is not None and self.max_samples:
+            if not reason:
+                reason = threat.reasons[-1] if threat.reasons else self.name
+            threat.samples.append(make_sample(entry, reason))
+
+    def _replay_columnar(
+        self, keys: List[str], groups, exceeded, flagged: Callable[[int], int],
+        seen: Callable[[int], datetime], check: Callable[[int], Optional[ThreatInfo]],
+        entry_at: Callable[[int], LogEntry] = None
+    ) -> List[ThreatInfo]:
+        """
+        按记录顺序处理向量化批量分析中超过阈值的记录（与逐条分析结果相同）
+
+        只有已标记的规则超过阈值的IP批量累计命中次数；
+        有未标记的规则超过阈值的IP逐条判定，期间的命中次数在判定前按顺序累计。
+
+        Args:
+            keys: 组编号对应的IP
+            groups: 每行的组编号（同组的行连续，组内按记录顺序）
+            exceeded: 每行超过阈值的规则（按规则序号的位掩码，0表示未超过）
+            flagged: 组编号 -> 当前已标记的规则位掩码
+            seen: 行位置 -> 该行的日志时间
+            check: 逐条判定一行，返回报告的威胁
+            entry_at: 行位置 -> 该行的日志记录（提供时已报告IP的命中记入证据样本）
+        """
+        np = columnar.np
+        positions = np.flatnonzero(exceeded)
+        if not len(positions):
+            return []
+        hot_groups = groups[positions]
+        exceeded = exceeded[positions]
+        hot_keys = np.unique(hot_groups)
+        flags = np.zeros(len(keys), dtype=np.int64)
+        flags[hot_keys] = [flagged(group_id) for group_id in hot_keys.tolist()]
+        stepwise = np.zeros(len(keys), dtype=bool)
+        stepwise[hot_groups[(exceeded & ~flags[hot_groups]) != 0]] = True
+
+        # 只有已标记规则超过阈值的IP：每个IP一次累计
+        bulk = ~stepwise[hot_groups]
+        bulk_groups = hot_groups[bulk]
+        bulk_positions = positions[bulk]
+        if len(bulk_groups):
+            ends = np.flatnonzero(np.append(bulk_groups[1:] != bulk_groups[:-1], True))
+            counts = np.diff(np.concatenate(([-1], ends)))
+            for group_id, count, end in zip(bulk_groups[ends].tolist(), counts.tolist(), ends.tolist()):
+                ip = keys[group_id]
+                self._add_hits(ip, count, seen(int(bulk_positions[end])))
+                if entry_at is not None and self.max_samples:
+                    # 环形缓冲只会留下最后 max_samples 条
+                    for position in bulk_positions[max(end - count + 1, end - self.max_samples + 1):end + 1].tolist():
+                        self._add_sample(ip, entry_at(position))
+
+        # 其余IP逐条判定
+        found: Dict[str, ThreatInfo] = {}
+        pending: Dict[str, list] = {}
+        for position, group_id, bits in zip(
+                positions[~bulk].tolist(), hot_groups[~bulk].tolist(), exceeded[~bulk].tolist()):
+            ip = keys[group_id]
+            if not bits & ~flagged(group_id):
+                hits = pending.setdefault(ip, [0, None])
+                hits[0] += 1
+                hits[1] = seen(position)
+                if entry_at is not None:
+                    self._add_sample(ip, entry_at(position))
+                continue
+            if ip in pending:
+                self._add_hits(ip, *pending.pop(ip))
+            threat = check(position)
+            if threat:
+                found[ip] = threat
+        for ip, (count, last_seen) in pending.items():
+            self._add_hits(ip, count, last_seen)
+        return list(found.values())
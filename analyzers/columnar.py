@@ -0,0 +1,156 @@
+"""
+列式批量分析的公共计算（NumPy 向量化）
+
+一批记录按IP分组排成列（IP编号、时间），每个IP的记录连续，
+用 searchsorted 一次求出每条记录所在窗口内、同一IP截至该记录的记录数，
+与逐条累加的结果一致。
+
+本批内时间回退的记录单独补计数，本批乱序且记录过多的IP交给Python实现。
+已有状态不展开成列：已有状态的总数加上本批内的计数是窗口内计数的上界，
+大部分记录远低于阈值，只有上界超过阈值的记录才补上已有状态中仍在窗口内的部分。
+
+NumPy 为可选依赖，未安装时 HAS_NUMPY 为 False，分析器使用Python实现。
+"""
+from typing import Callable, Hashable, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HAS_NUMPY = np is not None
+
+# 批内记录少于此数时向量化的固定开销不划算，直接用Python实现
+MIN_ROWS = 512
+# 平均每个IP的记录少于此数时逐IP的状态读写占主导，向量化没有收益
+MIN_ROWS_PER_KEY = 3
+# 本批内乱序的IP记录超过此数时交给Python实现（乱序记录的补计数与IP的记录数成正比）
+MAX_DISORDERED_ROWS = 512
+# 没有已有状态时的最新时间
+NO_TIME = -(1 << 62)
+
+
+def window_counts(groups, times, lower) -> 'np.ndarray':
+    """
+    每行所在窗口内、同组位置不晚于该行的记录数
+
+    不早于同组之前最大时间的行组内有序，用 searchsorted 一次求出；
+    早于之前最大时间的行（乱序，通常很少）补到同组中它及之后各行的计数上。
+
+    Args:
+        groups: 每行的组编号（不递减，同组的行连续）
+        times: 每行的时间
+        lower: 每行窗口的下界（不含），窗口为 (lower, time]；不小于该行时间时计数为0
+    """
+    n = len(times)
+    # 时间换成名次，组编号和名次组合成全局有序的键（不会溢出）
+    uniq = np.unique(times)
+    ranks = np.searchsorted(uniq, times)
+    lower_ranks = np.searchsorted(uniq, lower, side='right')
+    width = len(uniq) + 1
+    late = np.zeros(n, dtype=bool)
+    late[1:] = (groups[1:] == groups[:-1]) & (times[1:] < group_cummax(groups, times)[:-1])
+    keys = (groups * width + ranks)[~late]
+    left = np.searchsorted(keys, groups * width + lower_ranks, side='left')
+    counts = np.maximum(np.cumsum(~late) - left, 0)
+
+    late_rows = np.flatnonzero(late)
+    if len(late_rows):
+        lengths = np.searchsorted(groups, groups[late_rows], side='right') - late_rows
+        targets = np.arange(lengths.sum()) + np.repeat(late_rows - (np.cumsum(lengths) - lengths), lengths)
+        hits = targets[times[np.repeat(late_rows, lengths)] > lower[targets]]
+        counts += np.bincount(hits, minlength=n)
+    return counts
+
+
+def batch_counts(groups, times, lower, disordered, pairwise: Callable[['np.ndarray'], 'np.ndarray']) -> 'np.ndarray':
+    """
+    有序的组同 window_counts，乱序的组由 pairwise 逐对比较求出
+    （乱序时计数规则与 window_counts 不同的情况，如按每条记录的窗口逐条过滤）
+
+    Args:
+        disordered: 每个组编号是否乱序
+        pairwise: 乱序组的行（布尔掩码）-> 这些行的计数
+    """
+    ordered = ~disordered[groups]
+    if ordered.all():
+        return window_counts(groups, times, lower)
+    counts = np.zeros(len(times), dtype=np.int64)
+    if ordered.any():
+        counts[ordered] = window_counts(groups[ordered], times[ordered], lower[ordered])
+    counts[~ordered] = pairwise(~ordered)
+    return counts
+
+
+def _longest_run(groups) -> int:
+    """同组连续行的最大行数"""
+    heads = np.flatnonzero(np.concatenate(([True], groups[1:] != groups[:-1], [True])))
+    return int(np.diff(heads).max())
+
+
+def surviving_counts(groups, times, window: int) -> 'np.ndarray':
+    """
+    乱序的组按每条记录的窗口逐条过滤时，截至每条记录仍保留的同组记录数
+
+    记录 j 在之后第一条满足 times[k] - window >= times[j] 的记录处被过滤，
+    即 counts[i] 为同组、j <= i 且 max(times[j..i]) - window < times[j] 的 j 的个数
+    """
+    n = len(times)
+    counts = np.zeros(n, dtype=np.int64)
+    # spans[i] = max(times[i - lag..i])，跨组的部分不会被计数（更大的间隔也不再同组）
+    spans = times.copy()
+    for lag in range(_longest_run(groups)):
+        spans[lag:] = np.maximum(spans[lag:], times[:n - lag])
+        counts[lag:] += (groups[lag:] == groups[:n - lag]) & (spans[lag:] - window < times[:n - lag])
+    return counts
+
+
+def group_cummax(groups, values, reverse: bool = False) -> 'np.ndarray':
+    """组内累计最大值（groups 不递减）；reverse 为真时从组尾向前累计"""
+    if not len(values):
+        return values
+    offset = int(values.max() - values.min()) + 1
+    if reverse:
+        shifted = values - groups * offset
+        return np.maximum.accumulate(shifted[::-1])[::-1] + groups * offset
+    shifted = values + groups * offset
+    return np.maximum.accumulate(shifted) - groups * offset
+
+
+def unique_pairs(first, second) -> Tuple[List[Tuple[int, int]], 'np.ndarray']:
+    """
+    整数对去重
+
+    Returns:
+        (pairs, inverse)：pairs 为去重后的 (first, second) 列表，第 i 行的对为 pairs[inverse[i]]
+    """
+    base = int(second.min())
+    width = int(second.max()) - base + 1
+    uniq, inverse = np.unique(first * width + (second - base), return_inverse=True)
+    return list(zip((uniq // width).tolist(), (uniq % width + base).tolist())), inverse.reshape(-1)
+
+
+def group_rows(keys: List[Hashable]) -> Tuple[List[Hashable], 'np.ndarray', 'np.ndarray']:
+    """
+    按键分组排列行
+
+    Returns:
+        (keys, order, bounds)：keys 为按首次出现顺序排列的键（组编号即下标）；
+        order 为按 (组编号, 原顺序) 排列的行号；第 i 组的行为 order[bounds[i]:bounds[i + 1]]
+    """
+    index = {}
+    ids = as_array([index.setdefault(key, len(index)) for key in keys])
+    order = np.argsort(ids, kind='stable')
+    bounds = np.searchsorted(ids[order], np.arange(len(index) + 1))
+    return list(index), order, bounds
+
+
+def as_array(values) -> 'np.ndarray':
+    """整数列表转换为 int64 数组"""
+    return np.asarray(values, dtype=np.int64)
+
+
+def as_stamps(values: List[Hashable], convert: Callable[[Hashable], int]) -> 'np.ndarray':
+    """按 convert 转换为 int64 数组，相同的值只转换一次（日志时间多为整秒，重复很多）"""
+    stamps = {value: convert(value) for value in set(values)}
+    return as_array([stamps[value] for value in values])
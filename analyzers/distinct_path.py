@@ -0,0 +1,196 @@
+"""不同路径数分析器（目录爆破/路径枚举检测）"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any, Tuple
+
+from .base import BaseAnalyzer, ThreatInfo, to_epoch, from_epoch
+from .sketch import HyperLogLog
+from .state import IPStateTable, RECORD_BYTES
+from utils.log_parser import LogEntry
+
+
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+# 已报告的规则（位）
+_FLAG_PATHS = 1
+_FLAG_MISSING = 2
+
+
+def _epoch_seconds(dt: datetime) -> int:
+    """UTC时间转换为整秒时间戳"""
+    return (dt - _EPOCH) // _SECOND
+
+
+class _PathWindow:
+    """IP在当前时间窗口内访问的不同路径（HyperLogLog，每IP内存固定）"""
+    __slots__ = ('start', 'paths', 'missing', 'flagged')
+
+    def __init__(self):
+        # 窗口开始时间（整秒时间戳）
+        self.start = 0
+        self.paths: Optional[HyperLogLog] = None
+        # 返回404的不同路径（出现404时才创建）
+        self.missing: Optional[HyperLogLog] = None
+        self.flagged = 0
+
+
+class DistinctPathAnalyzer(BaseAnalyzer):
+    """
+    不同路径数分析器 - 检测目录爆破、路径枚举
+
+    爆破工具会访问成千上万个不同的URL，其中大部分不在敏感路径列表中。
+    每个IP每个时间窗口用两个 HyperLogLog 估计访问过的不同路径数和返回404的不同路径数，
+    超过阈值时标记。路径不含查询串；静态资源请求（引擎预分类）不计入不同路径数。
+
+    时间窗口按日志时间对齐 window_seconds（固定窗口），窗口结束后重新计数；
+    早于IP当前窗口的乱序记录不计入。
+    """
+
+    sources = ('nginx',)
+    fields = ('ip', 'timestamp', 'path', 'status')
+
+    def __init__(self, config: Dict = None, state_table: IPStateTable = None):
+        super().__init__(config, state_table)
+
+        thresholds = self.config.get('thresholds', {}).get('distinct_paths', {})
+        self.window_seconds = thresholds.get('window_seconds', 600)
+        self.max_paths = thresholds.get('max_paths', 300)
+        self.max_missing_paths = thresholds.get('max_404_paths', 100)
+        # 寄存器个数 2^precision，每IP内存约 2 * 2^precision 字节，标准误差约 1.04/sqrt(2^precision)
+        self.precision = min(16, max(4, thresholds.get('precision', 7)))
+
+        scores = self.config.get('threat_scores', {})
+        self.threat_score = scores.get('path_enumeration', 4)
+
+        self.state_table.register(self.name, self._expire, self._records)
+
+    @property
+    def name(self) -> str:
+        return 'distinct_path'
+
+    def analyze(self, entry: LogEntry) -> Optional[ThreatInfo]:
+        """统计不同路径数"""
+        return self._analyze_entry(entry)
+
+    def analyze_batch(self, entries: List[LogEntry]) -> List[ThreatInfo]:
+        """批量统计不同路径数（同一批内重复的路径只计算一次哈希）"""
+        found: Dict[str, ThreatInfo] = {}
+        positions: Dict[str, Tuple[int, int]] = {}
+        with self.state_table.deferred_sweep():
+            for entry in entries:
+                threat = self._analyze_entry(entry, positions)
+                if threat:
+                    found[threat.ip] = threat
+        return list(found.values())
+
+    def _position(self, path: str, positions: Dict[str, Tuple[int, int]] = None) -> Tuple[int, int]:
+        """路径对应的寄存器位置（positions 缓存同一批内的结果）"""
+        if positions is None:
+            return HyperLogLog.position(HyperLogLog.hash(path), self.precision)
+        position = positions.get(path)
+        if position is None:
+            position = positions[path] = HyperLogLog.position(HyperLogLog.hash(path), self.precision)
+        return position
+
+    def _analyze_entry(
+        self, entry: LogEntry, positions: Dict[str, Tuple[int, int]] = None
+    ) -> Optional[ThreatInfo]:
+        """分析单条记录"""
+        if not entry.ip or not entry.timestamp or not entry.path:
+            return None
+
+        ip = entry.ip
+        now = entry.timestamp
+        self._observe(now)
+
+        start = _epoch_seconds(now) // self.window_seconds * self.window_seconds
+        window = self.state_table.touch(ip, self.name, _PathWindow, now)
+        if window.paths is None or start > window.start:
+            # 新的时间窗口
+            window.start = start
+            window.paths = HyperLogLog(self.precision)
+            window.missing = None
+            window.flagged = 0
+        elif start < window.start:
+            return None
+
+        missing = entry.status == 404
+        static = entry.extra.get('static', False)
+        if static and not missing:
+            if window.flagged:
+                self._add_hits(ip, entry.extra.get('weight', 1), now, entry)
+            return None
+
+        path = entry.path.split('?', 1)[0]
+        position = self._position(path, positions)
+        threat = None
+
+        if not static and window.paths.update(*position):
+            if not window.flagged & _FLAG_PATHS:
+                count = window.paths.count()
+                if count > self.max_paths:
+                    window.flagged |= _FLAG_PATHS
+                    threat = self._add_threat(ip, f'路径枚举(约{count}个不同路径)', self.threat_score, entry)
+
+        if missing:
+            if window.missing is None:
+                window.missing = HyperLogLog(self.precision)
+            if window.missing.update(*position):
+                if not window.flagged & _FLAG_MISSING:
+                    count = window.missing.count()
+                    if count > self.max_missing_paths:
+                        window.flagged |= _FLAG_MISSING
+                        threat = self._add_threat(ip, f'大量404路径(约{count}个不同路径)', self.threat_score, entry)
+
+        if threat is None and window.flagged:
+            # 已报告的IP再次访问
+            self._add_hits(ip, 1, now, entry)
+        return threat
+
+    def _expire(self, window: _PathWindow, latest: datetime) -> bool:
+        """窗口已结束的IP丢弃"""
+        return window.start + self.window_seconds > _epoch_seconds(latest)
+
+    def _records(self, window: _PathWindow) -> int:
+        """寄存器占用的内存折算为记录条数（用于估算内存）"""
+        size = len(window.paths.registers) if window.paths is not None else 0
+        if window.missing is not None:
+            size += len(window.missing.registers)
+        return size // RECORD_BYTES
+
+    def clear(self):
+        """清除记录"""
+        super().clear()
+        self.state_table.discard(self.name)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前窗口内各IP的非零寄存器和已报告的规则"""
+        windows = {}
+        if self._latest is not None:
+            for ip, window in self.state_table.items(self.name):
+                if window.paths is None or not self._expire(window, self._latest):
+                    continue
+                windows[ip] = [
+                    window.start,
+                    window.paths.pairs(),
+                    window.missing.pairs() if window.missing is not None else [],
+                    window.flagged
+                ]
+        return {
+            'latest': to_epoch(self._latest) if self._latest else None,
+            'precision': self.precision,
+            'windows': windows
+        }
+
+    def restore(self, state: Dict[str, Any]):
+        """恢复当前窗口内的寄存器（寄存器个数配置变化时不恢复）"""
+        if state.get('latest') is not None:
+            self._observe(from_epoch(state['latest']))
+        if state.get('precision') != self.precision:
+            return
+        for ip, (start, paths, missing, flagged) in state.get('windows', {}).items():
+            window = self.state_table.touch(ip, self.name, _PathWindow, self._latest)
+            window.start = start
+            window.paths = HyperLogLog.from_pairs(paths, self.precision)
+            window.missing = HyperLogLog.from_pairs(missing, self.precision) if missing else None
+            window.flagged = flagged
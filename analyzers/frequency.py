@@ -1,9 +1,14 @@
 """高频访问分析器"""
-from collections import defaultdict
+from collections import deque
 from datetime import datetime, timedelta, timezone
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional, Any, Tuple
 
-from .base import BaseAnalyzer, ThreatInfo
+from . import columnar
+from .base import (
+    BaseAnalyzer, ThreatInfo, to_epoch, from_epoch, to_epoch_microseconds, from_epoch_microseconds, group_by_ip
+)
+from .state import IPStateTable
+from .sketch import SlidingCountMinSketch
 from utils.log_parser import LogEntry
 
 
@@ -30,23 +35,269 @@ def _utc_now() -> datetime:
     return datetime.now(timezone.utc).replace(tzinfo=None)
 
 
+# 时间桶粒度（秒）：秒、分钟、小时
+BUCKET_RESOLUTIONS = (1, 60, 3600)
+
+# 每条规则的窗口至少划分的桶数；粒度取满足该条件的最粗一级，
+# 窗口边界按整桶计算，统计窗口最多比配置短一个桶（不超过1/10），只会少算不会多算
+MIN_BUCKETS_PER_WINDOW = 10
+
+
+class FrequencyRule:
+    """高频访问规则：window_seconds秒内超过max_requests次请求"""
+    __slots__ = ('window_seconds', 'max_requests', 'score', 'resolution', 'span')
+
+    def __init__(self, window_seconds: int, max_requests: int, score: int):
+        self.window_seconds = int(window_seconds)
+        self.max_requests = max_requests
+        self.score = score
+        self.resolution = next(
+            (g for g in reversed(BUCKET_RESOLUTIONS) if self.window_seconds // g >= MIN_BUCKETS_PER_WINDOW),
+            BUCKET_RESOLUTIONS[0]
+        )
+        # 窗口包含的桶数
+        self.span = max(1, self.window_seconds // self.resolution)
+
+    @property
+    def key(self) -> str:
+        """规则标识（用于保存已报告状态）"""
+        return f"{self.window_seconds}:{self.max_requests}"
+
+
+def parse_frequency_rules(config: Dict) -> List[FrequencyRule]:
+    """
+    解析高频访问规则
+
+    thresholds.frequency 可以是单条规则（旧格式）或规则列表：
+        frequency: {window_seconds: 300, max_requests: 100}
+        frequency:
+          - {window_seconds: 300, max_requests: 100}
+          - {window_seconds: 86400, max_requests: 5000, score: 3}
+    未指定 score 时使用 threat_scores.frequency_violation。
+    """
+    default_score = config.get('threat_scores', {}).get('frequency_violation', 3)
+    thresholds = config.get('thresholds', {}).get('frequency', {})
+    if isinstance(thresholds, dict):
+        thresholds = [thresholds]
+
+    rules = [
+        FrequencyRule(
+            item.get('window_seconds', 60),
+            item.get('max_requests', 100),
+            item.get('score', default_score)
+        )
+        for item in thresholds or [{}]
+    ]
+    rules.sort(key=lambda rule: rule.window_seconds)
+    return rules
+
+
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+
+def _epoch_seconds(dt: datetime) -> int:
+    """UTC时间转换为整秒时间戳"""
+    return (dt - _EPOCH) // _SECOND
+
+
+def _bucket_add(buckets: deque, bucket_id: int, count: int):
+    """向按编号排序的桶队列中计数"""
+    if buckets and buckets[-1][0] == bucket_id:
+        buckets[-1][1] += count
+    elif not buckets or bucket_id > buckets[-1][0]:
+        buckets.append([bucket_id, count])
+    else:
+        # 乱序的旧日志
+        for i in range(len(buckets) - 1, -1, -1):
+            if buckets[i][0] == bucket_id:
+                buckets[i][1] += count
+                return
+            if buckets[i][0] < bucket_id:
+                buckets.insert(i + 1, [bucket_id, count])
+                return
+        buckets.appendleft([bucket_id, count])
+
+
+class _AccessWindow:
+    """
+    IP的多粒度访问计数
+
+    每种粒度一个按时间排序的桶队列 [[桶编号, 次数], ...]，只保留该粒度上
+    最长规则窗口内的桶，同时维护队列总数；所有规则共用这一份状态。
+    """
+    __slots__ = ('levels', 'totals', 'flagged')
+
+    def __init__(self):
+        # {粒度: deque([[桶编号, 次数], ...])}
+        self.levels: Dict[int, deque] = {}
+        # {粒度: 队列内总次数}
+        self.totals: Dict[int, int] = {}
+        # 已报告的规则（按规则序号的位掩码，避免重复报告）
+        self.flagged = 0
+
+    def add(self, timestamp: int, count: int, level_spans: Dict[int, int]):
+        """记录访问并丢弃各粒度窗口外的桶"""
+        for resolution, span in level_spans.items():
+            bucket_id = timestamp // resolution
+            buckets = self.levels.get(resolution)
+            if buckets is None:
+                buckets = self.levels[resolution] = deque()
+                self.totals[resolution] = 0
+            elif buckets:
+                newest = buckets[-1]
+                if newest[0] == bucket_id:
+                    # 最常见的情况：计入最新的桶，窗口没有移动
+                    newest[1] += count
+                    self.totals[resolution] += count
+                    continue
+                if bucket_id <= newest[0] - span:
+                    # 乱序的旧日志已在窗口外
+                    continue
+            _bucket_add(buckets, bucket_id, count)
+            self.totals[resolution] += count
+            self.expire_level(resolution, buckets[-1][0] - span)
+
+    def expire_level(self, resolution: int, oldest_excluded: int):
+        """丢弃编号不大于 oldest_excluded 的桶"""
+        buckets = self.levels[resolution]
+        while buckets and buckets[0][0] <= oldest_excluded:
+            self.totals[resolution] -= buckets.popleft()[1]
+
+    def count(self, rule: FrequencyRule, timestamp: int, level_span: int) -> int:
+        """规则窗口内（截至timestamp）的访问次数"""
+        resolution = rule.resolution
+        if rule.span == level_span:
+            return self.totals.get(resolution, 0)
+        # 同一粒度上较短的窗口从最新的桶往前累加
+        cutoff = timestamp // resolution - rule.span
+        total = 0
+        for bucket_id, count in reversed(self.levels.get(resolution, ())):
+            if bucket_id <= cutoff:
+                break
+            total += count
+        return total
+
+    def count_after(self, resolution: int, oldest_excluded: int) -> int:
+        """某粒度编号大于 oldest_excluded 的桶内次数（从离界限较近的一端累加）"""
+        buckets = self.levels.get(resolution)
+        if not buckets:
+            return 0
+        if oldest_excluded - buckets[0][0] < buckets[-1][0] - oldest_excluded:
+            total = self.totals[resolution]
+            for bucket_id, count in buckets:
+                if bucket_id > oldest_excluded:
+                    break
+                total -= count
+            return total
+        total = 0
+        for bucket_id, count in reversed(buckets):
+            if bucket_id <= oldest_excluded:
+                break
+            total += count
+        return total
+
+    def size(self) -> int:
+        """最大粒度窗口内的访问次数"""
+        return max(self.totals.values(), default=0)
+
+    def bucket_count(self) -> int:
+        """桶数量（用于估算内存）"""
+        return sum(len(buckets) for buckets in self.levels.values())
+
+    def extend_level(self, resolution: int, span: int, items: Iterable[Tuple[int, int]]):
+        """
+        按顺序追加一批桶并丢弃窗口外的桶（与逐条 add 的结果相同）
+
+        Args:
+            resolution: 粒度
+            span: 该粒度保留的桶数
+            items: [(桶编号, 次数), ...]，编号递增且不小于已有的最新桶
+        """
+        buckets = self.levels.get(resolution)
+        if buckets is None:
+            buckets = self.levels[resolution] = deque()
+            total = 0
+        else:
+            total = self.totals[resolution]
+        for bucket_id, count in items:
+            if buckets and buckets[-1][0] == bucket_id:
+                buckets[-1][1] += count
+            else:
+                buckets.append([bucket_id, count])
+            total += count
+        if buckets:
+            oldest_excluded = buckets[-1][0] - span
+            while buckets[0][0] <= oldest_excluded:
+                total -= buckets.popleft()[1]
+        self.totals[resolution] = total
+
+    def merge_level(self, resolution: int, span: int, items: List[Tuple[int, int]]):
+        """
+        并入一批任意顺序的桶（与逐条 add 的结果相同：只保留最新桶往前 span 个桶内的桶）
+
+        Args:
+            resolution: 粒度
+            span: 该粒度保留的桶数
+            items: [(桶编号, 次数), ...]
+        """
+        merged: Dict[int, int] = {}
+        for bucket_id, count in self.levels.get(resolution, ()):
+            merged[bucket_id] = count
+        for bucket_id, count in items:
+            merged[bucket_id] = merged.get(bucket_id, 0) + count
+        oldest_excluded = max(merged) - span
+        buckets = deque([bucket_id, count] for bucket_id, count in sorted(merged.items())
+                        if bucket_id > oldest_excluded)
+        self.levels[resolution] = buckets
+        self.totals[resolution] = sum(count for _, count in buckets)
+
+
 class FrequencyAnalyzer(BaseAnalyzer):
-    """高频访问分析器 - 检测短时间内大量请求"""
+    """高频访问分析器 - 检测短时间内大量请求，也可同时检测长时间窗口内的低速慢扫"""
+
+    # 只统计访问日志；WAF拦截记录和SSH登录不计入访问频率
+    sources = ('nginx',)
+    fields = ('ip', 'timestamp')
 
-    def __init__(self, config: Dict = None):
-        super().__init__(config)
+    def __init__(self, config: Dict = None, state_table: IPStateTable = None):
+        super().__init__(config, state_table)
 
-        thresholds = self.config.get('thresholds', {}).get('frequency', {})
-        self.window_seconds = thresholds.get('window_seconds', 60)
-        self.max_requests = thresholds.get('max_requests', 100)
+        self.rules = parse_frequency_rules(self.config)
+        # 各粒度需要保留的桶数（该粒度上最长的规则窗口）
+        self._level_spans: Dict[int, int] = {}
+        for rule in self.rules:
+            self._level_spans[rule.resolution] = max(self._level_spans.get(rule.resolution, 0), rule.span)
 
-        scores = self.config.get('threat_scores', {})
-        self.threat_score = scores.get('frequency_violation', 3)
+        # 兼容单规则的属性（取最短窗口的规则）
+        self.window_seconds = self.rules[0].window_seconds
+        self.max_requests = self.rules[0].max_requests
+        self.threat_score = self.rules[0].score
 
-        # IP访问时间记录 {ip: [timestamp1, timestamp2, ...]}
-        self._access_times: Dict[str, List[datetime]] = defaultdict(list)
-        # 已标记的IP（避免重复报告）
-        self._flagged_ips: set = set()
+        self._expire_latest: Optional[datetime] = None
+        self._expire_timestamp = 0
+
+        # IP访问计数保存在共享状态表中
+        self.state_table.register(self.name, self._expire, lambda window: window.bucket_count())
+
+        # 近似模式：所有IP只计入固定内存的 Count-Min Sketch（每条规则一个），
+        # 任一规则的估计值接近阈值的IP才提升为精确跟踪（最多 top_k 个）
+        sketch_config = self.config.get('frequency_sketch', {})
+        self.sketches: List[SlidingCountMinSketch] = []
+        if sketch_config.get('enabled', False):
+            promote_ratio = sketch_config.get('promote_ratio', 0.5)
+            for rule in self.rules:
+                self.sketches.append(SlidingCountMinSketch(
+                    rule.window_seconds,
+                    width=sketch_config.get('width', 131072),
+                    depth=sketch_config.get('depth', 4),
+                    slices=sketch_config.get('slices', 6)
+                ))
+            self.promote_thresholds = [max(1, int(rule.max_requests * promote_ratio)) for rule in self.rules]
+            self.top_k = sketch_config.get('top_k', 2000)
+            # 精确跟踪中的IP {ip: 提升时的估计值}
+            self._promoted: Dict[str, int] = {}
+            self.promotions = 0
 
     @property
     def name(self) -> str:
@@ -59,48 +310,362 @@ class FrequencyAnalyzer(BaseAnalyzer):
 
         ip = entry.ip
         now = _to_utc(entry.timestamp)
+        timestamp = _epoch_seconds(now)
+        # 降载采样保留的记录代表 weight 次请求
+        weight = entry.extra.get('weight', 1)
 
         # 添加访问记录
-        self._access_times[ip].append(now)
-
-        # 清理过期记录
-        cutoff = now - timedelta(seconds=self.window_seconds)
-        self._access_times[ip] = [
-            t for t in self._access_times[ip] if t > cutoff
-        ]
-
-        # 检查频率
-        request_count = len(self._access_times[ip])
-
-        if request_count > self.max_requests:
-            # 只在首次超过阈值时报告
-            if ip not in self._flagged_ips:
-                self._flagged_ips.add(ip)
-                reason = f"高频访问({request_count}次/{self.window_seconds}秒)"
-                return self._add_threat(ip, reason, self.threat_score, entry)
+        if self.sketches:
+            window = self._sketch_track(ip, timestamp, now, weight)
+            if window is None:
+                # 估计值远低于阈值，不做精确跟踪
+                self._observe(now)
+                return None
+        else:
+            window = self.state_table.touch(ip, self.name, _AccessWindow, now)
+            window.add(timestamp, weight, self._level_spans)
+        self._observe(now)
+        return self._check_rules(ip, window, timestamp, now, entry)
+
+    def analyze_batch(self, entries: List[LogEntry]) -> List[ThreatInfo]:
+        """
+        批量分析访问频率：按IP分组，每个IP只取一次状态，组内按原顺序计数和检查规则
+
+        已安装 NumPy 时走向量化实现，本批乱序且记录过多的IP仍走Python实现。
+        近似模式的Sketch分片按全局时间滚动，仍逐条处理。
+        """
+        if self.sketches:
+            return super().analyze_batch(entries)
+
+        found = []
+        level_spans = self._level_spans
+        latest = None
+        with self.state_table.deferred_sweep():
+            if self.columnar and len(entries) >= columnar.MIN_ROWS:
+                found, entries = self._analyze_columnar(entries)
+
+            for ip, group in group_by_ip(entries).items():
+                timed = [(entry, _to_utc(entry.timestamp)) for entry in group if entry.timestamp]
+                if not timed:
+                    continue
+                newest = max(now for _, now in timed)
+                if latest is None or newest > latest:
+                    latest = newest
+                window = self.state_table.touch(ip, self.name, _AccessWindow, newest)
+
+                threat = None
+                for entry, now in timed:
+                    timestamp = _epoch_seconds(now)
+                    window.add(timestamp, entry.extra.get('weight', 1), level_spans)
+                    threat = self._check_rules(ip, window, timestamp, now, entry) or threat
+                if threat:
+                    found.append(threat)
+
+        if latest is not None:
+            self._observe(latest)
+        return found
+
+    def _analyze_columnar(self, entries: List[LogEntry]) -> Tuple[List[ThreatInfo], List[LogEntry]]:
+        """
+        向量化批量分析：本批记录按IP排成列，一次求出每条记录在各规则窗口内的次数
+
+        与逐条分析相同，各粒度按该IP已见过的最新桶丢弃旧桶，记录 r 在规则窗口内的次数为
+        位置不晚于 r、桶编号大于 max(r 的桶 - 规则桶数, 最新桶 - 粒度保留桶数) 的次数。
+        本批内的部分用 searchsorted 求出，乱序的记录单独补上；
+        已有桶的部分：已有总数加上本批次数是上界，只有上界超过阈值的记录才从已有桶中统计。
+        本批乱序且记录过多的IP、以及有降载采样权重记录的IP原样返回交给Python实现。
+
+        Returns:
+            (报告的威胁, 未处理的记录)
+        """
+        np = columnar.np
+        level_spans = self._level_spans
+        entries = [entry for entry in entries if entry.ip and entry.timestamp]
+        keys, order, bounds = columnar.group_rows([entry.ip for entry in entries])
+        if len(keys) * columnar.MIN_ROWS_PER_KEY > len(entries):
+            return [], entries
+        times = [_to_utc(entry.timestamp) for entry in entries]
+        groups = np.repeat(np.arange(len(keys)), np.diff(bounds))
+        micros = columnar.as_stamps(times, to_epoch_microseconds)[order]
+        stamps = micros // 1000000
+
+        disordered = np.zeros(len(keys), dtype=bool)
+        disordered[groups[1:][(groups[1:] == groups[:-1]) & (stamps[1:] < stamps[:-1])]] = True
+        good = ~disordered | (np.diff(bounds) <= columnar.MAX_DISORDERED_ROWS)
+        weighted = [row for row, entry in enumerate(entries) if 'weight' in entry.extra]
+        if weighted:
+            row_groups = np.empty(len(entries), dtype=np.int64)
+            row_groups[order] = groups
+            good[row_groups[weighted]] = False
+        selected = good[groups]
+        rest = [entries[i] for i in np.sort(order[~selected]).tolist()]
+        # 同一秒内的记录可能乱序，最新时间按微秒取
+        last_micros = columnar.group_cummax(groups, micros)[bounds[1:] - 1]
+        groups, stamps, rows = groups[selected], stamps[selected], order[selected]
+        if not len(rows):
+            return [], rest
+
+        present = np.flatnonzero(good)
+        starts = np.searchsorted(groups, present)
+        ends = np.searchsorted(groups, present, side='right')
+        row_list = rows.tolist()
+        windows: Dict[int, _AccessWindow] = {}
+        prior_newest = {resolution: [columnar.NO_TIME] * len(keys) for resolution in level_spans}
+        prior_totals = {resolution: [0] * len(keys) for resolution in level_spans}
+        latest = None
+        # 按IP首次出现的顺序取状态（包括交给Python实现的IP），状态表中的顺序与逐条分析一致
+        for group_id, (stamp, vectorized) in enumerate(zip(last_micros.tolist(), good.tolist())):
+            newest = from_epoch_microseconds(stamp)
+            window = self.state_table.touch(keys[group_id], self.name, _AccessWindow, newest)
+            if vectorized:
+                windows[group_id] = window
+                if latest is None or newest > latest:
+                    latest = newest
+                # 各粒度已有的最新桶和总数
+                for resolution, buckets in window.levels.items():
+                    if buckets and resolution in level_spans:
+                        prior_newest[resolution][group_id] = buckets[-1][0]
+                        prior_totals[resolution][group_id] = window.totals[resolution]
+        columns = {}
+        for resolution in level_spans:
+            buckets = stamps // resolution
+            newest = np.maximum(
+                columnar.group_cummax(groups, buckets), columnar.as_array(prior_newest[resolution])[groups]
+            )
+            columns[resolution] = (buckets, newest, columnar.as_array(prior_totals[resolution])[groups])
+
+        # 每条规则：窗口内的次数，超过阈值的规则位
+        rule_counts = []
+        exceeded = np.zeros(len(rows), dtype=np.int64)
+        for n, rule in enumerate(self.rules):
+            buckets, newest, totals = columns[rule.resolution]
+            lower = np.maximum(buckets - rule.span, newest - level_spans[rule.resolution])
+            counts = columnar.window_counts(groups, buckets, lower)
+            maybe = np.flatnonzero(counts + totals > rule.max_requests)
+            if len(maybe):
+                # 下界相同的同组记录共用已有桶的计数
+                pairs, inverse = columnar.unique_pairs(groups[maybe], lower[maybe])
+                counts[maybe] += columnar.as_array([
+                    windows[group_id].count_after(rule.resolution, oldest_excluded)
+                    for group_id, oldest_excluded in pairs
+                ])[inverse]
+            rule_counts.append(counts)
+            exceeded |= (counts > rule.max_requests).astype(np.int64) << n
+
+        def check(position: int) -> Optional[ThreatInfo]:
+            group_id = int(groups[position])
+            row = row_list[position]
+            return self._check_rules(
+                keys[group_id], windows[group_id], None, times[row], entries[row],
+                tuple(int(counts[position]) for counts in rule_counts)
+            )
+
+        found = self._replay_columnar(
+            keys, groups, exceeded, lambda group_id: windows[group_id].flagged,
+            lambda position: times[row_list[position]], check,
+            lambda position: entries[row_list[position]]
+        )
+
+        # 把本批记录并入各粒度的桶：时间有序且不早于已有最新桶的IP直接追加，其余合并
+        for resolution, span in level_spans.items():
+            buckets = columns[resolution][0]
+            merge = disordered.copy()
+            merge[present] |= buckets[starts] < columnar.as_array(prior_newest[resolution])[present]
+            for group_id in np.flatnonzero(merge & good).tolist():
+                start, end = np.searchsorted(groups, (group_id, group_id + 1)).tolist()
+                windows[group_id].merge_level(resolution, span, [(b, 1) for b in buckets[start:end].tolist()])
+
+            append = ~merge[groups]
+            if not append.any():
+                continue
+            level_groups, buckets = groups[append], buckets[append]
+            heads = np.flatnonzero(np.concatenate((
+                [True], (level_groups[1:] != level_groups[:-1]) | (buckets[1:] != buckets[:-1])
+            )))
+            counts = np.diff(np.append(heads, len(level_groups)))
+            level_groups = level_groups[heads]
+            buckets = buckets[heads]
+            tails = np.flatnonzero(np.append(level_groups[1:] != level_groups[:-1], True))
+            last_bucket = np.zeros(len(keys), dtype=np.int64)
+            last_bucket[level_groups[tails]] = buckets[tails]
+            keep = buckets > last_bucket[level_groups] - span
+            level_groups = level_groups[keep]
+            bucket_list, count_list = buckets[keep].tolist(), counts[keep].tolist()
+            heads = np.flatnonzero(np.concatenate(([True], level_groups[1:] != level_groups[:-1])))
+            for group_id, start, end in zip(
+                    level_groups[heads].tolist(), heads.tolist(), np.append(heads[1:], len(level_groups)).tolist()):
+                windows[group_id].extend_level(resolution, span, zip(bucket_list[start:end], count_list[start:end]))
+
+        self._observe(latest)
+        return found, rest
+
+    def _check_rules(
+        self, ip: str, window: _AccessWindow, timestamp: Optional[int], now: datetime, entry: LogEntry,
+        counts: Tuple[int, ...] = None
+    ) -> Optional[ThreatInfo]:
+        """
+        检查每条规则，每条规则只在首次超过阈值时报告
+
+        counts 为已算好的各规则窗口内次数（向量化实现），未提供时从窗口状态统计
+        """
+        threat = None
+        already_flagged = False
+        for i, rule in enumerate(self.rules):
+            if counts is not None:
+                request_count = counts[i]
+            else:
+                request_count = window.count(rule, timestamp, self._level_spans[rule.resolution])
+            if request_count <= rule.max_requests:
+                continue
+            bit = 1 << i
+            if not window.flagged & bit:
+                window.flagged |= bit
+                reason = f"高频访问({request_count}次/{rule.window_seconds}秒)"
+                threat = self._add_threat(ip, reason, rule.score, entry)
             else:
-                # 已标记的IP只更新最后访问时间
-                if ip in self._threats:
-                    self._threats[ip].hit_count += 1
-                    self._threats[ip].last_seen = now
+                already_flagged = True
 
-        return None
+        if threat is None and already_flagged:
+            # 已标记的IP只更新最后访问时间
+            self._add_hits(ip, entry.extra.get('weight', 1), now, entry)
+
+        return threat
+
+    def _sketch_track(self, ip: str, timestamp: int, now: datetime, weight: int = 1) -> Optional[_AccessWindow]:
+        """
+        近似模式：计入Sketch，返回需要精确跟踪的IP的访问记录
+
+        IP首次提升时用触发提升的规则的Sketch中各分片估计值（记在分片开始时间）补齐窗口内的历史，
+        因此提升不会漏掉提升前的请求；分片开始时间早于实际时间，补齐的记录只会提前过期。
+        """
+        estimates = [sketch.add(ip, timestamp, weight) for sketch in self.sketches]
+
+        if self.state_table.get(ip, self.name) is not None:
+            window = self.state_table.touch(ip, self.name, _AccessWindow, now)
+            window.add(timestamp, weight, self._level_spans)
+            return window
+
+        self._promoted.pop(ip, None)
+        trigger = next(
+            (i for i, estimate in enumerate(estimates) if estimate >= self.promote_thresholds[i]),
+            None
+        )
+        if trigger is None or not self._make_room(estimates[trigger]):
+            return None
+
+        window = self.state_table.touch(ip, self.name, _AccessWindow, now)
+        for start, count in self.sketches[trigger].slice_estimates(ip):
+            window.add(int(start), count, self._level_spans)
+        self._promoted[ip] = estimates[trigger]
+        self.promotions += 1
+        return window
+
+    def _make_room(self, estimate: int) -> bool:
+        """精确跟踪已满时，淘汰访问最少且未标记的IP（仅当其少于新IP的估计值）"""
+        if len(self._promoted) < self.top_k:
+            return True
+
+        # 先移除已被状态表按窗口清理掉的IP
+        for ip in [ip for ip in self._promoted if self.state_table.get(ip, self.name) is None]:
+            del self._promoted[ip]
+        if len(self._promoted) < self.top_k:
+            return True
+
+        victim, victim_count = None, None
+        for ip in self._promoted:
+            window = self.state_table.get(ip, self.name)
+            if window.flagged:
+                continue
+            if victim_count is None or window.size() < victim_count:
+                victim, victim_count = ip, window.size()
+        if victim is None or victim_count >= estimate:
+            return False
+
+        del self._promoted[victim]
+        self.state_table.remove(victim, self.name)
+        return True
+
+    def _expire(self, window: _AccessWindow, latest: datetime) -> bool:
+        """丢弃各粒度窗口外的桶，所有窗口都已清空时丢弃（包括已标记状态）"""
+        if latest != self._expire_latest:
+            # 一次清理中所有IP的 latest 相同，只换算一次
+            self._expire_latest = latest
+            self._expire_timestamp = _epoch_seconds(latest)
+        timestamp = self._expire_timestamp
+        for resolution, span in self._level_spans.items():
+            if resolution in window.levels:
+                window.expire_level(resolution, timestamp // resolution - span)
+        return window.size() > 0
 
     def clear(self):
         """清除记录"""
         super().clear()
-        self._access_times.clear()
-        self._flagged_ips.clear()
+        self.state_table.discard(self.name)
+        for sketch in self.sketches:
+            sketch.clear()
+        if self.sketches:
+            self._promoted.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """各粒度窗口内的桶和已报告的规则"""
+        buckets = {}
+        flagged = {}
+        if self._latest is not None:
+            timestamp = _epoch_seconds(self._latest)
+            for ip, window in self.state_table.items(self.name):
+                levels = {}
+                for resolution, span in self._level_spans.items():
+                    cutoff = timestamp // resolution - span
+                    live = [[b, c] for b, c in window.levels.get(resolution, ()) if b > cutoff]
+                    if live:
+                        levels[str(resolution)] = live
+                if not levels:
+                    continue
+                buckets[ip] = levels
+                if window.flagged:
+                    flagged[ip] = [rule.key for i, rule in enumerate(self.rules) if window.flagged & (1 << i)]
+        return {
+            'latest': to_epoch(self._latest) if self._latest else None,
+            'buckets': buckets,
+            'flagged': flagged
+        }
+
+    def restore(self, state: Dict[str, Any]):
+        """恢复各粒度的桶和已报告的规则"""
+        if state.get('latest') is not None:
+            self._observe(from_epoch(state['latest']))
+        rule_bits = {rule.key: 1 << i for i, rule in enumerate(self.rules)}
+
+        for ip, levels in state.get('buckets', {}).items():
+            window = self.state_table.touch(ip, self.name, _AccessWindow, self._latest)
+            for resolution, items in levels.items():
+                resolution = int(resolution)
+                if resolution not in self._level_spans:
+                    continue
+                for bucket_id, count in items:
+                    _bucket_add(window.levels.setdefault(resolution, deque()), bucket_id, count)
+                    window.totals[resolution] = window.totals.get(resolution, 0) + count
+            for key in state.get('flagged', {}).get(ip, []):
+                window.flagged |= rule_bits.get(key, 0)
+            if self.sketches:
+                self._promoted[ip] = window.size()
 
     def get_ip_request_count(self, ip: str, window_seconds: int = None) -> int:
         """获取IP在时间窗口内的请求数"""
-        if ip not in self._access_times:
+        window = self.state_table.get(ip, self.name)
+        if window is None:
             return 0
 
         if window_seconds is None:
             window_seconds = self.window_seconds
 
-        now = _utc_now()
-        cutoff = now - timedelta(seconds=window_seconds)
-
-        return len([t for t in self._access_times[ip] if t > cutoff])
+        # 使用能覆盖该窗口的最细粒度
+        resolutions = sorted(window.levels)
+        if not resolutions:
+            return 0
+        resolution = next(
+            (g for g in resolutions if self._level_spans[g] * g >= window_seconds),
+            resolutions[-1]
+        )
+        cutoff = (_epoch_seconds(_utc_now()) - window_seconds) // resolution
+        return sum(c for b, c in window.levels[resolution] if b > cutoff)
@@ -1,20 +1,148 @@
 """恶意模式分析器"""
 import os
 import re
-from collections import defaultdict
-from typing import Dict, List, Optional, Set
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Any, Tuple
 
 import yaml
 
-from .base import BaseAnalyzer, ThreatInfo
+from .base import BaseAnalyzer, ThreatInfo, to_epoch, from_epoch
+from .state import IPStateTable
 from utils.log_parser import LogEntry
 
 
+# 注入类检查：(规则属性, 原因, 是否匹配请求路径, 是否匹配原始日志)，按顺序检查
+_INJECTION_CHECKS = (
+    ('sqli_patterns', 'SQL注入特征', True, True),
+    ('xss_patterns', 'XSS攻击特征', True, True),
+    ('traversal_patterns', '路径遍历攻击', True, False),
+    ('cmd_patterns', '命令注入特征', True, True),
+    ('lfi_patterns', '文件包含攻击', True, True),
+    ('ssrf_patterns', 'SSRF攻击特征', True, True),
+    ('xxe_patterns', 'XXE攻击特征', False, True),
+    ('ssti_patterns', '模板注入特征', True, True),
+    ('java_deser_patterns', 'Java反序列化攻击', False, True),
+)
+
+# 合并后语义会改变的写法：反向引用、全局内联标志
+_UNSAFE_TO_COMBINE = re.compile(r'\\[1-9]|\(\?P=|\(\?[aiLmsux]+\)')
+
+# 正则元字符（不含这些字符的规则按普通字符串处理）
+_REGEX_METACHARS = set('.^$*+?{}[]|()')
+
+
+def _literal_text(pattern: str) -> Optional[str]:
+    """规则是纯文本（只含转义的普通字符）时返回对应的字符串，否则返回None"""
+    chars = []
+    escaped = False
+    for ch in pattern:
+        if escaped:
+            if ch.isalnum():
+                # \d、\b 等特殊序列
+                return None
+            chars.append(ch)
+            escaped = False
+        elif ch == '\\':
+            escaped = True
+        elif ch in _REGEX_METACHARS:
+            return None
+        else:
+            chars.append(ch)
+    if escaped or not chars:
+        return None
+    return ''.join(chars)
+
+
+def _trie_pattern(words: List[str]) -> str:
+    """
+    把一组字符串编译为前缀树形式的正则
+
+    共同前缀只匹配一次，比逐条匹配或简单的分支正则快得多（re 会逐个尝试每个分支）。
+    """
+    trie: Dict[str, dict] = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            # 较短的字符串在此结束，后续部分可选
+            body = '(?:' + body + ')?'
+        return body
+
+    return build(trie)
+
+
+class _RuleSet:
+    """
+    同一类规则
+
+    同类规则只关心是否有任意一条命中，能安全合并时编译为一个正则一次扫描：
+    纯文本规则合并为前缀树，其余规则作为分支；含反向引用等不能合并的规则仍逐条匹配。
+    """
+    __slots__ = ('patterns', 'combined')
+
+    def __init__(self, patterns: List[re.Pattern]):
+        self.patterns = patterns
+        self.combined = None
+        if patterns and not any(_UNSAFE_TO_COMBINE.search(p.pattern) for p in patterns):
+            literals = set()
+            branches = []
+            for p in patterns:
+                text = _literal_text(p.pattern)
+                if text is not None:
+                    literals.add(text.lower())
+                else:
+                    branches.append(f'(?:{p.pattern})')
+            if literals:
+                branches.insert(0, _trie_pattern(sorted(literals)))
+            try:
+                self.combined = re.compile('|'.join(branches), re.IGNORECASE)
+            except (re.error, RecursionError, OverflowError):
+                self.combined = None
+
+    def search(self, text: str) -> bool:
+        """是否有任意一条规则命中"""
+        if self.combined is not None:
+            return self.combined.search(text) is not None
+        return any(p.search(text) for p in self.patterns)
+
+    def first(self, text: str) -> Optional[re.Pattern]:
+        """按规则顺序返回第一条命中的规则"""
+        if self.combined is not None and self.combined.search(text) is None:
+            return None
+        for p in self.patterns:
+            if p.search(text):
+                return p
+        return None
+
+
+class _PatternState:
+    """IP的敏感路径计数和已标记原因"""
+    __slots__ = ('sensitive_hits', 'reasons', 'active')
+
+    def __init__(self):
+        self.sensitive_hits = 0
+        self.reasons: Set[str] = set()
+        # 最近一次计数变化的日志时间
+        self.active: Optional[datetime] = None
+
+
 class PatternAnalyzer(BaseAnalyzer):
     """恶意模式分析器 - 检测敏感路径、恶意UA、SQL注入等"""
 
-    def __init__(self, config: Dict = None, rules_file: str = None):
-        super().__init__(config)
+    # SSH登录失败由 SSHBruteforceAnalyzer 按时间窗口判定
+    sources = ('nginx', 'waf', 'free_waf')
+    fields = ('ip',)
+
+    def __init__(self, config: Dict = None, rules_file: str = None, state_table: IPStateTable = None):
+        super().__init__(config, state_table)
 
         # 加载规则
         if rules_file is None:
@@ -33,15 +161,12 @@ class PatternAnalyzer(BaseAnalyzer):
         self.malicious_ua_score = scores.get('malicious_ua', 4)
         self.sql_injection_score = scores.get('sql_injection', 5)
         self.waf_block_score = scores.get('waf_block', 5)
-        self.ssh_bruteforce_score = scores.get('ssh_bruteforce', 5)
 
         # 编译正则
         self._compile_patterns()
 
-        # IP敏感路径计数
-        self._sensitive_hits: Dict[str, int] = defaultdict(int)
-        # 已标记的IP
-        self._flagged_ips: Dict[str, Set[str]] = defaultdict(set)  # {ip: {reason1, reason2}}
+        # IP敏感路径计数和已标记原因保存在共享状态表中
+        self.state_table.register(self.name, self._expire)
 
     def _load_rules(self, rules_file: str) -> Dict:
         """加载规则文件"""
@@ -156,6 +281,14 @@ class PatternAnalyzer(BaseAnalyzer):
             except re.error:
                 pass
 
+        # 合并的规则集
+        self._sensitive_rules = _RuleSet(self.sensitive_path_patterns)
+        self._ua_rules = _RuleSet(self.malicious_ua_patterns)
+        self._injection_rules = [
+            (_RuleSet(getattr(self, attr)), reason, on_path, on_raw)
+            for attr, reason, on_path, on_raw in _INJECTION_CHECKS
+        ]
+
     @property
     def name(self) -> str:
         return 'pattern'
@@ -164,9 +297,46 @@ class PatternAnalyzer(BaseAnalyzer):
         """分析恶意模式"""
         if not entry.ip:
             return None
-
+        return self._analyze_entry(entry)
+
+    def analyze_batch(self, entries: List[LogEntry]) -> List[ThreatInfo]:
+        """
+        批量分析恶意模式
+
+        同一批内重复的请求路径（静态资源、热门页面）只对路径匹配一次规则，
+        原始日志每条不同，仍逐条匹配。
+        """
+        found: Dict[str, ThreatInfo] = {}
+        path_cache: Dict[str, Tuple[bool, ...]] = {}
+        with self.state_table.deferred_sweep():
+            for entry in entries:
+                if not entry.ip:
+                    continue
+                threat = self._analyze_entry(entry, path_cache)
+                if threat:
+                    found[threat.ip] = threat
+        return list(found.values())
+
+    def screen(self, entry: LogEntry) -> bool:
+        """是否命中敏感路径或恶意UA规则（静态资源请求在恶意模式分析中只做这两项检查）"""
+        if entry.path and self._sensitive_rules.search(entry.path.lower()):
+            return True
+        return bool(entry.user_agent) and self._ua_rules.search(entry.user_agent)
+
+    def _match_path(self, path: str) -> Tuple[bool, ...]:
+        """请求路径（已转小写）的匹配结果：(敏感路径, 各注入类检查...)"""
+        return (self._sensitive_rules.search(path),) + tuple(
+            on_path and rules.search(path)
+            for rules, _, on_path, _ in self._injection_rules
+        )
+
+    def _analyze_entry(
+        self, entry: LogEntry, path_cache: Dict[str, Tuple[bool, ...]] = None
+    ) -> Optional[ThreatInfo]:
+        """分析单条记录（path_cache 缓存同一批内请求路径的匹配结果）"""
         ip = entry.ip
         threat = None
+        self._observe(entry.timestamp)
 
         # WAF拦截记录标记为威胁（付费版WAF准确度更高）
         if entry.source == 'waf':
@@ -185,117 +355,44 @@ class PatternAnalyzer(BaseAnalyzer):
                 reason += f"({rule_type})"
             threat = self._add_threat_if_new(ip, reason, reduced_score, entry)
 
-        # SSH暴力破解
-        if entry.source == 'ssh' and entry.extra.get('failed'):
-            reason = 'SSH登录失败'
-            # SSH分析器会单独处理阈值，这里只记录
-            threat = self._add_threat_if_new(ip, reason, self.ssh_bruteforce_score, entry)
-
         # 检查请求路径
         if entry.path:
             path = entry.path.lower()
+            if entry.extra.get('static'):
+                # 引擎预分类的静态资源请求只检查敏感路径，跳过注入类规则
+                matches = (self._sensitive_rules.search(path),)
+            elif path_cache is None:
+                matches = self._match_path(path)
+            else:
+                matches = path_cache.get(path)
+                if matches is None:
+                    matches = path_cache[path] = self._match_path(path)
 
             # 敏感路径
-            for pattern in self.sensitive_path_patterns:
-                if pattern.search(path):
-                    self._sensitive_hits[ip] += 1
-                    if self._sensitive_hits[ip] >= self.max_sensitive_hits:
-                        reason = '敏感路径扫描'
-                        t = self._add_threat_if_new(ip, reason, self.sensitive_path_score, entry)
-                        if t:
-                            threat = t
-                    break
-
-            # SQL注入
-            for pattern in self.sqli_patterns:
-                if pattern.search(path) or pattern.search(entry.raw):
-                    reason = 'SQL注入特征'
-                    t = self._add_threat_if_new(ip, reason, self.sql_injection_score, entry)
-                    if t:
-                        threat = t
-                    break
-
-            # XSS
-            for pattern in self.xss_patterns:
-                if pattern.search(path) or pattern.search(entry.raw):
-                    reason = 'XSS攻击特征'
-                    t = self._add_threat_if_new(ip, reason, self.sql_injection_score, entry)
-                    if t:
-                        threat = t
-                    break
-
-            # 路径遍历
-            for pattern in self.traversal_patterns:
-                if pattern.search(path):
-                    reason = '路径遍历攻击'
-                    t = self._add_threat_if_new(ip, reason, self.sql_injection_score, entry)
-                    if t:
-                        threat = t
-                    break
-
-            # 命令注入
-            for pattern in self.cmd_patterns:
-                if pattern.search(path) or pattern.search(entry.raw):
-                    reason = '命令注入特征'
-                    t = self._add_threat_if_new(ip, reason, self.sql_injection_score, entry)
-                    if t:
-                        threat = t
-                    break
-
-            # 文件包含 (LFI/RFI)
-            for pattern in self.lfi_patterns:
-                if pattern.search(path) or pattern.search(entry.raw):
-                    reason = '文件包含攻击'
-                    t = self._add_threat_if_new(ip, reason, self.sql_injection_score, entry)
-                    if t:
-                        threat = t
-                    break
-
-            # SSRF
-            for pattern in self.ssrf_patterns:
-                if pattern.search(path) or pattern.search(entry.raw):
-                    reason = 'SSRF攻击特征'
-                    t = self._add_threat_if_new(ip, reason, self.sql_injection_score, entry)
-                    if t:
-                        threat = t
-                    break
-
-            # XXE
-            for pattern in self.xxe_patterns:
-                if pattern.search(entry.raw):
-                    reason = 'XXE攻击特征'
-                    t = self._add_threat_if_new(ip, reason, self.sql_injection_score, entry)
-                    if t:
-                        threat = t
-                    break
-
-            # SSTI (模板注入)
-            for pattern in self.ssti_patterns:
-                if pattern.search(path) or pattern.search(entry.raw):
-                    reason = '模板注入特征'
-                    t = self._add_threat_if_new(ip, reason, self.sql_injection_score, entry)
+            if matches[0]:
+                state = self._touch(ip, entry)
+                state.sensitive_hits += 1
+                if state.sensitive_hits >= self.max_sensitive_hits:
+                    reason = '敏感路径扫描'
+                    t = self._add_threat_if_new(ip, reason, self.sensitive_path_score, entry)
                     if t:
                         threat = t
-                    break
 
-            # Java反序列化
-            for pattern in self.java_deser_patterns:
-                if pattern.search(entry.raw):
-                    reason = 'Java反序列化攻击'
+            # SQL注入、XSS、路径遍历、命令注入、文件包含、SSRF、XXE、模板注入、Java反序列化
+            for (rules, reason, _, on_raw), path_hit in zip(self._injection_rules, matches[1:]):
+                if path_hit or (on_raw and rules.search(entry.raw)):
                     t = self._add_threat_if_new(ip, reason, self.sql_injection_score, entry)
                     if t:
                         threat = t
-                    break
 
         # 检查User-Agent
         if entry.user_agent:
-            for pattern in self.malicious_ua_patterns:
-                if pattern.search(entry.user_agent):
-                    reason = f'恶意UA({pattern.pattern})'
-                    t = self._add_threat_if_new(ip, reason, self.malicious_ua_score, entry)
-                    if t:
-                        threat = t
-                    break
+            pattern = self._ua_rules.first(entry.user_agent)
+            if pattern is not None:
+                reason = f'恶意UA({pattern.pattern})'
+                t = self._add_threat_if_new(ip, reason, self.malicious_ua_score, entry)
+                if t:
+                    threat = t
 
         return threat
 
@@ -304,19 +401,80 @@ class PatternAnalyzer(BaseAnalyzer):
     ) -> Optional[ThreatInfo]:
         """添加威胁（如果是新原因）"""
         # 检查是否已为该原因标记过
-        if reason in self._flagged_ips[ip]:
+        state = self._live_state(ip, entry.timestamp)
+        if state is not None and reason in state.reasons:
             # 只更新计数和时间
-            if ip in self._threats:
-                self._threats[ip].hit_count += 1
-                if entry.timestamp:
-                    self._threats[ip].last_seen = entry.timestamp
+            self._add_hits(ip, 1, entry.timestamp, entry, reason)
             return None
 
-        self._flagged_ips[ip].add(reason)
+        state = self._touch(ip, entry)
+        state.reasons.add(reason)
         return self._add_threat(ip, reason, score, entry)
 
+    def _live_state(self, ip: str, timestamp: Optional[datetime]) -> Optional[_PatternState]:
+        """
+        IP的计数状态，距本条记录已超过state_ttl无活动时丢弃并返回None
+
+        按记录自身的时间判断过期，与状态表何时清理无关：
+        逐条、批量和多进程分析（各分片清理时机不同）对同一条记录得到相同的结果
+        """
+        state = self.state_table.get(ip, self.name)
+        if state is not None and timestamp and not self._expire(state, timestamp):
+            self.state_table.remove(ip, self.name)
+            return None
+        return state
+
+    def _touch(self, ip: str, entry: LogEntry) -> _PatternState:
+        """取出IP的计数状态（已过期的重新计数）并记录变化时间"""
+        self._live_state(ip, entry.timestamp)
+        state = self.state_table.touch(ip, self.name, _PatternState, entry.timestamp)
+        if entry.timestamp:
+            state.active = entry.timestamp
+        return state
+
+    def _expire(self, state: _PatternState, latest: datetime) -> bool:
+        """超过state_ttl无活动的IP丢弃（没有时间的计数一直保留）"""
+        if state.active is None:
+            return True
+        return state.active > latest - timedelta(seconds=self.state_ttl)
+
     def clear(self):
         """清除记录"""
         super().clear()
-        self._sensitive_hits.clear()
-        self._flagged_ips.clear()
+        self.state_table.discard(self.name)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """state_ttl内有活动的IP的敏感路径计数和已标记原因"""
+        sensitive_hits = {}
+        flagged = {}
+        last_active = {}
+        for ip, state in self.state_table.items(self.name):
+            if self._latest is not None and not self._expire(state, self._latest):
+                continue
+            if state.sensitive_hits:
+                sensitive_hits[ip] = state.sensitive_hits
+            if state.reasons:
+                flagged[ip] = sorted(state.reasons)
+            if state.active is not None:
+                last_active[ip] = to_epoch(state.active)
+        return {
+            'latest': to_epoch(self._latest) if self._latest else None,
+            'sensitive_hits': sensitive_hits,
+            'flagged': flagged,
+            'last_active': last_active
+        }
+
+    def restore(self, state: Dict[str, Any]):
+        """恢复敏感路径计数和已标记原因"""
+        if state.get('latest') is not None:
+            self._observe(from_epoch(state['latest']))
+        last_active = state.get('last_active', {})
+        ips = set(state.get('sensitive_hits', {})) | set(state.get('flagged', {}))
+        for ip in ips:
+            active = from_epoch(last_active[ip]) if ip in last_active else None
+            ip_state = self.state_table.touch(ip, self.name, _PatternState, active)
+            ip_state.sensitive_hits += state.get('sensitive_hits', {}).get(ip, 0)
+            ip_state.reasons.update(state.get('flagged', {}).get(ip, []))
+            if active and (ip_state.active is None or active > ip_state.active):
+                ip_state.active = active
+
@@ -0,0 +1,100 @@
+"""静态资源预分类"""
+import re
+from typing import Dict, Iterable, List
+
+from utils.log_parser import LogEntry
+
+
+# 默认的静态资源扩展名（不含 .txt：敏感路径规则包含 .txt 文件）
+DEFAULT_SUFFIXES = (
+    '.css', '.js', '.mjs', '.map',
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif', '.svg', '.ico', '.bmp',
+    '.woff', '.woff2', '.ttf', '.otf', '.eot',
+    '.mp4', '.webm', '.mp3', '.ogg',
+)
+
+# 默认的静态资源目录
+DEFAULT_PREFIXES = (
+    '/static/', '/assets/', '/dist/', '/images/', '/img/', '/fonts/',
+    '/wp-content/uploads/', '/wp-includes/css/', '/wp-includes/js/',
+)
+
+# 静态资源路径只含这些字符（编码字符、引号、尖括号等都交给完整的规则检查）
+_SAFE_PATH = re.compile(r'[A-Za-z0-9/._~+-]+')
+
+
+class StaticAssetFilter:
+    """
+    静态资源预分类
+
+    在恶意模式规则匹配之前判断请求是否为普通的静态资源访问：
+    GET/HEAD、状态码在 statuses 中、没有查询串、路径只含普通字符且不含 `..`，
+    并且扩展名在 suffixes 中或路径位于 prefixes 之下（按路径段建立的前缀树）。
+    标记为静态资源的记录仍计入高频访问等统计，恶意模式分析只跳过注入类规则。
+    """
+
+    # 只对访问日志分类（WAF记录本身就是拦截）
+    sources = ('nginx',)
+    methods = ('GET', 'HEAD')
+
+    def __init__(self, config: Dict = None):
+        """
+        Args:
+            config: static_assets 配置 {suffixes, prefixes, statuses}
+        """
+        config = config or {}
+        self.suffixes = frozenset(s.lower() for s in config.get('suffixes', DEFAULT_SUFFIXES))
+        self.statuses = frozenset(config.get('statuses', (200, 304)))
+        self._prefixes: Dict[str, dict] = {}
+        for prefix in config.get('prefixes', DEFAULT_PREFIXES):
+            self._add_prefix(prefix)
+
+    def _add_prefix(self, prefix: str):
+        """把目录前缀按路径段加入前缀树（'' 键表示该目录之下都是静态资源）"""
+        node = self._prefixes
+        for segment in prefix.lower().strip('/').split('/'):
+            if segment:
+                node = node.setdefault(segment, {})
+        node[''] = {}
+
+    def _under_prefix(self, segments: List[str]) -> bool:
+        """路径（按段拆分，不含最后的文件名）是否位于某个静态资源目录之下"""
+        node = self._prefixes
+        for segment in segments:
+            node = node.get(segment)
+            if node is None:
+                return False
+            if '' in node:
+                return True
+        return False
+
+    def is_static(self, entry: LogEntry) -> bool:
+        """是否为普通的静态资源请求"""
+        if entry.source not in self.sources or entry.status not in self.statuses:
+            return False
+        if entry.method not in self.methods:
+            return False
+        path = entry.path
+        if not path or '?' in path or '..' in path or not _SAFE_PATH.fullmatch(path):
+            return False
+
+        path = path.lower()
+        slash = path.rfind('/')
+        dot = path.rfind('.')
+        if dot > slash and path[dot:] in self.suffixes:
+            return True
+        return bool(self._prefixes) and self._under_prefix(path[1:slash].split('/'))
+
+    def tag(self, entries: Iterable[LogEntry]) -> int:
+        """
+        标记一批记录中的静态资源请求（entry.extra['static']）
+
+        Returns:
+            标记的记录数
+        """
+        count = 0
+        for entry in entries:
+            if self.is_static(entry):
+                entry.extra['static'] = True
+                count += 1
+        return count
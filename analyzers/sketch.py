@@ -0,0 +1,213 @@
+"""近似统计的Sketch：滑动时间窗口的 Count-Min Sketch、HyperLogLog 基数估计"""
+import hashlib
+import math
+import operator
+import zlib
+from array import array
+from typing import Iterable, List, Tuple
+
+
+class SlidingCountMinSketch:
+    """
+    按时间分片的 Count-Min Sketch，用固定内存近似统计每个IP在时间窗口内的请求数
+
+    窗口被切成 slices 个分片，每个分片一个 depth x width 的计数矩阵，
+    另维护一个所有存活分片之和的矩阵，查询只需 depth 次查找。
+    保留 slices+1 个分片（覆盖 窗口+1个分片 的时间），因此估计值只会偏大不会偏小。
+
+    误差界（标准 Count-Min 结论）：
+        估计值 <= 真实值 + ε·N 的概率至少为 1-δ
+        其中 ε = e / width，δ = e^(-depth)，N 为窗口内的总请求数
+
+    内存固定为 width * depth * (slices + 2) * 4 字节。
+    """
+
+    def __init__(self, window_seconds: int, width: int = 131072, depth: int = 4, slices: int = 6):
+        self.width = width
+        self.depth = depth
+        self.slices = max(1, slices)
+        self.slice_seconds = max(1.0, window_seconds / self.slices)
+
+        # 每行哈希使用不同的 crc32 初值
+        self._seeds = [(0x9E3779B1 * (i + 1)) & 0xFFFFFFFF for i in range(depth)]
+        # 存活分片 [(分片编号, [行计数数组...])]，按编号从旧到新
+        self._ring: List[Tuple[int, List[array]]] = []
+        # 存活分片之和
+        self._total = [array('I', bytes(4 * width)) for _ in range(depth)]
+        # 存活分片的请求总数（即误差界中的N）
+        self.total_count = 0
+        self._slice_counts: List[int] = []
+
+    @property
+    def epsilon(self) -> float:
+        """单次估计的最大相对误差 ε = e / width"""
+        return math.e / self.width
+
+    @property
+    def delta(self) -> float:
+        """估计值超出误差界的概率 δ = e^(-depth)"""
+        return math.exp(-self.depth)
+
+    @property
+    def memory_bytes(self) -> int:
+        """计数矩阵占用的内存"""
+        return self.width * self.depth * (self.slices + 2) * 4
+
+    def error_bound(self) -> float:
+        """当前窗口内估计值的最大偏差 ε·N（以 1-δ 的概率成立）"""
+        return self.epsilon * self.total_count
+
+    def _indexes(self, key: bytes) -> List[int]:
+        """每行的计数位置"""
+        width = self.width
+        return [zlib.crc32(key, seed) % width for seed in self._seeds]
+
+    def _slice_position(self, slice_id: int) -> int:
+        """获取分片在存活分片中的位置，必要时向前滚动并丢弃窗口外的分片"""
+        ring = self._ring
+        if ring and slice_id <= ring[-1][0]:
+            # 乱序的旧日志写入对应的存活分片，已过期的写入最旧分片（只会高估）
+            for i in range(len(ring) - 1, -1, -1):
+                if ring[i][0] <= slice_id:
+                    return i
+            return 0
+
+        ring.append((slice_id, [array('I', bytes(4 * self.width)) for _ in range(self.depth)]))
+        self._slice_counts.append(0)
+
+        # 保留 slices+1 个分片
+        oldest_alive = slice_id - self.slices
+        while ring[0][0] < oldest_alive:
+            _, expired = ring.pop(0)
+            self.total_count -= self._slice_counts.pop(0)
+            self._total = [
+                array('I', map(operator.sub, total, old))
+                for total, old in zip(self._total, expired)
+            ]
+        return len(ring) - 1
+
+    def add(self, key: str, timestamp: float, count: int = 1) -> int:
+        """
+        记录请求并返回窗口内的估计次数
+
+        Args:
+            key: IP地址
+            timestamp: 日志时间戳（秒）
+            count: 请求次数（采样记录的权重）
+
+        Returns:
+            估计请求数（不小于真实值）
+        """
+        position = self._slice_position(int(timestamp // self.slice_seconds))
+        rows = self._ring[position][1]
+        self._slice_counts[position] += count
+        self.total_count += count
+
+        estimate = None
+        for row, total, index in zip(rows, self._total, self._indexes(key.encode())):
+            row[index] += count
+            value = total[index] + count
+            total[index] = value
+            if estimate is None or value < estimate:
+                estimate = value
+        return estimate
+
+    def estimate(self, key: str) -> int:
+        """窗口内的估计请求数"""
+        return min(total[index] for total, index in zip(self._total, self._indexes(key.encode())))
+
+    def slice_estimates(self, key: str) -> List[Tuple[float, int]]:
+        """
+        各存活分片内的估计请求数
+
+        Returns:
+            [(分片开始时间戳, 估计次数), ...]，只包含估计次数大于0的分片
+        """
+        indexes = self._indexes(key.encode())
+        result = []
+        for slice_id, rows in self._ring:
+            count = min(row[index] for row, index in zip(rows, indexes))
+            if count:
+                result.append((slice_id * self.slice_seconds, count))
+        return result
+
+    def clear(self):
+        """清空计数"""
+        self._ring.clear()
+        self._slice_counts.clear()
+        self._total = [array('I', bytes(4 * self.width)) for _ in range(self.depth)]
+        self.total_count = 0
+
+
+class HyperLogLog:
+    """
+    HyperLogLog 基数估计：用固定内存近似统计不同元素的个数
+
+    元素的64位哈希按前 precision 位分到 m = 2^precision 个寄存器，
+    每个寄存器记录其余位中第一个1出现的最大位置（1字节）。
+    标准误差约 1.04/sqrt(m)，例如 precision=7 时128字节、误差约9%。
+
+    维护 Σ2^-M[j] 和零寄存器个数，寄存器变化时增量更新，估计为O(1)。
+    """
+    __slots__ = ('precision', 'registers', '_inverse_sum', '_zeros')
+
+    def __init__(self, precision: int = 7):
+        self.precision = precision
+        m = 1 << precision
+        self.registers = bytearray(m)
+        self._inverse_sum = float(m)
+        self._zeros = m
+
+    @staticmethod
+    def hash(value: str) -> int:
+        """元素的64位哈希（各进程、重启前后一致，快照可以直接恢复）"""
+        return int.from_bytes(
+            hashlib.blake2b(value.encode('utf-8', 'surrogatepass'), digest_size=8).digest(), 'big'
+        )
+
+    @staticmethod
+    def position(hash_value: int, precision: int) -> Tuple[int, int]:
+        """哈希对应的 (寄存器序号, 第一个1的位置)"""
+        bits = 64 - precision
+        rest = hash_value & ((1 << bits) - 1)
+        return hash_value >> bits, bits - rest.bit_length() + 1
+
+    def update(self, index: int, rank: int) -> bool:
+        """更新寄存器，返回估计值是否可能变化"""
+        old = self.registers[index]
+        if rank <= old:
+            return False
+        self.registers[index] = rank
+        self._inverse_sum += 2.0 ** -rank - 2.0 ** -old
+        if not old:
+            self._zeros -= 1
+        return True
+
+    def add(self, value: str) -> bool:
+        """加入一个元素，返回估计值是否可能变化"""
+        return self.update(*self.position(self.hash(value), self.precision))
+
+    def count(self) -> int:
+        """估计的不同元素个数"""
+        m = len(self.registers)
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / self._inverse_sum
+        if estimate <= 2.5 * m and self._zeros:
+            # 小基数时用线性计数修正
+            estimate = m * math.log(m / self._zeros)
+        return int(round(estimate))
+
+    def pairs(self) -> List[List[int]]:
+        """非零寄存器 [[序号, 值], ...]（快照用，元素少时很紧凑）"""
+        return [[i, r] for i, r in enumerate(self.registers) if r]
+
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[Tuple[int, int]], precision: int) -> 'HyperLogLog':
+        """从非零寄存器恢复"""
+        sketch = cls(precision)
+        for index, rank in pairs:
+            sketch.update(int(index), int(rank))
+        return sketch
@@ -0,0 +1,167 @@
+"""SSH暴力破解分析器"""
+from bisect import insort
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any
+
+from .base import BaseAnalyzer, ThreatInfo, to_epoch, from_epoch
+from .state import IPStateTable
+from utils.log_parser import LogEntry
+
+
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+# 已报告的规则（位）
+_FLAG_FAILURES = 1
+_FLAG_SPRAY = 2
+
+
+def _epoch_seconds(dt: datetime) -> int:
+    """UTC时间转换为整秒时间戳"""
+    return (dt - _EPOCH) // _SECOND
+
+
+class _FailureWindow:
+    """IP最近的SSH登录失败"""
+    __slots__ = ('times', 'users', 'flagged')
+
+    def __init__(self):
+        # 最近 max_failures+1 次失败的时间（整秒时间戳，升序），更早的失败不影响判定
+        self.times: List[int] = []
+        # 用户名 -> 最近一次失败时间（最多保留 max_users+1 个最近失败的用户名）
+        self.users: Dict[str, int] = {}
+        self.flagged = 0
+
+
+class SSHBruteforceAnalyzer(BaseAnalyzer):
+    """
+    SSH暴力破解分析器 - 检测密码爆破和密码喷洒
+
+    按IP统计SSH登录失败：window_seconds 秒内失败超过 max_failures 次判定为暴力破解；
+    spray_window_seconds 秒内失败的不同用户名超过 max_users 个判定为密码喷洒
+    （每个用户名只试少量密码，单个用户名的失败次数不高）。
+    每个IP只保留判定所需的最近几次失败时间和最近失败的用户名，内存与攻击强度无关。
+    只统计每次登录尝试一条的失败消息（extra.failed），Invalid user、认证前断开等消息不重复计数。
+    """
+
+    sources = ('ssh',)
+    fields = ('ip', 'timestamp', 'extra')
+
+    def __init__(self, config: Dict = None, state_table: IPStateTable = None):
+        super().__init__(config, state_table)
+
+        thresholds = self.config.get('thresholds', {}).get('ssh_bruteforce', {})
+        self.window_seconds = thresholds.get('window_seconds', 300)
+        self.max_failures = max(1, thresholds.get('max_failures', 5))
+        self.spray_window_seconds = thresholds.get('spray_window_seconds', 3600)
+        self.max_users = max(1, thresholds.get('max_users', 10))
+
+        scores = self.config.get('threat_scores', {})
+        self.threat_score = scores.get('ssh_bruteforce', 5)
+
+        self.state_table.register(self.name, self._expire, self._records)
+
+    @property
+    def name(self) -> str:
+        return 'ssh_bruteforce'
+
+    def analyze(self, entry: LogEntry) -> Optional[ThreatInfo]:
+        """统计SSH登录失败"""
+        return self._analyze_entry(entry)
+
+    def analyze_batch(self, entries: List[LogEntry]) -> List[ThreatInfo]:
+        """批量统计SSH登录失败"""
+        found: Dict[str, ThreatInfo] = {}
+        with self.state_table.deferred_sweep():
+            for entry in entries:
+                threat = self._analyze_entry(entry)
+                if threat:
+                    found[threat.ip] = threat
+        return list(found.values())
+
+    def _analyze_entry(self, entry: LogEntry) -> Optional[ThreatInfo]:
+        """分析单条记录"""
+        if not entry.ip or not entry.timestamp or not entry.extra.get('failed'):
+            return None
+
+        ip = entry.ip
+        now = entry.timestamp
+        self._observe(now)
+        timestamp = _epoch_seconds(now)
+
+        window = self.state_table.touch(ip, self.name, _FailureWindow, now)
+        threat = None
+
+        # 失败次数：保留最近 max_failures+1 次，最早一次与最近一次的间隔在窗口内即超过阈值
+        times = window.times
+        insort(times, timestamp)
+        if len(times) > self.max_failures + 1:
+            del times[0]
+        if len(times) > self.max_failures and times[-1] - times[0] < self.window_seconds:
+            if not window.flagged & _FLAG_FAILURES:
+                window.flagged |= _FLAG_FAILURES
+                threat = self._add_threat(ip, 'SSH暴力破解', self.threat_score, entry)
+
+        # 不同用户名：丢弃窗口外的用户名，超出上限时丢弃最早失败的用户名
+        user = entry.extra.get('user')
+        if user:
+            users = window.users
+            if users.get(user, timestamp) <= timestamp:
+                users.pop(user, None)
+                users[user] = timestamp
+            cutoff = max(users.values()) - self.spray_window_seconds
+            for name in [name for name, last in users.items() if last <= cutoff]:
+                del users[name]
+            if len(users) > self.max_users + 1:
+                del users[min(users, key=users.get)]
+            if len(users) > self.max_users and not window.flagged & _FLAG_SPRAY:
+                window.flagged |= _FLAG_SPRAY
+                threat = self._add_threat(ip, 'SSH密码喷洒', self.threat_score, entry)
+
+        if threat is None and window.flagged:
+            # 已报告的IP再次失败
+            self._add_hits(ip, 1, now, entry)
+        return threat
+
+    def _last_failure(self, window: _FailureWindow) -> int:
+        """IP最近一次失败的时间"""
+        last = window.times[-1] if window.times else 0
+        if window.users:
+            last = max(last, max(window.users.values()))
+        return last
+
+    def _expire(self, window: _FailureWindow, latest: datetime) -> bool:
+        """两个时间窗口内都没有失败的IP丢弃"""
+        horizon = max(self.window_seconds, self.spray_window_seconds)
+        return self._last_failure(window) + horizon > _epoch_seconds(latest)
+
+    def _records(self, window: _FailureWindow) -> int:
+        """失败时间和用户名的条数（用于估算内存）"""
+        return len(window.times) + len(window.users)
+
+    def clear(self):
+        """清除记录"""
+        super().clear()
+        self.state_table.discard(self.name)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """时间窗口内各IP的最近失败时间、用户名和已报告的规则"""
+        windows = {}
+        if self._latest is not None:
+            for ip, window in self.state_table.items(self.name):
+                if self._expire(window, self._latest):
+                    windows[ip] = [list(window.times), dict(window.users), window.flagged]
+        return {
+            'latest': to_epoch(self._latest) if self._latest else None,
+            'windows': windows
+        }
+
+    def restore(self, state: Dict[str, Any]):
+        """恢复时间窗口内的失败记录"""
+        if state.get('latest') is not None:
+            self._observe(from_epoch(state['latest']))
+        for ip, (times, users, flagged) in state.get('windows', {}).items():
+            window = self.state_table.touch(ip, self.name, _FailureWindow, self._latest)
+            window.times = sorted(times)[-(self.max_failures + 1):]
+            window.users = dict(sorted(users.items(), key=lambda item: item[1])[-(self.max_users + 1):])
+            window.flagged = flagged
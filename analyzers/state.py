@@ -0,0 +1,236 @@
+"""分析器共享的IP状态表"""
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from utils.logger import get_logger
+
+# 内存估算（字节）：每个IP的固定开销（IP字符串、状态对象、字典槽位）
+IP_STATE_BYTES = 360
+# 每个分析器状态的固定开销
+PART_BYTES = 120
+# 每条时间记录（datetime及列表槽位）的开销
+RECORD_BYTES = 64
+
+# 两次清理之间至少间隔的操作次数
+MIN_SWEEP_OPS = 10000
+
+
+class _Registration:
+    """分析器在状态表中注册的过期判断和内存估算"""
+    __slots__ = ('expire', 'records')
+
+    def __init__(self, expire: Callable[[Any, datetime], bool], records: Callable[[Any], int]):
+        self.expire = expire
+        self.records = records
+
+
+class IPState:
+    """单个IP的状态：最近活动时间 + 各分析器各自的状态对象"""
+    __slots__ = ('last_seen', 'parts')
+
+    def __init__(self):
+        self.last_seen: Optional[datetime] = None
+        self.parts: Dict[str, Any] = {}
+
+
+class IPStateTable:
+    """
+    分析器共享的IP状态表
+
+    所有分析器的每IP状态集中在一张表里，按日志时间线清理：
+    每个分析器注册 expire(part, latest) 判断自己的状态是否还在窗口内
+    （可同时裁剪窗口外的记录），不在窗口内的状态才会被丢弃，
+    所有分析器的状态都被丢弃后整个IP从表中移除。
+    因此清理不会改变仍在窗口内的IP的判定结果。
+
+    清理时机：
+    - 距上次清理的操作数达到表大小（均摊O(1)）
+    - 估算内存超过 max_memory_mb
+
+    max_memory_mb 只是建议值，不是硬上限：超出时只会提前清理已离开窗口的状态，
+    窗口内的IP从不淘汰，实际内存可以超过预算（记录警告）。
+    """
+
+    def __init__(self, max_memory_mb: float = 512):
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+        self.logger = get_logger()
+
+        self._states: Dict[str, IPState] = {}
+        self._registrations: Dict[str, _Registration] = {}
+        # 已处理到的最新日志时间
+        self.latest: Optional[datetime] = None
+
+        self._ops = 0
+        self._next_sweep_ops = MIN_SWEEP_OPS
+        # 最近一次清理估算的每IP平均内存，用于在两次清理之间估算总内存
+        self._avg_ip_bytes = IP_STATE_BYTES + PART_BYTES
+        self._budget_ips = max(1, self.max_memory_bytes // self._avg_ip_bytes)
+        self.evicted = 0
+        self._warned_bytes = 0
+        # 暂停清理的层数（批量分析期间）
+        self._deferred = 0
+
+    def register(
+        self,
+        name: str,
+        expire: Callable[[Any, datetime], bool],
+        records: Callable[[Any], int] = None
+    ):
+        """
+        注册分析器
+
+        Args:
+            name: 分析器名称
+            expire: expire(part, latest) 裁剪窗口外的记录，返回状态是否仍需保留
+            records: records(part) 返回状态中的记录条数（用于估算内存）
+        """
+        self._registrations[name] = _Registration(expire, records or (lambda part: 0))
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def __contains__(self, ip: str) -> bool:
+        return ip in self._states
+
+    def get(self, ip: str, name: str) -> Any:
+        """获取IP在某分析器中的状态，不存在时返回None"""
+        state = self._states.get(ip)
+        if state is None:
+            return None
+        return state.parts.get(name)
+
+    def touch(self, ip: str, name: str, factory: Callable[[], Any], timestamp: datetime = None) -> Any:
+        """
+        获取（不存在时创建）IP在某分析器中的状态，并记录活动时间
+
+        Args:
+            ip: IP地址
+            name: 分析器名称
+            factory: 创建新状态的函数
+            timestamp: 日志时间
+
+        Returns:
+            分析器的状态对象
+        """
+        # 在取出状态之前清理，避免刚取出的（可能还是空的）状态被清理掉
+        self._ops += 1
+        if self._ops >= self._next_sweep_ops and not self._deferred:
+            self.sweep()
+
+        state = self._states.get(ip)
+        if state is None:
+            if len(self._states) >= self._budget_ips and not self._deferred:
+                self.sweep()
+            state = IPState()
+            self._states[ip] = state
+
+        part = state.parts.get(name)
+        if part is None:
+            part = factory()
+            state.parts[name] = part
+
+        if timestamp is not None:
+            if state.last_seen is None or timestamp > state.last_seen:
+                state.last_seen = timestamp
+            if self.latest is None or timestamp > self.latest:
+                self.latest = timestamp
+        return part
+
+    @contextmanager
+    def deferred_sweep(self):
+        """
+        暂停清理，退出时补做到期的清理（可嵌套）
+
+        批量分析按IP分组处理，日志时间线不再单调：处理完一个IP后 latest 已推进到批末，
+        此时清理会按批末时间裁掉其他IP处理批内较早记录时仍在窗口内的状态。
+        """
+        self._deferred += 1
+        try:
+            yield self
+        finally:
+            self._deferred -= 1
+            if not self._deferred and (
+                    self._ops >= self._next_sweep_ops or len(self._states) >= self._budget_ips):
+                self.sweep()
+
+    def items(self, name: str) -> Iterator[Tuple[str, Any]]:
+        """遍历某分析器的所有IP状态"""
+        for ip, state in self._states.items():
+            part = state.parts.get(name)
+            if part is not None:
+                yield ip, part
+
+    def remove(self, ip: str, name: str):
+        """移除IP在某分析器中的状态"""
+        state = self._states.get(ip)
+        if state is None:
+            return
+        state.parts.pop(name, None)
+        if not state.parts:
+            del self._states[ip]
+
+    def discard(self, name: str):
+        """清除某分析器的所有状态"""
+        for ip in list(self._states):
+            state = self._states[ip]
+            state.parts.pop(name, None)
+            if not state.parts:
+                del self._states[ip]
+
+    def clear(self):
+        """清空状态表"""
+        self._states.clear()
+        self.latest = None
+        self._ops = 0
+
+    def sweep(self):
+        """按最新日志时间清理窗口外的状态"""
+        if self._ops == 0 and len(self._states) <= self._budget_ips:
+            return
+
+        latest = self.latest
+        total_bytes = 0
+        evicted = 0
+        for ip in list(self._states):
+            state = self._states[ip]
+            if latest is not None:
+                for name in list(state.parts):
+                    registration = self._registrations.get(name)
+                    if registration and not registration.expire(state.parts[name], latest):
+                        del state.parts[name]
+            if not state.parts:
+                del self._states[ip]
+                evicted += 1
+                continue
+            total_bytes += IP_STATE_BYTES
+            for name, part in state.parts.items():
+                registration = self._registrations.get(name)
+                records = registration.records(part) if registration else 0
+                total_bytes += PART_BYTES + records * RECORD_BYTES
+
+        self.evicted += evicted
+        self._ops = 0
+        self._next_sweep_ops = max(MIN_SWEEP_OPS, len(self._states))
+        if self._states:
+            self._avg_ip_bytes = max(IP_STATE_BYTES, total_bytes // len(self._states))
+        self._budget_ips = max(1, self.max_memory_bytes // self._avg_ip_bytes)
+
+        if len(self._states) >= self._budget_ips:
+            # 窗口内的IP不能丢弃，放宽预算避免每次新增IP都触发清理（清理均摊O(1)）
+            self._budget_ips = len(self._states) + len(self._states) // 4 + 1
+
+        if total_bytes > self.max_memory_bytes and total_bytes > self._warned_bytes * 1.25:
+            # 只在超出部分明显增长时再次警告
+            self._warned_bytes = total_bytes
+            self.logger.warning(
+                f"分析器状态约 {total_bytes / 1024 / 1024:.0f}MB，超出预算 "
+                f"{self.max_memory_bytes / 1024 / 1024:.0f}MB，{len(self._states)} 个IP均在窗口内，暂不清理"
+            )
+
+        if evicted:
+            self.logger.debug(f"分析器状态表清理 {evicted} 个IP，剩余 {len(self._states)} 个")
+
+    def estimated_bytes(self) -> int:
+        """估算当前占用内存（字节）"""
+        return len(self._states) * self._avg_ip_bytes
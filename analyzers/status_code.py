@@ -1,9 +1,16 @@
 """异常状态码分析器"""
+from bisect import bisect_right
 from collections import defaultdict
 from datetime import datetime, timedelta, timezone
-from typing import Dict, List, Optional
-
-from .base import BaseAnalyzer, ThreatInfo
+from itertools import compress, islice
+from operator import itemgetter
+from typing import Dict, Iterable, List, Optional, Any, Tuple
+
+from . import columnar
+from .base import (
+    BaseAnalyzer, ThreatInfo, to_epoch, from_epoch, to_epoch_microseconds, from_epoch_microseconds, group_by_ip
+)
+from .state import IPStateTable
 from utils.log_parser import LogEntry
 
 
@@ -30,11 +37,33 @@ def _utc_now() -> datetime:
     return datetime.now(timezone.utc).replace(tzinfo=None)
 
 
+# 只统计这些可疑的错误码，排除常见的正常4xx
+# 401: 未授权（正常的认证保护）
+# 404: 未找到（可能是缺失资源，不一定是攻击）
+# 405: 方法不允许（可能是正常的API调用错误）
+# 关注：403（禁止访问，WAF拦截）、500-5xx（服务器错误，可能是攻击导致）
+SUSPICIOUS_CODES = frozenset({403, 500, 501, 502, 503, 504, 505})
+
+
+class _ErrorWindow:
+    """IP在时间窗口内的错误记录"""
+    __slots__ = ('records', 'flagged')
+
+    def __init__(self):
+        # [(timestamp, status_code), ...]
+        self.records: List[tuple] = []
+        self.flagged = False
+
+
 class StatusCodeAnalyzer(BaseAnalyzer):
     """异常状态码分析器 - 检测大量4xx/5xx错误"""
 
-    def __init__(self, config: Dict = None):
-        super().__init__(config)
+    # 按字段分派：提供真实响应状态的来源（Nginx、付费WAF）都统计；
+    # 免费WAF（固定记为403）和SSH不提供 status 字段，不会路由到此分析器
+    fields = ('ip', 'timestamp', 'status')
+
+    def __init__(self, config: Dict = None, state_table: IPStateTable = None):
+        super().__init__(config, state_table)
 
         thresholds = self.config.get('thresholds', {}).get('error_rate', {})
         self.window_seconds = thresholds.get('window_seconds', 60)
@@ -43,10 +72,8 @@ class StatusCodeAnalyzer(BaseAnalyzer):
         scores = self.config.get('threat_scores', {})
         self.threat_score = scores.get('error_flood', 2)
 
-        # IP错误记录 {ip: [(timestamp, status_code), ...]}
-        self._error_records: Dict[str, List[tuple]] = defaultdict(list)
-        # 已标记的IP
-        self._flagged_ips: set = set()
+        # IP错误记录保存在共享状态表中
+        self.state_table.register(self.name, self._expire, lambda window: len(window.records))
 
     @property
     def name(self) -> str:
@@ -57,41 +84,214 @@ class StatusCodeAnalyzer(BaseAnalyzer):
         if not entry.ip or not entry.timestamp:
             return None
 
-        # 只关注特定的异常错误，排除常见的正常4xx
-        # 401: 未授权（正常的认证保护）
-        # 404: 未找到（可能是缺失资源，不一定是攻击）
-        # 405: 方法不允许（可能是正常的API调用错误）
-        # 关注：403（禁止访问，WAF拦截）、500-5xx（服务器错误，可能是攻击导致）
-        status = entry.status
-
-        # 只统计这些可疑的错误码
-        suspicious_codes = {403, 500, 501, 502, 503, 504, 505}
-
-        if status not in suspicious_codes:
+        if entry.status not in SUSPICIOUS_CODES:
             return None
 
         ip = entry.ip
         now = _to_utc(entry.timestamp)
 
         # 记录错误
-        self._error_records[ip].append((now, entry.status))
+        window = self.state_table.touch(ip, self.name, _ErrorWindow, now)
+        window.records.append((now, entry.status))
+        self._observe(now)
 
         # 清理过期记录
         cutoff = now - timedelta(seconds=self.window_seconds)
-        self._error_records[ip] = [
-            (t, s) for t, s in self._error_records[ip] if t > cutoff
+        window.records = [
+            (t, s) for t, s in window.records if t > cutoff
         ]
 
-        # 检查错误数量
-        error_count = len(self._error_records[ip])
-
+        return self._check_errors(ip, window, len(window.records), window.records, now, entry)
+
+    def analyze_batch(self, entries: List[LogEntry]) -> List[ThreatInfo]:
+        """
+        批量分析状态码：按IP分组，每个IP只取一次状态
+
+        组内记录按时间有序时，过期记录只从头部推进起点，不再每条记录重建列表；
+        遇到乱序记录后退回逐条过滤，结果与逐条分析一致。
+        已安装 NumPy 时走向量化实现，本批乱序且记录过多的IP仍走Python实现。
+        """
+        found = []
+        window_delta = timedelta(seconds=self.window_seconds)
+        latest = None
+        errors = [
+            entry for entry in entries
+            if entry.timestamp and entry.status in SUSPICIOUS_CODES
+        ]
+        with self.state_table.deferred_sweep():
+            if self.columnar and len(errors) >= columnar.MIN_ROWS:
+                found, errors = self._analyze_columnar(errors)
+
+            for ip, group in group_by_ip(errors).items():
+                timed = [(entry, _to_utc(entry.timestamp)) for entry in group]
+                newest = max(now for _, now in timed)
+                if latest is None or newest > latest:
+                    latest = newest
+                window = self.state_table.touch(ip, self.name, _ErrorWindow, newest)
+
+                records = window.records
+                ordered = all(a[0] <= b[0] for a, b in zip(records, records[1:]))
+                start = 0
+                threat = None
+                for entry, now in timed:
+                    if ordered and records and now < records[-1][0]:
+                        records = records[start:]
+                        start = 0
+                        ordered = False
+                    records.append((now, entry.status))
+
+                    # 清理过期记录
+                    cutoff = now - window_delta
+                    if ordered:
+                        while records[start][0] <= cutoff:
+                            start += 1
+                    else:
+                        records = [(t, s) for t, s in records if t > cutoff]
+
+                    threat = self._check_errors(
+                        ip, window, len(records) - start, islice(records, start, None), now, entry
+                    ) or threat
+
+                window.records = records[start:] if start else records
+                if threat:
+                    found.append(threat)
+
+        if latest is not None:
+            self._observe(latest)
+        return found
+
+    def _analyze_columnar(self, errors: List[LogEntry]) -> Tuple[List[ThreatInfo], List[LogEntry]]:
+        """
+        向量化批量分析：本批错误按IP排成列，一次求出每条错误在窗口内的错误数
+
+        与逐条分析相同，每条错误按自己的窗口过滤已有记录：错误 j 在之后第一条满足
+        时间 - 窗口 >= j 的时间的错误处被过滤。本批内的部分：时间有序的IP用 searchsorted 求出，
+        乱序的IP逐对比较；已有记录的部分：已有记录数加上本批错误数是上界，
+        只有上界超过阈值的记录才二分查找已有记录。本批乱序且记录过多的IP原样返回交给Python实现。
+
+        Returns:
+            (报告的威胁, 未处理的记录)
+        """
+        np = columnar.np
+        window_length = self.window_seconds * 1000000
+        window_delta = timedelta(seconds=self.window_seconds)
+        keys, order, bounds = columnar.group_rows([entry.ip for entry in errors])
+        if len(keys) * columnar.MIN_ROWS_PER_KEY > len(errors):
+            return [], errors
+        times = [_to_utc(entry.timestamp) for entry in errors]
+        groups = np.repeat(np.arange(len(keys)), np.diff(bounds))
+        stamps = columnar.as_stamps(times, to_epoch_microseconds)[order]
+
+        disordered = np.zeros(len(keys), dtype=bool)
+        disordered[groups[1:][(groups[1:] == groups[:-1]) & (stamps[1:] < stamps[:-1])]] = True
+        good = ~disordered | (np.diff(bounds) <= columnar.MAX_DISORDERED_ROWS)
+        selected = good[groups]
+        rest = [errors[i] for i in np.sort(order[~selected]).tolist()]
+        last_stamps = columnar.group_cummax(groups, stamps)[bounds[1:] - 1]
+        groups, stamps, rows = groups[selected], stamps[selected], order[selected]
+        if not len(rows):
+            return [], rest
+
+        # 每条错误处已过滤到的最新时间（本组截至该条的最大时间），以及批末之前各条之后的最大时间
+        newest = columnar.group_cummax(groups, stamps)
+        following = columnar.group_cummax(groups, stamps, reverse=True)
+
+        present = np.flatnonzero(good)
+        row_list = rows.tolist()
+        windows: Dict[int, _ErrorWindow] = {}
+        prior_sizes = [0] * len(keys)
+        latest = None
+        # 按IP首次出现的顺序取状态（包括交给Python实现的IP），状态表中的顺序与逐条分析一致
+        for group_id, (stamp, vectorized) in enumerate(zip(last_stamps.tolist(), good.tolist())):
+            last = from_epoch_microseconds(stamp)
+            window = self.state_table.touch(keys[group_id], self.name, _ErrorWindow, last)
+            if vectorized:
+                windows[group_id] = window
+                prior_sizes[group_id] = len(window.records)
+                if latest is None or last > latest:
+                    latest = last
+
+        # 本批内的错误数；上界超过阈值的记录补上已有记录中未被过滤的数量
+        counts = columnar.batch_counts(
+            groups, stamps, newest - window_length, disordered,
+            lambda mixed: columnar.surviving_counts(groups[mixed], stamps[mixed], window_length)
+        )
+        maybe = np.flatnonzero(counts + columnar.as_array(prior_sizes)[groups] > self.max_errors)
+        if len(maybe):
+            prior_times: Dict[int, List[datetime]] = {}
+            prior_counts = []
+            for group_id, stamp in zip(groups[maybe].tolist(), newest[maybe].tolist()):
+                ordered = prior_times.get(group_id)
+                if ordered is None:
+                    ordered = prior_times[group_id] = sorted(map(itemgetter(0), windows[group_id].records))
+                cutoff = from_epoch_microseconds(stamp) - window_delta
+                prior_counts.append(len(ordered) - bisect_right(ordered, cutoff))
+            counts[maybe] += columnar.as_array(prior_counts)
+
+        def check(position: int) -> Optional[ThreatInfo]:
+            group_id = int(groups[position])
+            row = row_list[position]
+            window = windows[group_id]
+            start = int(np.searchsorted(groups, group_id))
+            records = self._columnar_records(window.records, start, position, stamps, row_list, errors, times)
+            return self._check_errors(keys[group_id], window, int(counts[position]), records, times[row], errors[row])
+
+        found = self._replay_columnar(
+            keys, groups, (counts > self.max_errors).astype(np.int64),
+            lambda group_id: int(windows[group_id].flagged),
+            lambda position: times[row_list[position]], check,
+            lambda position: errors[row_list[position]]
+        )
+
+        # 每组只保留批末仍未被过滤的记录
+        for group_id, stamp in zip(present.tolist(), last_stamps[present].tolist()):
+            records = windows[group_id].records
+            if records:
+                cutoff = from_epoch_microseconds(stamp) - window_delta
+                windows[group_id].records = list(compress(records, map(cutoff.__lt__, map(itemgetter(0), records))))
+        live = np.flatnonzero(following - window_length < stamps)
+        for group_id, row in zip(groups[live].tolist(), rows[live].tolist()):
+            windows[group_id].records.append((times[row], errors[row].status))
+
+        self._observe(latest)
+        return found, rest
+
+    def _columnar_records(
+        self, prior: List[tuple], start: int, position: int, stamps, row_list: List[int],
+        errors: List[LogEntry], times: List[datetime]
+    ) -> List[tuple]:
+        """
+        截至本批某条错误时窗口内的错误记录（按记录顺序），只在首次报告时调用
+
+        Args:
+            prior: 已有记录（尚未并入本批错误）
+            start: 本组第一条错误在列中的位置
+            position: 该条错误在列中的位置
+        """
+        window_length = self.window_seconds * 1000000
+        batch = []
+        following = None
+        for i in range(position, start - 1, -1):
+            stamp = int(stamps[i])
+            following = stamp if following is None else max(following, stamp)
+            if following - window_length < stamp:
+                row = row_list[i]
+                batch.append((times[row], errors[row].status))
+        cutoff = from_epoch_microseconds(following) - timedelta(seconds=self.window_seconds)
+        return [record for record in prior if record[0] > cutoff] + batch[::-1]
+
+    def _check_errors(
+        self, ip: str, window: _ErrorWindow, error_count: int, records: Iterable[tuple],
+        now: datetime, entry: LogEntry
+    ) -> Optional[ThreatInfo]:
+        """检查窗口内的错误数量，首次超过阈值时报告（records 为窗口内的错误记录，只在报告时读取）"""
         if error_count > self.max_errors:
-            if ip not in self._flagged_ips:
-                self._flagged_ips.add(ip)
+            if not window.flagged:
+                window.flagged = True
 
                 # 统计错误类型
                 status_counts = defaultdict(int)
-                for _, status in self._error_records[ip]:
+                for _, status in records:
                     status_counts[status] += 1
 
                 top_errors = sorted(
@@ -105,21 +305,56 @@ class StatusCodeAnalyzer(BaseAnalyzer):
 
                 return self._add_threat(ip, reason, self.threat_score, entry)
             else:
-                if ip in self._threats:
-                    self._threats[ip].hit_count += 1
-                    self._threats[ip].last_seen = now
+                self._add_hits(ip, 1, now, entry)
 
         return None
 
+    def _expire(self, window: _ErrorWindow, latest: datetime) -> bool:
+        """裁剪窗口外的错误记录，窗口已清空时丢弃（包括已标记状态）"""
+        cutoff = latest - timedelta(seconds=self.window_seconds)
+        window.records = [(t, s) for t, s in window.records if t > cutoff]
+        return bool(window.records)
+
     def clear(self):
         """清除记录"""
         super().clear()
-        self._error_records.clear()
-        self._flagged_ips.clear()
+        self.state_table.discard(self.name)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """窗口内的错误记录和仍在窗口内的已标记IP"""
+        error_records = {}
+        flagged = []
+        if self._latest is not None:
+            cutoff = self._latest - timedelta(seconds=self.window_seconds)
+            for ip, window in self.state_table.items(self.name):
+                live = [[to_epoch(t), s] for t, s in window.records if t > cutoff]
+                if live:
+                    error_records[ip] = live
+                    if window.flagged:
+                        flagged.append(ip)
+        return {
+            'latest': to_epoch(self._latest) if self._latest else None,
+            'error_records': error_records,
+            'flagged': flagged
+        }
+
+    def restore(self, state: Dict[str, Any]):
+        """恢复窗口内的错误记录和已标记IP"""
+        if state.get('latest') is not None:
+            self._observe(from_epoch(state['latest']))
+        flagged = set(state.get('flagged', []))
+        for ip, records in state.get('error_records', {}).items():
+            restored = [(from_epoch(t), s) for t, s in records]
+            last = max((t for t, _ in restored), default=None)
+            window = self.state_table.touch(ip, self.name, _ErrorWindow, last)
+            window.records = restored + window.records
+            if ip in flagged:
+                window.flagged = True
 
     def get_ip_error_count(self, ip: str, window_seconds: int = None) -> int:
         """获取IP在时间窗口内的错误数"""
-        if ip not in self._error_records:
+        window = self.state_table.get(ip, self.name)
+        if window is None:
             return 0
 
         if window_seconds is None:
@@ -128,4 +363,4 @@ class StatusCodeAnalyzer(BaseAnalyzer):
         now = _utc_now()
         cutoff = now - timedelta(seconds=window_seconds)
 
-        return len([t for t, _ in self._error_records[ip] if t > cutoff])
+        return len([t for t, _ in window.records if t > cutoff])
@@ -0,0 +1,107 @@
+"""
+批量分析：NumPy 向量化 vs Python实现 基准测试
+
+按块流式生成访问日志（正常IP + 少量高频且大量403的IP，时间基本有序、
+偶有少量乱序），分别交给启用和关闭 NumPy 的高频访问、异常状态码分析器，
+比较两者的耗时和报告结果（应完全一致）。
+
+用法:
+    python benchmarks/batch_columnar.py [--lines 10000000] [--batch-size 2000] [--ips 500]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analyzers import FrequencyAnalyzer, StatusCodeAnalyzer
+from analyzers.columnar import HAS_NUMPY
+from utils.log_parser import LogEntry
+
+
+def generate(lines: int, batch_size: int, rate: int, ips: int, seed: int = 1):
+    """按批生成访问记录，每秒约 rate 条，其中20%来自50个攻击IP"""
+    rnd = random.Random(seed)
+    start = datetime(2025, 12, 9)
+    normal = [f"{rnd.randrange(1, 224)}.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(1, 255)}"
+              for _ in range(ips)]
+    hot = [f"10.1.0.{i + 1}" for i in range(50)]
+    normal_codes = (200, 200, 200, 200, 304, 404, 403, 500)
+    for offset in range(0, lines, batch_size):
+        batch = []
+        for n in range(offset, min(offset + batch_size, lines)):
+            seconds = n // rate
+            # 约1%的记录时间回退几秒（多个worker写同一日志）
+            if rnd.random() < 0.01:
+                seconds = max(0, seconds - rnd.randint(1, 5))
+            if rnd.random() < 0.2:
+                ip = rnd.choice(hot)
+                status = 403 if rnd.random() < 0.5 else 200
+            else:
+                ip = rnd.choice(normal)
+                status = rnd.choice(normal_codes)
+            batch.append(LogEntry(
+                timestamp=start + timedelta(seconds=seconds), ip=ip, status=status, source='nginx'
+            ))
+        yield batch
+
+
+def run(args, use_numpy: bool):
+    """运行分析器，返回(耗时, 各分析器报告的威胁)"""
+    config = {
+        'thresholds': {
+            'frequency': [
+                {'window_seconds': 60, 'max_requests': 300, 'score': 3},
+                {'window_seconds': 3600, 'max_requests': 5000, 'score': 2},
+            ],
+            'error_rate': {'window_seconds': 60, 'max_errors': 100},
+        },
+        'batch_analysis': {'numpy': use_numpy},
+    }
+    analyzers = [FrequencyAnalyzer(config), StatusCodeAnalyzer(config)]
+    elapsed = 0.0
+    for batch in generate(args.lines, args.batch_size, args.rate, args.ips):
+        begin = time.perf_counter()
+        for analyzer in analyzers:
+            analyzer.analyze_batch(batch)
+        elapsed += time.perf_counter() - begin
+    results = {
+        analyzer.name: {
+            (ip, tuple(threat.reasons), threat.score, threat.hit_count)
+            for ip, threat in analyzer.get_threats().items()
+        }
+        for analyzer in analyzers
+    }
+    return elapsed, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量分析 NumPy 向量化基准测试')
+    parser.add_argument('--lines', type=int, default=10000000, help='日志行数')
+    parser.add_argument('--batch-size', type=int, default=2000, help='每批记录数')
+    parser.add_argument('--rate', type=int, default=2000, help='每秒日志行数')
+    parser.add_argument('--ips', type=int, default=500, help='正常访问的IP数')
+    args = parser.parse_args()
+
+    if not HAS_NUMPY:
+        print("未安装 NumPy，无法比较")
+        return
+
+    print(f"日志: {args.lines} 行, 每批 {args.batch_size} 条, 正常IP {args.ips} 个")
+    python_time, python_results = run(args, use_numpy=False)
+    numpy_time, numpy_results = run(args, use_numpy=True)
+
+    print(f"{'实现':<8}{'耗时(s)':>10}{'行/秒':>14}")
+    print(f"{'Python':<8}{python_time:>10.2f}{args.lines / python_time:>14.0f}")
+    print(f"{'NumPy':<8}{numpy_time:>10.2f}{args.lines / numpy_time:>14.0f}")
+    print(f"加速: {python_time / numpy_time:.2f}x")
+    for name, expected in python_results.items():
+        same = '一致' if numpy_results[name] == expected else '不一致'
+        print(f"{name}: 报告 {len(expected)} 个IP，结果{same}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+高频检测：精确模式 vs 近似模式（Count-Min Sketch）基准测试
+
+模拟DDoS洪水：大量只访问几次的随机源IP + 少量真正的高频IP +
+一批访问次数接近阈值的IP，比较两种模式的检测结果、耗时和内存。
+
+用法:
+    python benchmarks/frequency_sketch.py [--flood 500000] [--attackers 200] [--width 131072]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analyzers import FrequencyAnalyzer
+from utils.log_parser import LogEntry
+
+
+def build_entries(flood: int, attackers: int, near: int, seed: int = 1):
+    """生成按时间排序的访问记录"""
+    rnd = random.Random(seed)
+    start = datetime(2025, 12, 9)
+    span = 600  # 日志时间跨度（秒）
+    events = []
+
+    # 洪水：每个随机IP 1~3 次
+    for _ in range(flood):
+        ip = f"{rnd.randrange(1, 224)}.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(1, 255)}"
+        for _ in range(rnd.randint(1, 3)):
+            events.append((rnd.uniform(0, span), ip))
+
+    # 真正的高频IP：60秒内 150~400 次
+    for i in range(attackers):
+        ip = f"10.1.{i // 250}.{i % 250 + 1}"
+        base = rnd.uniform(0, span - 60)
+        for _ in range(rnd.randint(150, 400)):
+            events.append((base + rnd.uniform(0, 60), ip))
+
+    # 接近阈值的IP：60秒内 60~100 次（不应报告）
+    for i in range(near):
+        ip = f"10.2.{i // 250}.{i % 250 + 1}"
+        base = rnd.uniform(0, span - 60)
+        for _ in range(rnd.randint(60, 100)):
+            events.append((base + rnd.uniform(0, 60), ip))
+
+    events.sort()
+    return [
+        LogEntry(timestamp=start + timedelta(seconds=int(t)), ip=ip, source='nginx')
+        for t, ip in events
+    ]
+
+
+def run(entries, config):
+    """运行分析器，返回(报告的IP集合, 耗时, 峰值内存MB, 分析器)"""
+    tracemalloc.start()
+    analyzer = FrequencyAnalyzer(config)
+    flagged = set()
+    begin = time.perf_counter()
+    for entry in entries:
+        if analyzer.analyze(entry):
+            flagged.add(entry.ip)
+    elapsed = time.perf_counter() - begin
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return flagged, elapsed, peak / 1024 / 1024, analyzer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='高频检测近似模式基准测试')
+    parser.add_argument('--flood', type=int, default=500000, help='洪水源IP数')
+    parser.add_argument('--attackers', type=int, default=200, help='真正的高频IP数')
+    parser.add_argument('--near', type=int, default=500, help='接近阈值的IP数')
+    parser.add_argument('--width', type=int, default=131072, help='Sketch宽度')
+    parser.add_argument('--depth', type=int, default=4, help='Sketch深度')
+    parser.add_argument('--top-k', type=int, default=2000, help='精确跟踪IP上限')
+    args = parser.parse_args()
+
+    entries = build_entries(args.flood, args.attackers, args.near)
+    print(f"访问记录: {len(entries)} 条")
+
+    base_config = {'thresholds': {'frequency': {'window_seconds': 60, 'max_requests': 100}}}
+    exact, exact_time, exact_mem, _ = run(entries, base_config)
+
+    sketch_config = dict(base_config)
+    sketch_config['frequency_sketch'] = {
+        'enabled': True, 'width': args.width, 'depth': args.depth, 'top_k': args.top_k
+    }
+    approx, approx_time, approx_mem, analyzer = run(entries, sketch_config)
+
+    missed = exact - approx
+    extra = approx - exact
+    sketch = analyzer.sketches[0]
+    print(f"{'模式':<8}{'报告IP':>8}{'耗时(s)':>10}{'峰值内存(MB)':>14}")
+    print(f"{'精确':<8}{len(exact):>8}{exact_time:>10.2f}{exact_mem:>14.1f}")
+    print(f"{'近似':<8}{len(approx):>8}{approx_time:>10.2f}{approx_mem:>14.1f}")
+    print(f"漏报: {len(missed)}  误报: {len(extra)}  提升为精确跟踪: {analyzer.promotions} 次")
+    print(
+        f"Sketch: {sketch.width}x{sketch.depth}x{sketch.slices + 2}, "
+        f"{sketch.memory_bytes / 1024 / 1024:.1f}MB, "
+        f"当前误差界 ε·N = {sketch.error_bound():.1f} (概率 >= {1 - sketch.delta:.3f})"
+    )
+
+
+if __name__ == '__main__':
+    main()
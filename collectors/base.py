@@ -3,27 +3,63 @@ import os
 import glob
 import json
 from abc import ABC, abstractmethod
-from typing import List, Iterator, Dict, Optional, Any
+from datetime import datetime, timedelta
+from typing import AbstractSet, List, Iterator, Dict, Optional, Any, Tuple
 from pathlib import Path
 
 from utils.log_parser import LogEntry
 from utils.logger import get_logger
+from utils.path_utils import match_glob
+from .rotation import open_log, file_fingerprint, fingerprint_matches, find_rotated_file
 
 
 class BaseCollector(ABC):
     """日志收集器基类"""
 
+    # 每次读取的块大小（字节）
+    READ_CHUNK_SIZE = 1024 * 1024
+    # 按时间查找起始位置时，二分范围缩小到此字节数后改为顺序读取
+    SEEK_MIN_SPAN = 64 * 1024
+    # 日志按时间顺序写入，但记录的时间可能略有乱序（如Nginx按请求开始时间记录、按结束顺序写入），
+    # 按时间查找和截止时放宽的时间
+    SEEK_SLACK = timedelta(seconds=60)
+
+    # 该日志源提供真实值的 LogEntry 字段（引擎据此把记录只路由给用得上的分析器）
+    fields: Tuple[str, ...] = ('timestamp', 'ip', 'method', 'path', 'status', 'user_agent', 'raw', 'extra')
+
     def __init__(
         self,
         paths: List[str],
         exclude: List[str] = None,
-        state_file: str = './data/state.json'
+        state_file: str = './data/state.json',
+        state_store=None
     ):
+        """
+        Args:
+            paths: 日志路径模式列表
+            exclude: 排除的文件名模式
+            state_file: JSON状态文件（未提供state_store时使用，或作为旧状态的导入来源）
+            state_store: 读取位置存储（Database），与威胁记录在同一数据库事务中提交
+        """
         self.paths = paths
         self.exclude = exclude or []
         self.state_file = state_file
+        self.state_store = state_store
         self.logger = get_logger()
         self._state: Dict[str, Any] = {}
+        # 自上次保存以来位置有变化的文件
+        self._dirty_paths: set = set()
+        # 当前正在读取的文件及最近一个已交出行之后的位置
+        self._cursor_file: Optional[str] = None
+        self._cursor_inode = 0
+        self._cursor_fingerprint = ''
+        self._cursor_offset = 0
+        # 累计读取字节数（用于按数据量触发检查点）
+        self.bytes_read = 0
+        # 已确认的威胁IP（由引擎设置），这些IP的行只解析IP和时间
+        self.known_ips: AbstractSet[str] = frozenset()
+        # 日志行IP索引（由引擎设置，None表示不建索引）
+        self.line_index = None
         self._load_state()
 
     @property
@@ -37,19 +73,58 @@ class BaseCollector(ABC):
         """解析单行日志"""
         pass
 
+    def parse_brief(self, line: str) -> Optional[LogEntry]:
+        """
+        只解析 known_ips 中的IP的行的IP和时间
+
+        其他IP的行、或日志源不支持快速解析时返回None（完整解析）。
+        """
+        return None
+
+    def line_ip(self, line: str) -> Optional[str]:
+        """行的客户端IP（建日志行索引时使用，日志源可以只取IP不做完整解析）"""
+        entry = self.parse_line(line)
+        return entry.ip if entry else None
+
     def _load_state(self):
-        """加载状态文件（记录已读取的位置）"""
-        if os.path.exists(self.state_file):
-            try:
-                with open(self.state_file, 'r', encoding='utf-8') as f:
-                    all_state = json.load(f)
-                    self._state = all_state.get(self.source_name, {})
-            except (json.JSONDecodeError, IOError) as e:
-                self.logger.warning(f"加载状态文件失败: {e}")
-                self._state = {}
+        """加载读取位置"""
+        if self.state_store is not None:
+            self._state = self.state_store.load_collector_state(self.source_name)
+            if self._state:
+                return
+            # 首次使用数据库存储时导入旧的JSON状态文件
+            self._state = self._load_state_file()
+            if self._state:
+                self.logger.info(f"[{self.source_name}] 从 {self.state_file} 导入 {len(self._state)} 个文件的读取位置")
+                self._dirty_paths.update(self._state)
+                self.save_state()
+            return
+
+        self._state = self._load_state_file()
+
+    def _load_state_file(self) -> Dict[str, Any]:
+        """从JSON状态文件加载读取位置"""
+        if not self.state_file or not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                all_state = json.load(f)
+                return all_state.get(self.source_name, {})
+        except (json.JSONDecodeError, IOError) as e:
+            self.logger.warning(f"加载状态文件失败: {e}")
+            return {}
+
+    def save_state(self):
+        """保存读取位置"""
+        self.sync_position()
+        # 索引先于读取位置落盘，重启后不会漏掉已跳过的行
+        if self.line_index is not None:
+            self.line_index.flush()
+
+        if self.state_store is not None:
+            self.state_store.save_collector_state({self.source_name: self.pop_dirty_state()})
+            return
 
-    def _save_state(self):
-        """保存状态文件"""
         state_dir = os.path.dirname(self.state_file)
         if state_dir and not os.path.exists(state_dir):
             os.makedirs(state_dir, exist_ok=True)
@@ -64,16 +139,41 @@ class BaseCollector(ABC):
 
         all_state[self.source_name] = self._state
 
-        with open(self.state_file, 'w', encoding='utf-8') as f:
+        # 先写临时文件再原子替换，避免写入中断损坏所有日志源的位置
+        tmp_file = f"{self.state_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             json.dump(all_state, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.state_file)
+        self._dirty_paths.clear()
+
+    def sync_position(self):
+        """把正在读取文件的当前位置（最近交出的行之后）写入状态"""
+        if self._cursor_file is not None:
+            self._set_file_position(
+                self._cursor_file, self._cursor_offset, self._cursor_inode, self._cursor_fingerprint
+            )
+
+    def pop_dirty_state(self) -> Dict[str, Any]:
+        """取出自上次保存以来有变化的文件位置"""
+        self.sync_position()
+        dirty = {path: self._state[path] for path in self._dirty_paths if path in self._state}
+        self._dirty_paths.clear()
+        return dirty
 
     def _get_file_position(self, filepath: str) -> Dict:
         """获取文件读取位置"""
         return self._state.get(filepath, {'offset': 0, 'inode': 0})
 
-    def _set_file_position(self, filepath: str, offset: int, inode: int = 0):
+    def _set_file_position(self, filepath: str, offset: int, inode: int = 0, fingerprint: str = ''):
         """设置文件读取位置"""
-        self._state[filepath] = {'offset': offset, 'inode': inode}
+        position = self._state.get(filepath)
+        if (position and position.get('offset') == offset and
+                position.get('inode') == inode and position.get('fingerprint', '') == fingerprint):
+            return
+        self._state[filepath] = {'offset': offset, 'inode': inode, 'fingerprint': fingerprint}
+        self._dirty_paths.add(filepath)
 
     def _should_exclude(self, filepath: str) -> bool:
         """检查文件是否应该排除"""
@@ -93,12 +193,33 @@ class BaseCollector(ABC):
                     files.append(f)
         return sorted(set(files))
 
-    def collect(self, incremental: bool = True) -> Iterator[LogEntry]:
+    def pending_bytes(self, incremental: bool = True) -> int:
+        """
+        尚未读取的日志量（字节，估算值）
+
+        按当前文件大小和保存的读取位置计算；文件已轮转或截断时按整个文件计，
+        不含轮转前旧文件中未读完的部分
+        """
+        total = 0
+        for filepath in self.get_log_files():
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                continue
+            position = self._get_file_position(filepath) if incremental else {}
+            offset = position.get('offset', 0)
+            if position.get('inode', 0) not in (0, stat.st_ino) or offset > stat.st_size:
+                offset = 0
+            total += stat.st_size - offset
+        return total
+
+    def collect(self, incremental: bool = True, save_state: bool = True) -> Iterator[LogEntry]:
         """
         收集日志
 
         Args:
             incremental: 是否增量读取（仅读取新增内容）
+            save_state: 结束时是否保存读取位置（由调用方做检查点时传False）
 
         Yields:
             LogEntry对象
@@ -113,10 +234,154 @@ class BaseCollector(ABC):
                 self.logger.error(f"[{self.source_name}] 读取文件失败 {filepath}: {e}")
 
         # 保存状态
-        self._save_state()
+        if save_state:
+            self.save_state()
+
+    def collect_range(self, since: datetime = None, until: datetime = None) -> Iterator[LogEntry]:
+        """
+        回溯收集 [since, until) 时间范围内的日志，不使用也不改变保存的读取位置
+
+        每个文件按日志时间二分查找起始位置，读到时间超过 until 的记录后停止。
+
+        Args:
+            since: 起始时间（UTC，无时区标记），None表示从文件开头
+            until: 截止时间（UTC，无时区标记，不含），None表示读到文件末尾
+
+        Yields:
+            LogEntry对象
+        """
+        log_files = self.get_log_files()
+        self.logger.info(f"[{self.source_name}] 发现 {len(log_files)} 个日志文件")
+
+        for filepath in log_files:
+            try:
+                yield from self._read_range(filepath, since, until)
+            except Exception as e:
+                self.logger.error(f"[{self.source_name}] 读取文件失败 {filepath}: {e}")
+
+    def _read_range(self, filepath: str, since: Optional[datetime], until: Optional[datetime]) -> Iterator[LogEntry]:
+        """读取单个文件中时间范围内的记录"""
+        start = self.seek_time(filepath, since - self.SEEK_SLACK) if since else 0
+        stop = until + self.SEEK_SLACK if until else None
+        line_count = 0
+        entry_count = 0
+
+        # 不传记录位置的路径，读取位置不变
+        for line in self._stream_lines(filepath, start, False, None, 0, ''):
+            line_count += 1
+            if start and line_count == 1:
+                # 查找位置落在行中间，第一行不完整
+                continue
+            entry = self.parse_brief(line) if self.known_ips else None
+            if entry is None:
+                entry = self.parse_line(line)
+            if entry is None or entry.timestamp is None:
+                continue
+            if stop is not None and entry.timestamp >= stop:
+                break
+            if (since and entry.timestamp < since) or (until and entry.timestamp >= until):
+                continue
+            entry_count += 1
+            yield entry
+
+        if entry_count > 0:
+            self.logger.info(
+                f"[{self.source_name}] {filepath}: "
+                f"从位置 {start} 读取 {line_count} 行, 时间范围内 {entry_count} 条记录"
+            )
+
+    def seek_time(self, filepath: str, target: datetime) -> int:
+        """
+        按日志时间二分查找读取的起始位置
+
+        每次探测读取该位置之后第一条能解析出时间的行。返回的位置之后第一个完整行的时间早于 target
+        （或为文件开头），日志按时间顺序写入时，从该位置顺序读取不会漏掉时间不早于 target 的行。
+        压缩文件不能随机访问，从头读取。
+
+        Args:
+            filepath: 文件路径
+            target: 目标时间（UTC，无时区标记）
+
+        Returns:
+            字节位置
+        """
+        if filepath.endswith('.gz'):
+            return 0
+        try:
+            with open(filepath, 'rb') as f:
+                low, high = 0, os.fstat(f.fileno()).st_size
+                while high - low > self.SEEK_MIN_SPAN:
+                    middle = (low + high) // 2
+                    timestamp = self._time_after(f, middle, high)
+                    if timestamp is None or timestamp >= target:
+                        high = middle
+                    else:
+                        low = middle
+                return low
+        except OSError as e:
+            self.logger.warning(f"[{self.source_name}] 按时间查找失败 {filepath}: {e}")
+            return 0
+
+    def _time_after(self, f, offset: int, limit: int) -> Optional[datetime]:
+        """offset 之后（跳过不完整的行）、limit 之前第一条能解析出时间的行的时间"""
+        f.seek(offset)
+        f.readline()
+        while f.tell() < limit:
+            raw = f.readline()
+            if not raw:
+                break
+            entry = self.parse_line(raw.decode('utf-8', errors='ignore').rstrip('\r\n'))
+            if entry is not None and entry.timestamp is not None:
+                return entry.timestamp
+        return None
+
+    def owns(self, filepath: str) -> bool:
+        """文件是否属于本收集器（匹配路径模式且未被排除）"""
+        if self._should_exclude(filepath):
+            return False
+        return any(match_glob(pattern, filepath) for pattern in self.paths)
 
     def _read_file(self, filepath: str, incremental: bool) -> Iterator[LogEntry]:
         """读取单个文件"""
+        line_count = 0
+        entry_count = 0
+
+        for line in self.read_lines(filepath, incremental):
+            line_count += 1
+            entry = self.parse_brief(line) if self.known_ips else None
+            if entry is None:
+                entry = self.parse_line(line)
+            if entry:
+                entry_count += 1
+                yield entry
+
+        if entry_count > 0:
+            self.logger.info(
+                f"[{self.source_name}] {filepath}: "
+                f"读取 {line_count} 行, 解析 {entry_count} 条记录"
+            )
+
+    def read_lines(
+        self,
+        filepath: str,
+        incremental: bool = True,
+        keep_partial: bool = False
+    ) -> Iterator[str]:
+        """
+        从上次保存的位置按块读取文件新增的行
+
+        读取位置只推进到已交出的行之后，保存状态时不会跳过尚未处理的行。
+        检测到轮转（inode变化）或copytruncate（开头指纹变化/文件变小）时，
+        先找到旧文件（改名或已压缩）从上次位置读完，再从头读取新文件。
+
+        Args:
+            filepath: 文件路径
+            incremental: 是否从上次位置继续读取
+            keep_partial: 是否保留末尾未写完的行（实时模式下等待写入完成）
+
+        Yields:
+            日志行
+        """
         if not os.path.exists(filepath):
             return
 
@@ -130,48 +395,122 @@ class BaseCollector(ABC):
         position = self._get_file_position(filepath)
         start_offset = position.get('offset', 0) if incremental else 0
         saved_inode = position.get('inode', 0)
+        saved_fingerprint = position.get('fingerprint', '')
+        current_fingerprint = file_fingerprint(filepath)
 
-        # 如果inode变化（日志轮转），从头开始读
+        rotated = False
         if saved_inode != 0 and saved_inode != current_inode:
+            # inode变化（日志轮转）
             self.logger.info(f"[{self.source_name}] 检测到文件轮转: {filepath}")
-            start_offset = 0
-
-        # 如果文件变小（被截断），从头开始读
-        if start_offset > current_size:
+            rotated = True
+        elif start_offset > current_size or (
+                start_offset > 0 and saved_fingerprint and
+                saved_fingerprint != current_fingerprint and
+                not fingerprint_matches(filepath, saved_fingerprint)):
+            # 文件变小或开头内容变化（copytruncate后重新写入）
             self.logger.info(f"[{self.source_name}] 检测到文件截断: {filepath}")
+            rotated = True
+
+        if rotated:
+            if incremental and start_offset > 0:
+                old_file = find_rotated_file(filepath, saved_inode, saved_fingerprint)
+                if old_file:
+                    self.logger.info(
+                        f"[{self.source_name}] 补读轮转前的文件 {old_file} 从位置 {start_offset}"
+                    )
+                    # 补读期间的位置仍记在旧文件的inode/指纹下，中断后可继续补读
+                    yield from self._stream_lines(
+                        old_file, start_offset, False,
+                        filepath, saved_inode, saved_fingerprint
+                    )
+                else:
+                    self.logger.warning(f"[{self.source_name}] 未找到轮转前的文件: {filepath}")
             start_offset = 0
 
-        if start_offset == current_size:
+        if start_offset == current_size and not rotated:
             # 没有新内容
             return
 
         self.logger.debug(f"[{self.source_name}] 读取 {filepath} 从位置 {start_offset}")
 
-        try:
-            with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-                f.seek(start_offset)
-                line_count = 0
-                entry_count = 0
-
-                for line in f:
-                    line_count += 1
-                    entry = self.parse_line(line)
-                    if entry:
-                        entry_count += 1
-                        yield entry
-
-                # 更新位置
-                end_offset = f.tell()
-                self._set_file_position(filepath, end_offset, current_inode)
+        yield from self._stream_lines(
+            filepath, start_offset, keep_partial,
+            filepath, current_inode, current_fingerprint
+        )
 
-                if entry_count > 0:
-                    self.logger.info(
-                        f"[{self.source_name}] {filepath}: "
-                        f"读取 {line_count} 行, 解析 {entry_count} 条记录"
-                    )
+    def _stream_lines(
+        self,
+        read_path: str,
+        start_offset: int,
+        keep_partial: bool,
+        state_path: str,
+        inode: int,
+        fingerprint: str
+    ) -> Iterator[str]:
+        """
+        从指定位置按块读取行并跟踪读取位置
 
-        except IOError as e:
-            self.logger.error(f"[{self.source_name}] 读取文件失败 {filepath}: {e}")
+        Args:
+            read_path: 实际读取的文件（可能是轮转后的旧文件，.gz透明解压）
+            start_offset: 起始位置（解压后的字节偏移）
+            keep_partial: 是否保留末尾未写完的行
+            state_path: 记录读取位置使用的路径（None表示不记录，回溯扫描）
+            inode: 记录的inode
+            fingerprint: 记录的文件指纹
+        """
+        index = self.line_index if state_path is not None else None
+        try:
+            with open_log(read_path) as f:
+                f.seek(start_offset)
+                generation = index.generation(state_path, inode, fingerprint, read_path) if index else None
+                self._cursor_file = state_path
+                self._cursor_inode = inode
+                self._cursor_fingerprint = fingerprint
+                self._cursor_offset = start_offset
+                pending = b''
+
+                while True:
+                    chunk = f.read(self.READ_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    self.bytes_read += len(chunk)
+
+                    data = pending + chunk
+                    cut = data.rfind(b'\n') + 1
+                    pending = data[cut:]
+
+                    lines = data[:cut].split(b'\n')
+                    lines.pop()  # 最后一个换行符之后的空串
+                    for raw in lines:
+                        offset = self._cursor_offset
+                        # 游标指向已交出行之后，检查点只覆盖已处理的行
+                        self._cursor_offset += len(raw) + 1
+                        line = raw.decode('utf-8', errors='ignore').rstrip('\r')
+                        if generation is not None:
+                            self._index_line(generation, line, offset)
+                        yield line
+
+                # 末尾没有换行符的行
+                if pending and not keep_partial:
+                    offset = self._cursor_offset
+                    self._cursor_offset += len(pending)
+                    line = pending.decode('utf-8', errors='ignore')
+                    if generation is not None:
+                        self._index_line(generation, line, offset)
+                    yield line
+
+                self.sync_position()
+
+        except (IOError, OSError, EOFError) as e:
+            self.logger.error(f"[{self.source_name}] 读取文件失败 {read_path}: {e}")
+        finally:
+            self._cursor_file = None
+
+    def _index_line(self, generation: str, line: str, offset: int):
+        """把行的位置记入日志行索引"""
+        ip = self.line_ip(line)
+        if ip:
+            self.line_index.add(generation, ip, offset)
 
     def tail(self, filepath: str) -> Iterator[LogEntry]:
         """
@@ -8,11 +8,15 @@ from utils.log_parser import LogEntry, parse_free_waf_log
 class FreeWAFCollector(BaseCollector):
     """宝塔免费Nginx防火墙日志收集器"""
 
+    # 状态码固定为403（拦截），不是真实的响应状态
+    fields = ('timestamp', 'ip', 'method', 'path', 'user_agent', 'raw', 'extra')
+
     def __init__(
         self,
         paths: List[str] = None,
         exclude: List[str] = None,
-        state_file: str = './data/state.json'
+        state_file: str = './data/state.json',
+        state_store=None
     ):
         if paths is None:
             paths = [
@@ -22,7 +26,7 @@ class FreeWAFCollector(BaseCollector):
         if exclude is None:
             exclude = ['*.gz']
 
-        super().__init__(paths, exclude, state_file)
+        super().__init__(paths, exclude, state_file, state_store)
 
     @property
     def source_name(self) -> str:
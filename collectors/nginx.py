@@ -2,7 +2,7 @@
 from typing import Optional, List
 
 from .base import BaseCollector
-from utils.log_parser import LogEntry, parse_nginx_log
+from utils.log_parser import LogEntry, parse_nginx_log, parse_nginx_brief
 
 
 class NginxCollector(BaseCollector):
@@ -12,14 +12,15 @@ class NginxCollector(BaseCollector):
         self,
         paths: List[str] = None,
         exclude: List[str] = None,
-        state_file: str = './data/state.json'
+        state_file: str = './data/state.json',
+        state_store=None
     ):
         if paths is None:
             paths = ['/www/wwwlogs/*.log']
         if exclude is None:
             exclude = ['*.gz']
 
-        super().__init__(paths, exclude, state_file)
+        super().__init__(paths, exclude, state_file, state_store)
 
     @property
     def source_name(self) -> str:
@@ -28,3 +29,13 @@ class NginxCollector(BaseCollector):
     def parse_line(self, line: str) -> Optional[LogEntry]:
         """解析Nginx日志行"""
         return parse_nginx_log(line)
+
+    def parse_brief(self, line: str) -> Optional[LogEntry]:
+        """已确认威胁IP的行只解析IP和时间"""
+        return parse_nginx_brief(line, self.known_ips)
+
+    def line_ip(self, line: str) -> Optional[str]:
+        """行首的客户端IP（建日志行索引时不做完整解析）"""
+        line = line.lstrip()
+        end = line.find(' ')
+        return line[:end] if end > 0 else None
@@ -0,0 +1,124 @@
+"""日志轮转跟踪"""
+import os
+import gzip
+import hashlib
+from typing import Optional, List
+
+# 文件指纹使用的开头字节数
+FINGERPRINT_BYTES = 1024
+
+# 轮转文件名中紧跟原文件名的分隔符，如 access.log.1 / access.log-20251209 / access.log_1.gz
+ROTATED_SEPARATORS = ('.', '-', '_')
+
+# 查找轮转文件时最多检查的候选数（按修改时间从新到旧）
+MAX_CANDIDATES = 10
+
+
+def open_log(filepath: str):
+    """以二进制方式打开日志文件，.gz文件透明解压"""
+    if filepath.endswith('.gz'):
+        return gzip.open(filepath, 'rb')
+    return open(filepath, 'rb')
+
+
+def _hash_head(filepath: str, length: int) -> Optional[str]:
+    """计算文件开头length字节（解压后）的摘要"""
+    try:
+        with open_log(filepath) as f:
+            head = f.read(length)
+    except (IOError, OSError, EOFError):
+        return None
+    if len(head) < length:
+        return None
+    return hashlib.sha1(head).hexdigest()
+
+
+def file_fingerprint(filepath: str) -> str:
+    """
+    文件指纹：开头最多 FINGERPRINT_BYTES 字节的长度和摘要，格式 "长度:sha1"
+
+    日志文件的开头内容（首行时间戳等）在整个生命周期内不变，
+    轮转改名、压缩后依然可以通过指纹认出；copytruncate 截断后开头变化。
+    空文件返回空字符串（无法识别）。
+    """
+    try:
+        with open_log(filepath) as f:
+            head = f.read(FINGERPRINT_BYTES)
+    except (IOError, OSError, EOFError):
+        return ''
+    if not head:
+        return ''
+    return f"{len(head)}:{hashlib.sha1(head).hexdigest()}"
+
+
+def fingerprint_matches(filepath: str, fingerprint: str) -> bool:
+    """文件开头是否与指纹一致（指纹可能是文件较短时计算的，只比较对应长度）"""
+    if not fingerprint:
+        return False
+    length, _, digest = fingerprint.partition(':')
+    try:
+        length = int(length)
+    except ValueError:
+        return False
+    return _hash_head(filepath, length) == digest
+
+
+def _rotation_candidates(filepath: str) -> List[str]:
+    """同目录下由该文件轮转产生的候选文件，按修改时间从新到旧"""
+    directory = os.path.dirname(filepath) or '.'
+    basename = os.path.basename(filepath)
+    candidates = []
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+
+    for name in names:
+        if name == basename or not name.startswith(basename):
+            continue
+        if name[len(basename)] not in ROTATED_SEPARATORS:
+            continue
+        path = os.path.join(directory, name)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            continue
+        candidates.append((mtime, path))
+
+    candidates.sort(reverse=True)
+    return [path for _, path in candidates[:MAX_CANDIDATES]]
+
+
+def find_rotated_file(filepath: str, inode: int, fingerprint: str) -> Optional[str]:
+    """
+    查找文件轮转后的旧文件
+
+    先按inode匹配未压缩的改名文件（access.log.1 / access.log-20251209），
+    再按指纹匹配已压缩或copytruncate复制出的文件。
+
+    Args:
+        filepath: 当前日志路径
+        inode: 上次读取时的inode
+        fingerprint: 上次读取时的文件指纹
+
+    Returns:
+        旧文件路径，找不到时返回None
+    """
+    candidates = _rotation_candidates(filepath)
+
+    for path in candidates:
+        if path.endswith('.gz'):
+            continue
+        try:
+            if inode and os.stat(path).st_ino == inode:
+                if not fingerprint or fingerprint_matches(path, fingerprint):
+                    return path
+        except OSError:
+            continue
+
+    if fingerprint:
+        for path in candidates:
+            if fingerprint_matches(path, fingerprint):
+                return path
+
+    return None
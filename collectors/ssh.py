@@ -8,11 +8,15 @@ from utils.log_parser import LogEntry, parse_ssh_log
 class SSHCollector(BaseCollector):
     """SSH登录日志收集器"""
 
+    # 路径和状态码是解析时填充的占位值，没有请求路径和UA
+    fields = ('timestamp', 'ip', 'raw', 'extra')
+
     def __init__(
         self,
         paths: List[str] = None,
         exclude: List[str] = None,
-        state_file: str = './data/state.json'
+        state_file: str = './data/state.json',
+        state_store=None
     ):
         if paths is None:
             paths = [
@@ -22,7 +26,7 @@ class SSHCollector(BaseCollector):
         if exclude is None:
             exclude = ['*.gz']
 
-        super().__init__(paths, exclude, state_file)
+        super().__init__(paths, exclude, state_file, state_store)
 
     @property
     def source_name(self) -> str:
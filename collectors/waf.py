@@ -12,7 +12,8 @@ class WAFCollector(BaseCollector):
         self,
         paths: List[str] = None,
         exclude: List[str] = None,
-        state_file: str = './data/state.json'
+        state_file: str = './data/state.json',
+        state_store=None
     ):
         if paths is None:
             paths = [
@@ -22,7 +23,7 @@ class WAFCollector(BaseCollector):
         if exclude is None:
             exclude = ['*.gz']
 
-        super().__init__(paths, exclude, state_file)
+        super().__init__(paths, exclude, state_file, state_store)
 
     @property
     def source_name(self) -> str:
@@ -1,6 +1,9 @@
 """分析引擎 - 整合收集、分析、存储"""
 import os
 import sys
+import time
+import threading
+from datetime import datetime
 from typing import Dict, List, Optional, Any
 
 import yaml
@@ -9,26 +12,39 @@ import yaml
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from collectors import NginxCollector, WAFCollector, FreeWAFCollector, SSHCollector
-from analyzers import FrequencyAnalyzer, PatternAnalyzer, StatusCodeAnalyzer, ThreatInfo
-from storage import Database, Exporter
+from analyzers import ThreatInfo, IPStateTable, StaticAssetFilter
+from storage import Database, Exporter, LineIndex, AccessLogStore
+from utils.log_parser import LogEntry
 from utils.logger import setup_logger, get_logger
 from utils.ip_utils import normalize_ip, WhitelistManager
+from core.sharding import ShardedAnalysis, create_analyzers
+from core.sampling import AdaptiveSampler
 
 
 class Engine:
     """分析引擎"""
 
+    # 每批分析的记录数（默认值，可由 batch_analysis.batch_size 覆盖）；检查点只在整批分析完成后进行
+    BATCH_SIZE = 2000
+
     def __init__(self, config_path: str = 'config.yaml'):
         self.config = self._load_config(config_path)
         self._setup_logger()
         self.logger = get_logger()
+        self.batch_size = self.config.get('batch_analysis', {}).get('batch_size', self.BATCH_SIZE)
 
         # 初始化组件
+        self._init_storage()
         self._init_collectors()
         self._init_analyzers()
-        self._init_storage()
         self._init_whitelist()
 
+        # 已确认的高危IP（扫描开始时从数据库加载，检查点后更新），收集器对这些IP的行只解析IP和时间
+        self.known_ips: set = set()
+        for collector in self.collectors:
+            collector.known_ips = self.known_ips
+            collector.line_index = self.line_index
+
     def _load_config(self, config_path: str) -> Dict:
         """加载配置文件"""
         if os.path.exists(config_path):
@@ -58,7 +74,8 @@ class Engine:
             self.collectors.append(NginxCollector(
                 paths=nginx_config.get('paths'),
                 exclude=nginx_config.get('exclude'),
-                state_file=state_file
+                state_file=state_file,
+                state_store=self.database
             ))
 
         # WAF (付费版)
@@ -67,7 +84,8 @@ class Engine:
             self.collectors.append(WAFCollector(
                 paths=waf_config.get('paths'),
                 exclude=waf_config.get('exclude'),
-                state_file=state_file
+                state_file=state_file,
+                state_store=self.database
             ))
 
         # Free WAF (免费版Nginx防火墙)
@@ -76,7 +94,8 @@ class Engine:
             self.collectors.append(FreeWAFCollector(
                 paths=free_waf_config.get('paths'),
                 exclude=free_waf_config.get('exclude'),
-                state_file=state_file
+                state_file=state_file,
+                state_store=self.database
             ))
 
         # SSH
@@ -85,16 +104,210 @@ class Engine:
             self.collectors.append(SSHCollector(
                 paths=ssh_config.get('paths'),
                 exclude=ssh_config.get('exclude'),
-                state_file=state_file
+                state_file=state_file,
+                state_store=self.database
             ))
 
     def _init_analyzers(self):
         """初始化分析器"""
-        self.analyzers = [
-            FrequencyAnalyzer(self.config),
-            PatternAnalyzer(self.config),
-            StatusCodeAnalyzer(self.config)
-        ]
+        # 所有分析器共享一张IP状态表，按日志时间清理；内存预算只是建议值（窗口内的IP不淘汰）
+        state_config = self.config.get('analyzer_state', {})
+        self.state_table = IPStateTable(max_memory_mb=state_config.get('max_memory_mb', 512))
+        self.analyzers = create_analyzers(self.config, self.state_table)
+
+        # 多进程分析：记录按IP分片交给各分析进程，本进程的分析器只用于分派（不保存状态）
+        workers = self.config.get('batch_analysis', {}).get('workers', 1)
+        if workers == 0:
+            workers = os.cpu_count() or 1
+        self.shards: Optional[ShardedAnalysis] = None
+        if workers > 1:
+            self.shards = ShardedAnalysis(self.config, workers)
+        self._load_analyzer_state()
+        self._build_dispatch()
+
+        # 静态资源预分类：标记后恶意模式分析跳过注入类规则
+        static_config = self.config.get('static_assets', {})
+        self.static_filter: Optional[StaticAssetFilter] = None
+        if static_config.get('enabled', True):
+            self.static_filter = StaticAssetFilter(static_config)
+
+        # 降载采样：扫描积压超出时间预算时只对静态资源请求按IP采样（需要静态资源预分类）
+        shedding_config = self.config.get('load_shedding', {})
+        self.sampler: Optional[AdaptiveSampler] = None
+        if shedding_config.get('enabled', False) and self.static_filter:
+            self.sampler = AdaptiveSampler(shedding_config)
+
+    def _build_dispatch(self):
+        """按日志来源建立分析器分派表：记录只交给声明处理该来源、且所需字段齐全的分析器"""
+        self._dispatch: Dict[str, List] = {}
+        for collector in self.collectors:
+            routed = [
+                analyzer for analyzer in self.analyzers
+                if analyzer.accepts(collector.source_name, collector.fields)
+            ]
+            self._dispatch[collector.source_name] = routed
+            self.logger.debug(
+                f"[{collector.source_name}] 分析器: {', '.join(a.name for a in routed) or '无'}"
+            )
+
+    def analyzers_for(self, source: str) -> List:
+        """获取处理该来源日志的分析器"""
+        routed = self._dispatch.get(source)
+        if routed is None:
+            routed = [analyzer for analyzer in self.analyzers if analyzer.accepts(source)]
+            self._dispatch[source] = routed
+        return routed
+
+    def analyze_batch(self, entries: List[LogEntry], analyzers: List = None, sample: bool = False) -> List[ThreatInfo]:
+        """
+        把一批记录依次交给各分析器批量分析
+
+        分析器按IP分组处理，所有分析器处理完整批记录之前暂停状态表清理，
+        避免前一个分析器把日志时间推进到批末后，按批末时间清理掉后面的分析器仍需要的窗口状态。
+
+        Args:
+            entries: 同一来源、已过滤白名单的日志记录
+            analyzers: 处理这些记录的分析器（默认按第一条记录的来源分派）
+            sample: 是否按降载采样倍数对静态资源请求采样（扫描时）
+
+        Returns:
+            各分析器报告的威胁（分析器持有的累计对象）
+        """
+        if not entries:
+            return []
+        if analyzers is None:
+            analyzers = self.analyzers_for(entries[0].source)
+        if self.static_filter:
+            self.static_filter.tag(entries)
+        if sample and self.sampler:
+            entries = self.sampler.sample(entries, analyzers)
+            if not entries:
+                return []
+        if self.shards:
+            return self.shards.analyze_batch(entries, [analyzer.name for analyzer in analyzers])
+
+        threats = []
+        with self.state_table.deferred_sweep():
+            for analyzer in analyzers:
+                threats.extend(analyzer.analyze_batch(entries))
+        return threats
+
+    def _collect_threats(self, ips, known_hits: Dict[str, ThreatInfo] = None) -> Dict[str, ThreatInfo]:
+        """
+        汇总各分析器对这些IP的本次扫描威胁记录
+
+        按分析器各自持有的累计记录重新合并，结果与批内处理顺序无关。
+
+        Args:
+            ips: 报告过威胁的IP（分析器中的键）
+            known_hits: 已确认的高危IP跳过分析后累计的命中次数
+        """
+        ips = list(ips)
+        found = self.threat_records(ips)
+        records = [found.get(analyzer.name, {}) for analyzer in self.analyzers]
+
+        threats: Dict[str, ThreatInfo] = {}
+        for ip in ips:
+            key = normalize_ip(ip) or ip
+            for analyzer_threats in records:
+                threat = analyzer_threats.get(ip)
+                if threat is None:
+                    continue
+                if key in threats:
+                    threats[key].merge(threat)
+                else:
+                    threats[key] = threat.copy()
+        for key, hit in (known_hits or {}).items():
+            if key in threats:
+                threats[key].merge(hit)
+            else:
+                threats[key] = hit.copy()
+        return threats
+
+    def threat_records(self, ips: Optional[List[str]] = None) -> Dict[str, Dict[str, ThreatInfo]]:
+        """
+        各分析器对这些IP（None表示全部）的累计威胁记录 {分析器名称: {ip: ThreatInfo}}
+
+        单进程时为分析器持有的对象，多进程时为副本
+        """
+        if self.shards:
+            return self.shards.get_threats(ips)
+        records = {}
+        for analyzer in self.analyzers:
+            threats = analyzer.get_threats()
+            if ips is None:
+                records[analyzer.name] = dict(threats)
+            else:
+                records[analyzer.name] = {ip: threats[ip] for ip in ips if ip in threats}
+        return records
+
+    def reset_threats(self):
+        """释放各分析器的累计威胁记录（已写入数据库后），保留时间窗口状态"""
+        if self.shards:
+            self.shards.reset_threats()
+            return
+        for analyzer in self.analyzers:
+            analyzer.reset_threats()
+
+    def _load_known_ips(self):
+        """从数据库加载达到 known_threats.min_level 的威胁IP（排除白名单）"""
+        known_config = self.config.get('known_threats', {})
+        if not known_config.get('enabled', True):
+            return
+        ips = self.database.get_threat_ips(known_config.get('min_level', 'CRITICAL'))
+        self.known_ips.clear()
+        self.known_ips.update(ip for ip in ips if not self.whitelist_manager.is_whitelisted(ip))
+
+    def _add_known_hit(self, known_hits: Dict[str, ThreatInfo], ip: str, entry: LogEntry):
+        """已确认的高危IP再次出现：只累计命中次数和最后访问时间"""
+        hit = known_hits.get(ip)
+        if hit is None:
+            known_hits[ip] = ThreatInfo(ip=ip, hit_count=1, first_seen=entry.timestamp, last_seen=entry.timestamp)
+            return
+        hit.hit_count += 1
+        if entry.timestamp and entry.timestamp > hit.last_seen:
+            hit.last_seen = entry.timestamp
+
+    def _analyzer_state_enabled(self) -> bool:
+        """是否跨扫描保留分析器时间窗口状态"""
+        return self.config.get('analyzer_state', {}).get('enabled', True)
+
+    def _load_analyzer_state(self):
+        """从数据库恢复分析器时间窗口状态"""
+        if not self._analyzer_state_enabled():
+            return
+        snapshots = self.database.load_analyzer_state()
+        if self.shards:
+            for name, error in self.shards.restore(snapshots).items():
+                self.logger.warning(f"[{name}] 恢复分析器状态失败: {error}")
+            if snapshots:
+                self.logger.info(f"已恢复 {len(snapshots)} 个分析器的窗口状态")
+            return
+        for analyzer in self.analyzers:
+            snapshot = snapshots.get(analyzer.name)
+            if not snapshot:
+                continue
+            try:
+                analyzer.restore(snapshot)
+            except Exception as e:
+                self.logger.warning(f"[{analyzer.name}] 恢复分析器状态失败: {e}")
+                analyzer.clear()
+        if snapshots:
+            self.logger.info(f"已恢复 {len(snapshots)} 个分析器的窗口状态")
+
+    def _analyzer_snapshots(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        """所有分析器的窗口状态快照"""
+        if not self._analyzer_state_enabled():
+            return None
+        if self.shards:
+            return self.shards.snapshots()
+        return {analyzer.name: analyzer.snapshot() for analyzer in self.analyzers}
+
+    def save_analyzer_state(self):
+        """保存分析器时间窗口状态（停止服务时调用）"""
+        snapshots = self._analyzer_snapshots()
+        if snapshots:
+            self.database.save_analyzer_state(snapshots)
 
     def _init_storage(self):
         """初始化存储"""
@@ -102,8 +315,14 @@ class Engine:
         self.database = Database(
             db_path=db_config.get('path', './data/ipcollect.db'),
             retention_days=db_config.get('retention_days', 30),
-            threat_retention_days=db_config.get('threat_retention_days', 0)
+            threat_retention_days=db_config.get('threat_retention_days', 0),
+            samples_per_ip=self._samples_per_ip(),
+            cleanup_chunk_size=db_config.get('cleanup_chunk_size', 5000)
         )
+        # 过期数据清理间隔（秒），与扫描间隔无关；下次清理时间首次检查时从数据库读取
+        self.cleanup_interval = db_config.get('cleanup_interval_hours', 24) * 3600
+        self._next_cleanup: Optional[float] = None
+        self._cleanup_lock = threading.Lock()
 
         output_config = self.config.get('output', {})
         self.exporter = Exporter(
@@ -112,6 +331,34 @@ class Engine:
             deduplicate=output_config.get('deduplicate', True)
         )
 
+        # 日志行IP索引（按IP查看原始日志行）
+        index_config = self.config.get('line_index', {})
+        self.line_index = None
+        if index_config.get('enabled', False):
+            self.line_index = LineIndex(
+                path=index_config.get('path', './data/line_index'),
+                flush_postings=index_config.get('flush_postings', 1000000),
+                max_segments=index_config.get('max_segments', 8)
+            )
+
+        # 访问日志分区存储（按日期分文件批量写入）
+        access_config = self.config.get('access_logs', {})
+        self.access_log: Optional[AccessLogStore] = None
+        if access_config.get('enabled', False):
+            self.access_log = AccessLogStore(
+                path=access_config.get('path', './data/access_logs'),
+                batch_size=access_config.get('batch_size', 5000),
+                skip_static=access_config.get('skip_static', False),
+                include_whitelisted=access_config.get('include_whitelisted', False)
+            )
+
+    def _samples_per_ip(self) -> int:
+        """每个威胁IP保留的证据样本数（未启用时为0）"""
+        evidence_config = self.config.get('evidence', {})
+        if not evidence_config.get('enabled', True):
+            return 0
+        return evidence_config.get('samples_per_ip', 10)
+
     def _init_whitelist(self):
         """初始化白名单"""
         # 从配置获取白名单列表
@@ -129,63 +376,165 @@ class Engine:
         if self.whitelist_manager.count > 0:
             self.logger.info(f"已加载 {self.whitelist_manager.count} 条白名单规则")
 
-    def scan(self, incremental: bool = True) -> Dict[str, Any]:
+    def scan(
+        self, incremental: bool = True, since: datetime = None, until: datetime = None
+    ) -> Dict[str, Any]:
         """
         执行一次扫描
 
+        指定 since/until 时为回溯扫描：每个文件按日志时间查找起始位置，只分析该时间范围内的日志。
+        回溯扫描从空的窗口状态开始完整分析所有IP（不走已确认高危IP的快速路径），威胁照常写入数据库，
+        但不改变保存的读取位置和分析器窗口状态，结束后恢复数据库中保存的窗口状态。
+
         Args:
             incremental: 是否增量扫描
+            since: 回溯扫描起始时间（UTC，无时区标记）
+            until: 回溯扫描截止时间（UTC，无时区标记，不含）
 
         Returns:
             扫描结果统计
         """
+        backfill = since is not None or until is not None
         self.logger.info("=" * 50)
-        self.logger.info(f"开始{'增量' if incremental else '全量'}扫描")
+        if backfill:
+            self.logger.info(f"开始回溯扫描: {since or '文件开头'} ~ {until or '文件末尾'} (UTC)")
+        else:
+            self.logger.info(f"开始{'增量' if incremental else '全量'}扫描")
 
         stats = {
             'entries_processed': 0,
             'threats_found': 0,
             'threats_exported': 0,
+            'static_skipped': 0,
+            'sampled': 0,
             'sources': {}
         }
 
-        # 收集所有威胁
-        all_threats: Dict[str, ThreatInfo] = {}
+        # 全量扫描重新读取所有日志、回溯扫描读取其他时间段，都不能叠加之前保留的窗口状态
+        if not incremental or backfill:
+            self._clear_analyzers()
+
+        # 本次扫描报告过威胁的IP（分析器中的键）
+        threat_ips = set()
+        # 已确认的高危IP不再交给分析器，只累计命中次数和最后访问时间（回溯扫描完整分析所有IP）
+        if backfill:
+            self.known_ips.clear()
+        else:
+            self._load_known_ips()
+        known_hits: Dict[str, ThreatInfo] = {}
+        # 已在检查点写入数据库的部分 {ip: (score, hit_count, reasons数量)}
+        persisted: Dict[str, tuple] = {}
+
+        checkpoint_config = self.config.get('checkpoint', {})
+        checkpoint_bytes = checkpoint_config.get('interval_mb', 64) * 1024 * 1024
+        checkpoint_seconds = checkpoint_config.get('interval_seconds', 30)
+        last_checkpoint_time = time.time()
+        last_checkpoint_bytes = self._bytes_read()
+
+        if self.sampler:
+            lag = 0 if backfill else sum(collector.pending_bytes(incremental) for collector in self.collectors)
+            self.sampler.start(lag, last_checkpoint_bytes)
 
         # 遍历所有收集器
         for collector in self.collectors:
             source_name = collector.source_name
-            source_stats = {'entries': 0, 'threats': 0}
+            source_stats = {'entries': 0, 'threats': 0, 'known_hits': 0, 'static': 0, 'sampled': 0}
+            analyzers = self.analyzers_for(source_name)
 
             self.logger.info(f"[{source_name}] 开始收集日志")
 
-            for entry in collector.collect(incremental=incremental):
+            batch: List[LogEntry] = []
+            pending = 0
+            if backfill:
+                entries = collector.collect_range(since, until)
+            else:
+                entries = collector.collect(incremental=incremental, save_state=False)
+            # 回溯扫描读取的是已处理过的时间段，不重复写入访问日志
+            access_log = None if backfill else self.access_log
+            for entry in entries:
                 # 白名单过滤
                 ip = normalize_ip(entry.ip)
-                if not ip or self.whitelist_manager.is_whitelisted(ip):
+                if not ip:
+                    continue
+                if self.whitelist_manager.is_whitelisted(ip):
+                    if access_log:
+                        self.record_access([entry], whitelisted=True)
                     continue
 
-                source_stats['entries'] += 1
-
-                # 遍历所有分析器
-                for analyzer in self.analyzers:
-                    threat = analyzer.analyze(entry)
-                    if threat:
-                        if ip in all_threats:
-                            all_threats[ip].merge(threat)
-                        else:
-                            all_threats[ip] = threat
-                        source_stats['threats'] += 1
-
+                if ip in self.known_ips:
+                    self._add_known_hit(known_hits, ip, entry)
+                    source_stats['known_hits'] += 1
+                    if access_log:
+                        access_log.add(entry)
+                else:
+                    batch.append(entry)
+                pending += 1
+                if pending < self.batch_size:
+                    continue
+                pending = 0
+
+                bytes_read = self._bytes_read()
+                if self.sampler:
+                    self.sampler.adjust(bytes_read)
+
+                # 只交给处理该来源的分析器
+                if batch:
+                    self._scan_batch(batch, analyzers, threat_ips, source_stats)
+                    if access_log:
+                        access_log.extend(batch)
+                    batch = []
+
+                # 定期检查点（整批分析完成后）：按读取数据量或时间
+                if (bytes_read - last_checkpoint_bytes >= checkpoint_bytes or
+                        time.time() - last_checkpoint_time >= checkpoint_seconds):
+                    self._checkpoint(self._collect_threats(threat_ips, known_hits), persisted, backfill)
+                    last_checkpoint_time = time.time()
+                    last_checkpoint_bytes = bytes_read
+                    # 检查点写入后新达到等级的IP此后也走快速路径
+                    if not backfill:
+                        self._load_known_ips()
+
+            if batch:
+                self._scan_batch(batch, analyzers, threat_ips, source_stats)
+                if access_log:
+                    access_log.extend(batch)
+
+            # 分派表按来源固定，每个分析器处理的记录数即该来源的记录数
+            source_stats['analyzers'] = {analyzer.name: source_stats['entries'] for analyzer in analyzers}
             stats['sources'][source_name] = source_stats
-            stats['entries_processed'] += source_stats['entries']
+            if source_stats['entries']:
+                self.logger.info(
+                    f"[{source_name}] 分析 {source_stats['entries']} 条记录，"
+                    f"分析器: {', '.join(source_stats['analyzers']) or '无'}"
+                )
+            if source_stats['static']:
+                source_stats['static_ratio'] = round(source_stats['static'] / source_stats['entries'], 4)
+                self.logger.info(
+                    f"[{source_name}] 静态资源请求 {source_stats['static']} 条"
+                    f"（{source_stats['static_ratio']:.1%}），跳过注入类规则"
+                )
+            if source_stats['sampled']:
+                source_stats['sample_rate'] = round(1 - source_stats['sampled'] / source_stats['static'], 4)
+                self.logger.info(
+                    f"[{source_name}] 降载采样跳过 {source_stats['sampled']} 条静态资源请求"
+                    f"（静态资源保留 {source_stats['sample_rate']:.1%}）"
+                )
+            if source_stats['known_hits']:
+                self.logger.info(f"[{source_name}] 已确认高危IP的 {source_stats['known_hits']} 条记录只累计命中次数")
+            stats['entries_processed'] += source_stats['entries'] + source_stats['known_hits']
+            stats['static_skipped'] += source_stats['static']
+            stats['sampled'] += source_stats['sampled']
 
         self.logger.info(f"处理了 {stats['entries_processed']} 条日志记录")
+        if self.sampler:
+            # 实际分析的记录占比（1 表示未采样）
+            analyzed = stats['entries_processed'] - stats['sampled']
+            stats['sample_rate'] = round(analyzed / stats['entries_processed'], 4) if stats['entries_processed'] else 1
+            stats['sample_factor'] = self.sampler.peak_factor
 
-        # 保存威胁到数据库
-        level_thresholds = self.config.get('threat_levels', {})
-        for ip, threat in all_threats.items():
-            self.database.upsert_threat(threat, level_thresholds)
+        # 保存威胁和读取位置到数据库
+        all_threats = self._collect_threats(threat_ips, known_hits)
+        self._checkpoint(all_threats, persisted, backfill)
 
         stats['threats_found'] = len(all_threats)
         self.logger.info(f"发现 {len(all_threats)} 个威胁IP")
@@ -200,23 +549,156 @@ class Engine:
             exported_ips = [t['ip'] for t in unexported]
             self.database.mark_exported(exported_ips)
 
-        # 清理旧数据（备份到ip.txt同目录）
-        output_dir = os.path.dirname(os.path.abspath(self.exporter.output_file))
-        self.database.cleanup_old_data(output_dir=output_dir)
-
-        # 清除分析器状态
-        for analyzer in self.analyzers:
-            analyzer.clear()
+        # 清理旧数据（按清理间隔）
+        self.cleanup()
+
+        # 清除本次扫描的威胁记录，时间窗口状态裁剪后留给下次扫描继续累计
+        if backfill:
+            # 回溯扫描的窗口状态属于其他时间段，丢弃后恢复数据库中保存的状态
+            self._clear_analyzers()
+            self._load_analyzer_state()
+        elif not self._analyzer_state_enabled():
+            self._clear_analyzers()
+        elif self.shards:
+            self.shards.reset_threats()
+            self.shards.trim()
+        else:
+            for analyzer in self.analyzers:
+                analyzer.reset_threats()
+                analyzer.trim()
 
         self.logger.info(f"扫描完成，导出 {stats['threats_exported']} 个威胁IP")
         self.logger.info("=" * 50)
 
         return stats
 
+    def _clear_analyzers(self):
+        """清除所有分析器的威胁记录和窗口状态"""
+        if self.shards:
+            self.shards.clear()
+            return
+        for analyzer in self.analyzers:
+            analyzer.clear()
+
+    def _scan_batch(self, batch: List[LogEntry], analyzers: List, threat_ips: set, source_stats: Dict):
+        """扫描中分析一批记录，记下报告威胁的IP"""
+        sampled = self.sampler.sampled if self.sampler else 0
+        threats = self.analyze_batch(batch, analyzers, sample=True)
+        threat_ips.update(threat.ip for threat in threats)
+        source_stats['entries'] += len(batch)
+        source_stats['static'] += sum(1 for entry in batch if entry.extra.get('static'))
+        if self.sampler:
+            source_stats['sampled'] += self.sampler.sampled - sampled
+        source_stats['threats'] += len(threats)
+
+    def _bytes_read(self) -> int:
+        """所有收集器累计读取的字节数"""
+        return sum(c.bytes_read for c in self.collectors)
+
+    def _checkpoint(self, all_threats: Dict[str, ThreatInfo], persisted: Dict[str, tuple], backfill: bool = False):
+        """
+        检查点：在一个事务中写入上次检查点以来的威胁增量、当前读取位置和分析器窗口状态
+
+        Args:
+            all_threats: 本次扫描累计的威胁
+            persisted: 各IP已写入数据库的部分，写入后更新
+            backfill: 回溯扫描只写入威胁，不写入读取位置和窗口状态
+        """
+        deltas = []
+        for ip, threat in all_threats.items():
+            prev_score, prev_hits, prev_reasons = persisted.get(ip, (0, 0, 0))
+            if (threat.score == prev_score and threat.hit_count == prev_hits and
+                    len(threat.reasons) == prev_reasons):
+                continue
+            delta = threat.copy()
+            delta.score -= prev_score
+            delta.hit_count -= prev_hits
+            deltas.append(delta)
+            persisted[ip] = (threat.score, threat.hit_count, len(threat.reasons))
+
+        level_thresholds = self.config.get('threat_levels', {})
+        if backfill:
+            self.database.checkpoint(deltas, level_thresholds, {})
+        else:
+            # 日志行索引、访问日志先于读取位置落盘
+            if self.line_index:
+                self.line_index.flush()
+            if self.access_log:
+                self.access_log.flush()
+            states = {c.source_name: c.pop_dirty_state() for c in self.collectors}
+            self.database.checkpoint(deltas, level_thresholds, states, self._analyzer_snapshots())
+
+        if deltas:
+            self.logger.debug(f"检查点: 写入 {len(deltas)} 个威胁IP")
+
+    def lookup_lines(self, ip: str, limit: int = 200) -> List[Dict]:
+        """从日志行索引读取IP的原始日志行（未启用索引时返回空列表）"""
+        if not self.line_index:
+            return []
+        return self.line_index.lookup(normalize_ip(ip) or ip, limit=limit)
+
+    def cleanup(self, force: bool = False) -> bool:
+        """
+        清理过期数据（过期威胁IP备份到ip.txt同目录）
+
+        距上次清理不足 database.cleanup_interval_hours 时跳过；同时只有一个清理在执行。
+
+        Args:
+            force: 不检查清理间隔，立即清理
+
+        Returns:
+            是否执行了清理
+        """
+        if not self._cleanup_lock.acquire(blocking=False):
+            return False
+        try:
+            now = time.time()
+            if not force:
+                if self._next_cleanup is None:
+                    self._next_cleanup = self.database.get_last_cleanup() + self.cleanup_interval
+                if now < self._next_cleanup:
+                    return False
+
+            output_dir = os.path.dirname(os.path.abspath(self.exporter.output_file))
+            self.database.cleanup_old_data(output_dir=output_dir)
+            if self.line_index:
+                self.line_index.cleanup(self.database.retention_days)
+            if self.access_log:
+                self.access_log.cleanup(self.database.retention_days)
+            self._next_cleanup = now + self.cleanup_interval
+            return True
+        finally:
+            self._cleanup_lock.release()
+
+    def record_access(self, entries: List[LogEntry], whitelisted: bool = False):
+        """
+        把记录写入访问日志分区（未启用时忽略）
+
+        Args:
+            entries: 日志记录（已分析的记录带有静态资源标记）
+            whitelisted: 是否为白名单IP的记录（未分析，按配置决定是否写入）
+        """
+        if not self.access_log:
+            return
+        if whitelisted:
+            if not self.access_log.include_whitelisted:
+                return
+            if self.access_log.skip_static and self.static_filter:
+                self.static_filter.tag(entries)
+        self.access_log.extend(entries)
+
+    def flush_access_logs(self):
+        """写入内存中累计的访问日志"""
+        if self.access_log:
+            self.access_log.flush()
+
     def get_stats(self) -> Dict[str, Any]:
         """获取统计信息"""
         db_stats = self.database.get_stats()
         db_stats['exported_file'] = self.exporter.get_exported_count()
+        if self.access_log:
+            db_stats['logs']['total'] += self.access_log.count()
+            db_stats['logs']['partitions'] = len(self.access_log.partitions())
         return db_stats
 
     def export_all(self, min_level: str = 'LOW') -> int:
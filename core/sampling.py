@@ -0,0 +1,126 @@
+"""扫描积压时的自适应采样（降载）"""
+import time
+from typing import Dict, List, Tuple
+
+from utils.log_parser import LogEntry
+from utils.logger import get_logger
+
+
+class AdaptiveSampler:
+    """
+    扫描积压时的自适应采样
+
+    扫描开始时记下未读取的日志量，扫描过程中按最近的读取速度估算读完剩余日志的时间，
+    超出时间预算时把采样倍数翻倍（最多 max_factor），预算充裕时减半。
+    只对静态资源预分类标记的普通请求采样，且命中任一分析器预筛规则（敏感路径、恶意UA）的记录始终保留；
+    WAF、SSH 等其他来源不采样。
+
+    每个IP按自己的静态资源请求计数确定性地每 factor 条保留一条，
+    保留的记录带权重 extra['weight'] = factor，高频访问按权重计数。
+    """
+
+    def __init__(self, config: Dict = None):
+        """
+        Args:
+            config: load_shedding 配置 {time_budget_seconds, max_factor, adjust_seconds}
+        """
+        config = config or {}
+        self.time_budget = config.get('time_budget_seconds', 1800)
+        # 采样倍数取2的幂
+        max_factor = max(1, config.get('max_factor', 16))
+        self.max_factor = 1 << (max_factor.bit_length() - 1)
+        self.adjust_seconds = config.get('adjust_seconds', 5)
+        self.logger = get_logger()
+
+        self.factor = 1
+        self.peak_factor = 1
+        self.sampled = 0
+        self._counters: Dict[str, int] = {}
+        self._lag = 0
+        self._start_time = 0.0
+        self._start_bytes = 0
+        self._last_time = 0.0
+        self._last_bytes = 0
+
+    def start(self, lag_bytes: int, bytes_read: int):
+        """
+        扫描开始
+
+        Args:
+            lag_bytes: 未读取的日志量（字节）
+            bytes_read: 收集器当前累计读取的字节数
+        """
+        self.factor = 1
+        self.peak_factor = 1
+        self.sampled = 0
+        self._counters.clear()
+        self._lag = lag_bytes
+        self._start_time = self._last_time = time.time()
+        self._start_bytes = self._last_bytes = bytes_read
+
+    def adjust(self, bytes_read: int):
+        """按最近的读取速度和剩余时间预算调整采样倍数（每 adjust_seconds 秒最多调整一次）"""
+        now = time.time()
+        interval = now - self._last_time
+        if interval < self.adjust_seconds:
+            return
+        speed = (bytes_read - self._last_bytes) / interval
+        self._last_time = now
+        self._last_bytes = bytes_read
+        if speed <= 0:
+            return
+
+        remaining = max(0, self._lag - (bytes_read - self._start_bytes))
+        available = self.time_budget - (now - self._start_time)
+        projected = remaining / speed
+        if projected > available and self.factor < self.max_factor:
+            self.factor *= 2
+        elif projected * 2 < available and self.factor > 1:
+            self.factor //= 2
+        else:
+            return
+        self.peak_factor = max(self.peak_factor, self.factor)
+        self.logger.info(
+            f"降载采样: 剩余 {remaining / 1048576:.1f}MB，预计 {projected:.0f} 秒，"
+            f"剩余预算 {max(0, available):.0f} 秒，静态资源请求采样倍数调整为 {self.factor}"
+        )
+
+    def sample(self, entries: List[LogEntry], analyzers: List) -> List[LogEntry]:
+        """
+        对一批记录中的静态资源请求采样
+
+        Args:
+            entries: 已做静态资源预分类的记录
+            analyzers: 处理这些记录的分析器（任一分析器预筛命中的记录始终保留）
+
+        Returns:
+            保留的记录（保持原顺序）
+        """
+        factor = self.factor
+        if factor == 1:
+            return entries
+
+        kept = []
+        counters = self._counters
+        # 同一批内 (路径, UA) 重复很多，预筛结果只计算一次
+        screened: Dict[Tuple[str, str], bool] = {}
+        for entry in entries:
+            if not entry.extra.get('static'):
+                kept.append(entry)
+                continue
+            key = (entry.path, entry.user_agent)
+            hit = screened.get(key)
+            if hit is None:
+                hit = screened[key] = any(analyzer.screen(entry) for analyzer in analyzers)
+            if hit:
+                kept.append(entry)
+                continue
+
+            count = counters.get(entry.ip, 0)
+            counters[entry.ip] = count + 1
+            if count % factor == 0:
+                entry.extra['weight'] = factor
+                kept.append(entry)
+            else:
+                self.sampled += 1
+        return kept
@@ -0,0 +1,394 @@
+"""
+按IP分片的多进程分析
+
+分析器的所有状态都以IP为键，按IP哈希把记录分到多个进程后各进程之间无需协调：
+每个分析进程持有自己的一组分析器和状态表，只处理分到本分片的IP，
+每个IP的记录仍按原顺序交给同一组分析器，判定结果与单进程相同。
+主进程负责分派记录，汇总各进程报告的威胁和窗口状态快照后统一写入数据库。
+"""
+import atexit
+import multiprocessing
+import signal
+import threading
+import traceback
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from analyzers import (
+    BaseAnalyzer, FrequencyAnalyzer, PatternAnalyzer, StatusCodeAnalyzer, DistinctPathAnalyzer, SSHBruteforceAnalyzer,
+    ThreatInfo, IPStateTable
+)
+from utils.log_parser import LogEntry
+from utils.logger import get_logger
+
+
+def create_analyzers(config: Dict, state_table: IPStateTable) -> List[BaseAnalyzer]:
+    """创建共享同一状态表的一组分析器（主进程和各分析进程相同）"""
+    return [
+        FrequencyAnalyzer(config, state_table=state_table),
+        PatternAnalyzer(config, state_table=state_table),
+        StatusCodeAnalyzer(config, state_table=state_table),
+        DistinctPathAnalyzer(config, state_table=state_table),
+        SSHBruteforceAnalyzer(config, state_table=state_table)
+    ]
+
+
+def shard_of(ip: str, shards: int) -> int:
+    """IP所属的分片（crc32 在各进程中一致；内置 hash 对字符串按进程随机化，不能用于分片）"""
+    return zlib.crc32(ip.encode('utf-8', 'surrogatepass')) % shards
+
+
+def split_snapshot(snapshot: Dict[str, Any], shards: int) -> List[Dict[str, Any]]:
+    """
+    按IP把分析器快照拆成各分片的快照
+
+    快照中的字典以IP为键、列表为IP列表（如已标记IP），其余值（如 latest）每个分片都保留。
+    """
+    parts: List[Dict[str, Any]] = [{} for _ in range(shards)]
+    for key, value in snapshot.items():
+        if isinstance(value, dict):
+            for part in parts:
+                part[key] = {}
+            for ip, item in value.items():
+                parts[shard_of(ip, shards)][key][ip] = item
+        elif isinstance(value, list):
+            for part in parts:
+                part[key] = []
+            for ip in value:
+                parts[shard_of(ip, shards)][key].append(ip)
+        else:
+            for part in parts:
+                part[key] = value
+    return parts
+
+
+def merge_snapshots(snapshots: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """合并各分片的分析器快照：以IP为键的字典合并、IP列表拼接，latest 取最大"""
+    merged: Dict[str, Any] = {}
+    for snapshot in snapshots:
+        for key, value in snapshot.items():
+            if isinstance(value, dict):
+                merged.setdefault(key, {}).update(value)
+            elif isinstance(value, list):
+                merged.setdefault(key, []).extend(value)
+            elif key == 'latest':
+                if value is not None and (merged.get(key) is None or value > merged[key]):
+                    merged[key] = value
+                else:
+                    merged.setdefault(key, value)
+            else:
+                merged.setdefault(key, value)
+    return merged
+
+
+def _later(a: Optional[datetime], b: Optional[datetime]) -> Optional[datetime]:
+    """两个可能为空的时间中较晚的一个"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+
+class _ShardWorker:
+    """分析进程内的一组分析器（只处理分到本分片的IP）"""
+
+    def __init__(self, config: Dict, max_memory_mb: float):
+        self.state_table = IPStateTable(max_memory_mb=max_memory_mb)
+        self.analyzers = {
+            analyzer.name: analyzer for analyzer in create_analyzers(config, self.state_table)
+        }
+
+    def latest(self) -> Tuple[Dict[str, Optional[datetime]], Optional[datetime]]:
+        """各分析器和状态表已处理到的最新日志时间"""
+        return {name: analyzer.latest for name, analyzer in self.analyzers.items()}, self.state_table.latest
+
+    def sync(self, latest: Dict[str, datetime], table_latest: Optional[datetime]):
+        """把各分析器和状态表的最新日志时间推进到所有分片中的最大值，与单进程的时间线一致"""
+        for name, timestamp in latest.items():
+            if timestamp is not None:
+                self.analyzers[name].advance(timestamp)
+        self.state_table.latest = _later(self.state_table.latest, table_latest)
+
+    def analyze_batch(
+        self, entries: List[LogEntry], names: List[str],
+        latest: Dict[str, datetime], table_latest: Optional[datetime]
+    ) -> List[ThreatInfo]:
+        """
+        同步时间线后把本分片的记录依次交给各分析器（所有分析器处理完之前暂停状态表清理）
+
+        table_latest 为整批记录（包括其他分片的IP）的最新日志时间，批末清理与单进程按同一时间裁剪
+        """
+        self.sync(latest, table_latest)
+        threats = []
+        with self.state_table.deferred_sweep():
+            for name in names:
+                threats.extend(self.analyzers[name].analyze_batch(entries))
+        return threats
+
+    def threats(self, ips: Optional[List[str]]) -> Dict[str, Dict[str, ThreatInfo]]:
+        """各分析器对这些IP（None表示全部）的本次扫描威胁记录"""
+        found = {}
+        for name, analyzer in self.analyzers.items():
+            threats = analyzer.get_threats()
+            if ips is None:
+                found[name] = dict(threats)
+            else:
+                found[name] = {ip: threats[ip] for ip in ips if ip in threats}
+        return found
+
+    def snapshot(self, latest: Dict[str, datetime], table_latest: Optional[datetime]) -> Dict[str, Dict[str, Any]]:
+        """同步时间线后导出各分析器的快照"""
+        self.sync(latest, table_latest)
+        return {name: analyzer.snapshot() for name, analyzer in self.analyzers.items()}
+
+    def restore(self, snapshots: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+        """恢复各分析器的快照，返回恢复失败的分析器及原因（失败的分析器清空）"""
+        failed = {}
+        for name, snapshot in snapshots.items():
+            analyzer = self.analyzers.get(name)
+            if analyzer is None:
+                continue
+            try:
+                analyzer.restore(snapshot)
+            except Exception as e:
+                failed[name] = str(e)
+                analyzer.clear()
+        return failed
+
+    def clear(self):
+        """清除所有分析器的威胁记录和窗口状态"""
+        for analyzer in self.analyzers.values():
+            analyzer.clear()
+
+    def clear_analyzers(self, names: List[str]):
+        """清除指定分析器的威胁记录和窗口状态"""
+        for name in names:
+            self.analyzers[name].clear()
+
+    def reset_threats(self):
+        """只清除本次扫描的威胁记录"""
+        for analyzer in self.analyzers.values():
+            analyzer.reset_threats()
+
+    def trim(self, latest: Dict[str, datetime], table_latest: Optional[datetime]):
+        """同步时间线后丢弃窗口外的状态"""
+        self.sync(latest, table_latest)
+        for analyzer in self.analyzers.values():
+            analyzer.trim()
+
+
+def _worker_main(config: Dict, max_memory_mb: float, conn):
+    """
+    分析进程主循环：逐个执行主进程发来的 (命令, 参数)，
+    返回 ('ok', 结果, 最新日志时间) 或 ('error', 错误信息, None)
+    """
+    # 停止信号由主进程处理：主进程保存状态后发送 stop，或退出后连接关闭
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    worker = _ShardWorker(config, max_memory_mb)
+    while True:
+        try:
+            command, args = conn.recv()
+        except (EOFError, OSError):
+            return
+        if command == 'stop':
+            conn.close()
+            return
+        try:
+            result = getattr(worker, command)(*args)
+            conn.send(('ok', result, worker.latest()))
+        except Exception:
+            conn.send(('error', traceback.format_exc(), None))
+
+
+class ShardedAnalysis:
+    """
+    按IP分片的多进程分析
+
+    记录按 shard_of(ip) 分到各分析进程，主进程先向所有进程发出本批的分片再等待返回，
+    各进程并行分析。各分析器已处理到的最新日志时间在主进程汇总，
+    分析每批记录、导出快照和裁剪状态前同步给所有进程，窗口裁剪与单进程使用同一条时间线。
+    各进程的清理时机（按操作次数）与单进程不同，分析器的判定不能依赖清理时机
+    （如恶意模式分析按记录时间判断 state_ttl 过期）。
+
+    近似模式（frequency_sketch）下每个进程各有一份 Sketch，只统计本分片的IP，
+    估计值的碰撞比单进程少，结果与单进程不保证相同。
+    """
+
+    def __init__(self, config: Dict, workers: int):
+        """
+        Args:
+            config: 配置（各分析进程用同一配置创建分析器）
+            workers: 分析进程数
+        """
+        self.logger = get_logger()
+        self.workers = workers
+
+        # 状态表内存预算按进程平分
+        state_config = config.get('analyzer_state', {})
+        max_memory_mb = state_config.get('max_memory_mb', 512) / workers
+
+        # 各分析器、状态表在所有分片中的最新日志时间
+        self._latest: Dict[str, datetime] = {}
+        self._table_latest: Optional[datetime] = None
+        # 请求和响应必须成对，定时扫描与实时监控同时运行时串行访问
+        self._lock = threading.Lock()
+        self._closed = False
+
+        if config.get('frequency_sketch', {}).get('enabled', False):
+            self.logger.warning("高频检测近似模式下各分析进程的Sketch只统计本进程的IP，结果与单进程不完全相同")
+
+        context = multiprocessing.get_context()
+        self._conns = []
+        self._processes = []
+        for shard in range(workers):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=_worker_main,
+                args=(config, max_memory_mb, child_conn),
+                name=f'analyzer-shard-{shard}',
+                daemon=True
+            )
+            process.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._processes.append(process)
+
+        # 在 multiprocessing 的退出处理（终止并等待子进程）之前停止分析进程
+        atexit.register(self.close)
+        self.logger.info(f"已启动 {workers} 个分析进程（按IP分片）")
+
+    def _request(self, command: str, args_by_shard: Dict[int, tuple]) -> Dict[int, Any]:
+        """向各分片发送命令，等待全部返回（先全部发送，各进程并行执行）"""
+        with self._lock:
+            for shard, args in args_by_shard.items():
+                self._conns[shard].send((command, args))
+            results = {}
+            errors = []
+            for shard in args_by_shard:
+                try:
+                    status, result, latest = self._conns[shard].recv()
+                except (EOFError, OSError) as e:
+                    errors.append(f"分析进程 {shard} 已退出: {e!r}")
+                    continue
+                if status != 'ok':
+                    errors.append(f"分析进程 {shard} 执行 {command} 失败:\n{result}")
+                    continue
+                results[shard] = result
+                analyzer_latest, table_latest = latest
+                for name, timestamp in analyzer_latest.items():
+                    self._latest[name] = _later(self._latest.get(name), timestamp)
+                self._table_latest = _later(self._table_latest, table_latest)
+            if errors:
+                raise RuntimeError('\n'.join(errors))
+            return results
+
+    def _broadcast(self, command: str, *args) -> Dict[int, Any]:
+        """向所有分片发送同一命令"""
+        return self._request(command, {shard: args for shard in range(self.workers)})
+
+    def analyze_batch(self, entries: List[LogEntry], names: List[str]) -> List[ThreatInfo]:
+        """
+        按IP分片后并行分析一批记录
+
+        Args:
+            entries: 同一来源的日志记录
+            names: 处理这些记录的分析器名称（按顺序）
+
+        Returns:
+            各分析器报告的威胁（分析进程中累计对象的副本）
+        """
+        parts: List[List[LogEntry]] = [[] for _ in range(self.workers)]
+        newest = self._table_latest
+        for entry in entries:
+            parts[shard_of(entry.ip or '', self.workers)].append(entry)
+            if entry.timestamp and (newest is None or entry.timestamp > newest):
+                newest = entry.timestamp
+        # 各分片先把状态表时间线推进到整批的最新时间（只处理本分片IP的进程看不到其他IP的时间）
+        latest = dict(self._latest)
+        results = self._request('analyze_batch', {
+            shard: (part, names, latest, newest) for shard, part in enumerate(parts) if part
+        })
+        threats = []
+        for shard in sorted(results):
+            threats.extend(results[shard])
+        return threats
+
+    def get_threats(self, ips: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, ThreatInfo]]:
+        """各分析器对这些IP（None表示全部）的本次扫描威胁记录 {分析器名称: {ip: ThreatInfo}}"""
+        if ips is None:
+            results = self._broadcast('threats', None)
+        else:
+            parts: List[List[str]] = [[] for _ in range(self.workers)]
+            for ip in ips:
+                parts[shard_of(ip, self.workers)].append(ip)
+            results = self._request('threats', {shard: (part,) for shard, part in enumerate(parts) if part})
+        threats: Dict[str, Dict[str, ThreatInfo]] = {}
+        for shard in sorted(results):
+            for name, found in results[shard].items():
+                threats.setdefault(name, {}).update(found)
+        return threats
+
+    def snapshots(self) -> Dict[str, Dict[str, Any]]:
+        """合并后的各分析器快照（与单进程的快照格式相同）"""
+        results = self._broadcast('snapshot', dict(self._latest), self._table_latest)
+        names = results[0].keys() if results else []
+        return {
+            name: merge_snapshots(results[shard][name] for shard in sorted(results))
+            for name in names
+        }
+
+    def restore(self, snapshots: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+        """
+        按IP拆分快照后交给各分片恢复
+
+        Returns:
+            恢复失败的分析器及原因（该分析器在所有分片中清空）
+        """
+        parts: List[Dict[str, Dict[str, Any]]] = [{} for _ in range(self.workers)]
+        for name, snapshot in snapshots.items():
+            if not snapshot:
+                continue
+            for shard, part in enumerate(split_snapshot(snapshot, self.workers)):
+                parts[shard][name] = part
+        failed: Dict[str, str] = {}
+        for result in self._request('restore', {shard: (part,) for shard, part in enumerate(parts)}).values():
+            failed.update(result)
+        if failed:
+            # 部分分片恢复失败时整个分析器都不保留旧状态，与单进程一致
+            self._request('clear_analyzers', {shard: (list(failed),) for shard in range(self.workers)})
+            for name in failed:
+                self._latest.pop(name, None)
+        return failed
+
+    def clear(self):
+        """清除所有分析器的威胁记录和窗口状态"""
+        self._broadcast('clear')
+        self._latest.clear()
+
+    def reset_threats(self):
+        """只清除本次扫描的威胁记录，保留窗口状态"""
+        self._broadcast('reset_threats')
+
+    def trim(self):
+        """同步时间线后丢弃窗口外的状态"""
+        self._broadcast('trim', dict(self._latest), self._table_latest)
+
+    def close(self):
+        """停止所有分析进程"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for conn in self._conns:
+                try:
+                    conn.send(('stop', ()))
+                except (BrokenPipeError, OSError):
+                    pass
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
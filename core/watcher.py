@@ -8,88 +8,197 @@ from typing import List, Dict, Callable, Optional
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler, FileModifiedEvent
 
+from collectors.base import BaseCollector
+from storage.sink import ThreatSink
+from utils.log_parser import LogEntry, LOG_PARSERS, detect_log_format
 from utils.logger import get_logger
+from utils.path_utils import match_glob, has_magic, glob_base_dir, is_recursive_glob
 
 
 class LogFileHandler(FileSystemEventHandler):
-    """日志文件变化处理器"""
-
-    def __init__(self, callback: Callable[[str], None], patterns: List[str] = None):
+    """日志文件变化处理器
+
+    只负责把匹配的文件路径通知给回调，读取由回调方按各自保存的位置完成。
+    同一文件在合并窗口内的多次修改事件只触发一次回调，
+    繁忙日志每秒上千次的修改事件会被合并为一次读取。
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[str], None],
+        patterns: List[str] = None,
+        debounce_seconds: float = 0.2
+    ):
+        """
+        Args:
+            callback: 文件变化时的回调函数 callback(文件路径)
+            patterns: 完整路径的glob模式列表
+            debounce_seconds: 事件合并窗口（秒），0表示每个事件立即回调
+        """
         super().__init__()
         self.callback = callback
         self.patterns = patterns or ['*.log']
+        self.debounce_seconds = debounce_seconds
         self.logger = get_logger()
-
-        # 文件读取位置记录
-        self._file_positions: Dict[str, int] = {}
         self._lock = threading.Lock()
 
+        # 待处理文件 {filepath: 首个事件时间}（按事件先后排序）
+        self._pending: Dict[str, float] = {}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+    def start(self):
+        """启动事件合并线程"""
+        if self.debounce_seconds <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='watcher-debounce', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止事件合并线程并处理剩余事件"""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self._dispatch(list(self._pending))
+        self._pending.clear()
+
     def on_modified(self, event):
         """文件修改事件"""
-        if event.is_directory:
-            return
+        if not event.is_directory:
+            self._on_change(event.src_path)
+
+    def on_created(self, event):
+        """文件创建事件（监控启动后新建的日志文件）"""
+        if not event.is_directory:
+            self._on_change(event.src_path)
 
-        filepath = event.src_path
+    def on_moved(self, event):
+        """文件移动事件（如临时文件重命名为日志文件）"""
+        if not event.is_directory:
+            self._on_change(event.dest_path)
 
+    def _on_change(self, filepath: str):
+        """记录文件变化"""
         # 检查是否匹配模式
         if not self._match_patterns(filepath):
             return
 
-        # 读取新增内容
-        self._read_new_content(filepath)
+        if not self._running:
+            self._dispatch([filepath])
+            return
+
+        with self._cond:
+            if filepath not in self._pending:
+                was_empty = not self._pending
+                self._pending[filepath] = time.monotonic()
+                if was_empty:
+                    self._cond.notify()
+
+    def _run(self):
+        """合并窗口到期后批量回调"""
+        while True:
+            with self._cond:
+                while self._running:
+                    if self._pending:
+                        first = next(iter(self._pending.values()))
+                        wait = self.debounce_seconds - (time.monotonic() - first)
+                        if wait <= 0:
+                            break
+                        self._cond.wait(timeout=wait)
+                    else:
+                        self._cond.wait()
+                if not self._running:
+                    return
+
+                # 取出所有到期的文件
+                now = time.monotonic()
+                due = [p for p, t in self._pending.items() if now - t >= self.debounce_seconds]
+                for p in due:
+                    del self._pending[p]
+
+            self._dispatch(due)
+
+    def _dispatch(self, filepaths: List[str]):
+        """依次回调"""
+        for filepath in filepaths:
+            with self._lock:
+                try:
+                    self.callback(filepath)
+                except Exception as e:
+                    self.logger.error(f"处理文件变化失败 {filepath}: {e}")
 
     def _match_patterns(self, filepath: str) -> bool:
         """检查文件是否匹配模式"""
-        import fnmatch
-        filename = os.path.basename(filepath)
         for pattern in self.patterns:
-            if fnmatch.fnmatch(filename, pattern):
+            if match_glob(pattern, filepath):
                 return True
         return False
 
-    def _read_new_content(self, filepath: str):
-        """读取文件新增内容"""
-        with self._lock:
-            try:
-                current_size = os.path.getsize(filepath)
-                last_pos = self._file_positions.get(filepath, 0)
-
-                # 文件被截断，从头开始
-                if current_size < last_pos:
-                    last_pos = 0
-
-                if current_size == last_pos:
-                    return
-
-                with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-                    f.seek(last_pos)
-                    new_content = f.read()
-                    self._file_positions[filepath] = f.tell()
-
-                # 按行处理
-                for line in new_content.splitlines():
-                    if line.strip():
-                        self.callback(line)
-
-            except Exception as e:
-                self.logger.error(f"读取文件失败 {filepath}: {e}")
-
 
 class Watcher:
     """实时监控器"""
 
-    def __init__(self, paths: List[str], callback: Callable[[str], None]):
+    def __init__(
+        self,
+        paths: List[str],
+        callback: Callable[[str], None],
+        debounce_seconds: float = 0.2
+    ):
         """
         Args:
-            paths: 要监控的目录列表
-            callback: 收到新日志行时的回调函数
+            paths: 要监控的日志路径模式列表（支持 ** 递归模式）
+            callback: 日志文件变化时的回调函数 callback(文件路径)
+            debounce_seconds: 同一文件修改事件的合并窗口（秒）
         """
         self.paths = paths
         self.callback = callback
+        self.debounce_seconds = debounce_seconds
         self.logger = get_logger()
         self._observer: Optional[Observer] = None
+        self._handler: Optional[LogFileHandler] = None
         self._running = False
 
+    def _get_watch_dirs(self) -> Dict[str, bool]:
+        """
+        根据路径模式计算要监控的目录
+
+        Returns:
+            {目录: 是否递归}，已被递归监控的父目录覆盖的子目录会被去掉
+        """
+        watch_dirs: Dict[str, bool] = {}
+        for path_pattern in self.paths:
+            if has_magic(path_pattern):
+                # 通配符模式：取不含通配符的目录前缀，目录部分含通配符或 ** 时递归监控
+                watch_dir = glob_base_dir(path_pattern)
+                recursive = is_recursive_glob(path_pattern)
+            elif os.path.isdir(path_pattern):
+                watch_dir, recursive = path_pattern, False
+            else:
+                watch_dir, recursive = os.path.dirname(path_pattern) or '.', False
+
+            watch_dir = os.path.abspath(watch_dir)
+            if not os.path.isdir(watch_dir):
+                self.logger.warning(f"监控目录不存在: {watch_dir}")
+                continue
+            watch_dirs[watch_dir] = watch_dirs.get(watch_dir, False) or recursive
+
+        # 去掉被递归监控覆盖的目录
+        result = {}
+        for watch_dir, recursive in watch_dirs.items():
+            covered = any(
+                parent_recursive and parent != watch_dir
+                and watch_dir.startswith(parent.rstrip(os.sep) + os.sep)
+                for parent, parent_recursive in watch_dirs.items()
+            )
+            if not covered:
+                result[watch_dir] = recursive
+        return result
+
     def start(self, blocking: bool = True):
         """
         启动监控
@@ -104,30 +213,21 @@ class Watcher:
         signal.signal(signal.SIGTERM, self._signal_handler)
 
         self._observer = Observer()
-        handler = LogFileHandler(self.callback)
+        self._handler = LogFileHandler(self.callback, self.paths, self.debounce_seconds)
 
         # 监控所有配置的路径
-        watched_paths = set()
-        for path_pattern in self.paths:
-            # 如果是通配符模式，取目录部分
-            if '*' in path_pattern:
-                watch_dir = os.path.dirname(path_pattern)
-                if not watch_dir:
-                    watch_dir = '.'
-            else:
-                watch_dir = path_pattern if os.path.isdir(path_pattern) else os.path.dirname(path_pattern)
-
-            if watch_dir and os.path.exists(watch_dir) and watch_dir not in watched_paths:
-                self._observer.schedule(handler, watch_dir, recursive=False)
-                watched_paths.add(watch_dir)
-                self.logger.info(f"监控目录: {watch_dir}")
+        watch_dirs = self._get_watch_dirs()
+        for watch_dir, recursive in watch_dirs.items():
+            self._observer.schedule(self._handler, watch_dir, recursive=recursive)
+            self.logger.info(f"监控目录: {watch_dir}{' (递归)' if recursive else ''}")
 
-        if not watched_paths:
+        if not watch_dirs:
             self.logger.warning("没有找到可监控的目录")
             return
 
+        self._handler.start()
         self._observer.start()
-        self.logger.info(f"实时监控已启动，监控 {len(watched_paths)} 个目录")
+        self.logger.info(f"实时监控已启动，监控 {len(watch_dirs)} 个目录")
 
         if blocking:
             try:
@@ -145,6 +245,9 @@ class Watcher:
             self._observer.stop()
             self._observer.join(timeout=5)
             self._observer = None
+        if self._handler:
+            self._handler.stop()
+            self._handler = None
         self.logger.info("实时监控已停止")
 
     def _signal_handler(self, signum, frame):
@@ -153,18 +256,169 @@ class Watcher:
         self.stop()
 
 
+class FormatRouter:
+    """按文件缓存日志格式的解析器路由
+
+    每个文件只在首次出现（或inode变化）时读取开头若干行判断一次格式，
+    之后该文件的所有行直接交给对应解析器，不再逐个尝试所有解析器。
+    连续解析失败的行数超过阈值时，用最近的失败行重新判断格式。
+    """
+
+    # 判断格式时读取的文件开头字节数，重新判断时使用的失败行数
+    SNIFF_BYTES = 64 * 1024
+    SNIFF_LINES = 20
+    # 连续解析失败多少行后重新判断格式
+    MISMATCH_THRESHOLD = 50
+
+    def __init__(self):
+        self.logger = get_logger()
+        # {filepath: (inode, format)}
+        self._formats: Dict[str, tuple] = {}
+        # {filepath: 连续解析失败行数}
+        self._mismatches: Dict[str, int] = {}
+        # {filepath: 当前重新判断阈值}（重新判断结果不变时翻倍，避免反复判断）
+        self._thresholds: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def parse_lines(
+        self, filepath: str, lines: List[str], preferred: str = None
+    ) -> List[LogEntry]:
+        """
+        解析同一文件的若干行
+
+        Args:
+            filepath: 文件路径
+            lines: 日志行
+            preferred: 首选格式（文件所属收集器的日志源），文件开头无法判断时使用
+        """
+        fmt = self._get_format(filepath, lines, preferred)
+        if not fmt:
+            return []
+
+        parser = LOG_PARSERS[fmt]
+        entries = []
+        failed = []
+        for line in lines:
+            entry = parser(line)
+            if entry:
+                entries.append(entry)
+                self._mismatches[filepath] = 0
+            else:
+                failed.append(line)
+                self._mismatches[filepath] = self._mismatches.get(filepath, 0) + 1
+
+        threshold = self._thresholds.get(filepath, self.MISMATCH_THRESHOLD)
+        if failed and self._mismatches.get(filepath, 0) >= threshold:
+            entries.extend(self._resniff(filepath, fmt, failed))
+
+        return entries
+
+    def _get_format(
+        self, filepath: str, lines: List[str], preferred: str = None
+    ) -> Optional[str]:
+        """获取文件格式（按路径+inode缓存）"""
+        try:
+            inode = os.stat(filepath).st_ino
+        except OSError:
+            inode = 0
+
+        cached = self._formats.get(filepath)
+        if cached and cached[0] == inode:
+            if cached[1]:
+                return cached[1]
+            # 文件开头无法判断格式，只用新增行判断，不再重复读取文件开头
+            sample = lines
+        else:
+            sample = None
+
+        with self._lock:
+            if sample is None:
+                fmt = detect_log_format(self._read_head(filepath)) or detect_log_format(lines)
+            else:
+                fmt = detect_log_format(sample)
+            if not fmt and preferred in LOG_PARSERS:
+                fmt = preferred
+            self._formats[filepath] = (inode, fmt)
+            self._mismatches[filepath] = 0
+            self._thresholds.pop(filepath, None)
+            if fmt:
+                self.logger.info(f"识别日志格式: {filepath} -> {fmt}")
+        return fmt
+
+    def _read_head(self, filepath: str) -> List[str]:
+        """读取文件开头若干行"""
+        try:
+            with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
+                head = f.read(self.SNIFF_BYTES)
+        except IOError:
+            return []
+        return head.splitlines()
+
+    def _resniff(self, filepath: str, old_fmt: str, failed: List[str]) -> List[LogEntry]:
+        """格式疑似变化时用失败行重新判断，返回用新解析器补解析出的记录"""
+        sample = failed[-self.SNIFF_LINES:]
+        new_fmt = detect_log_format(sample)
+        self._mismatches[filepath] = 0
+
+        if not new_fmt or new_fmt == old_fmt:
+            # 格式没变（如syslog中的非sshd行），放宽阈值
+            self._thresholds[filepath] = self._thresholds.get(filepath, self.MISMATCH_THRESHOLD) * 2
+            return []
+
+        inode = self._formats.get(filepath, (0, None))[0]
+        self._formats[filepath] = (inode, new_fmt)
+        self._thresholds.pop(filepath, None)
+        self.logger.info(f"日志格式变化: {filepath} {old_fmt} -> {new_fmt}")
+
+        parser = LOG_PARSERS[new_fmt]
+        return [entry for entry in (parser(line) for line in failed) if entry]
+
+    def forget(self, filepath: str):
+        """清除文件的格式缓存"""
+        self._formats.pop(filepath, None)
+        self._mismatches.pop(filepath, None)
+        self._thresholds.pop(filepath, None)
+
+
 class RealtimeEngine:
-    """实时分析引擎"""
+    """实时分析引擎
+
+    文件变化时找到负责该文件的收集器，从收集器保存的位置（偏移量+inode）
+    按块读取新增内容，并定期保存读取位置，重启后既不重复处理也不遗漏。
+    """
+
+    # 每批处理的行数
+    BATCH_LINES = 5000
 
     def __init__(self, engine):
         """
         Args:
             engine: Engine实例
         """
-        from core.engine import Engine
         self.engine = engine
         self.logger = get_logger()
         self._watcher: Optional[Watcher] = None
+        self._router = FormatRouter()
+
+        realtime_config = engine.config.get('realtime', {})
+        self.state_save_interval = realtime_config.get('state_save_interval', 10)
+        self.debounce_seconds = realtime_config.get('debounce_ms', 200) / 1000.0
+
+        # 检测结果由后台线程批量写入数据库和导出文件
+        self._sink = ThreatSink(
+            engine.database,
+            engine.exporter,
+            level_thresholds=engine.config.get('threat_levels', {}),
+            batch_size=realtime_config.get('sink_batch_size', 500),
+            max_latency=realtime_config.get('sink_max_latency_ms', 200) / 1000.0
+        )
+        self._sink_stopped = False
+
+        # {filepath: collector}
+        self._owners: Dict[str, Optional[BaseCollector]] = {}
+        self._dirty_collectors: set = set()
+        self._last_save = time.time()
+        self._lock = threading.Lock()
 
     def start(self):
         """启动实时监控"""
@@ -175,52 +429,131 @@ class RealtimeEngine:
 
         self.logger.info(f"启动实时监控，监控 {len(paths)} 个路径模式")
 
-        self._watcher = Watcher(paths, self._process_line)
-        self._watcher.start(blocking=True)
-
-    def _process_line(self, line: str):
-        """处理单行日志"""
-        from utils.log_parser import parse_nginx_log, parse_waf_log, parse_free_waf_log, parse_ssh_log
-        from utils.ip_utils import normalize_ip
-
-        # 尝试解析
-        entry = None
-        for parser in [parse_nginx_log, parse_waf_log, parse_free_waf_log, parse_ssh_log]:
-            entry = parser(line)
-            if entry:
-                break
-
-        if not entry:
+        self._sink.start()
+        self._watcher = Watcher(paths, self._on_file_changed, self.debounce_seconds)
+        try:
+            self._watcher.start(blocking=True)
+        finally:
+            with self._lock:
+                self._save_state()
+            self._stop_sink()
+
+    def _find_collector(self, filepath: str) -> Optional[BaseCollector]:
+        """查找负责该文件的收集器"""
+        if filepath not in self._owners:
+            self._owners[filepath] = next(
+                (c for c in self.engine.collectors if c.owns(filepath)), None
+            )
+        return self._owners[filepath]
+
+    def _on_file_changed(self, filepath: str):
+        """文件变化：从收集器保存的位置读取新增内容"""
+        collector = self._find_collector(filepath)
+        if collector is None:
             return
 
-        # 白名单过滤
-        ip = normalize_ip(entry.ip)
-        if not ip or self.engine.whitelist_manager.is_whitelisted(ip):
+        with self._lock:
+            batch = []
+            for line in collector.read_lines(filepath, incremental=True, keep_partial=True):
+                if not line.strip():
+                    continue
+                batch.append(line)
+                if len(batch) >= self.BATCH_LINES:
+                    self._process_lines(filepath, batch, collector.source_name)
+                    batch = []
+            if batch:
+                self._process_lines(filepath, batch, collector.source_name)
+
+            self._dirty_collectors.add(collector)
+            if time.time() - self._last_save >= self.state_save_interval:
+                self._save_state()
+
+    def _save_state(self):
+        """保存有变化的收集器的读取位置和分析器窗口状态（先写入已检测到的威胁，再保存位置），并安排清理过期数据"""
+        self._last_save = time.time()
+        # 分析器持有的累计记录（包括报告后继续累计的命中）全部交给写入器
+        for name, threats in self.engine.threat_records().items():
+            for threat in threats.values():
+                self._sink.submit(name, threat)
+        if not self._sink.flush():
+            # 威胁未写入时不保存读取位置，重启后重新读取这部分日志；下个保存间隔重试
+            self.logger.warning("威胁IP写入失败，本次不保存读取位置")
             return
+        # 已全部写入数据库：释放分析器的累计记录，实时运行时不随IP数增长（窗口状态保留）
+        self.engine.reset_threats()
+        self._sink.reset()
+        self.engine.flush_access_logs()
+        for collector in self._dirty_collectors:
+            try:
+                collector.save_state()
+            except Exception as e:
+                self.logger.error(f"[{collector.source_name}] 保存读取位置失败: {e}")
+        self._dirty_collectors.clear()
+        try:
+            self.engine.save_analyzer_state()
+        except Exception as e:
+            self.logger.error(f"保存分析器状态失败: {e}")
+        # 实时模式没有扫描结束的时机，按清理间隔清理过期数据；
+        # 分批删除和备份耗时较长，交给写入器的后台线程执行，不阻塞文件变化事件
+        self._sink.run_later(self._cleanup)
+
+    def _cleanup(self):
+        """清理过期数据（在写入器后台线程中执行，未到清理间隔时直接返回）"""
+        try:
+            self.engine.cleanup()
+        except Exception as e:
+            self.logger.error(f"清理过期数据失败: {e}")
+
+    def _process_lines(self, filepath: str, lines: List[str], source: str = None):
+        """处理同一文件的新增日志行：过滤白名单后按来源批量分析"""
+        from utils.ip_utils import normalize_ip
 
-        # 分析
-        for analyzer in self.engine.analyzers:
-            threat = analyzer.analyze(entry)
-            if threat:
-                # 保存到数据库
-                level_thresholds = self.engine.config.get('threat_levels', {})
-                self.engine.database.upsert_threat(threat, level_thresholds)
-
-                # 立即导出
-                threat_dict = {
-                    'ip': threat.ip,
-                    'threat_level': threat.get_level(level_thresholds),
-                    'reasons': threat.reasons,
-                    'hit_count': threat.hit_count,
-                    'first_seen': threat.first_seen.isoformat() if threat.first_seen else None,
-                    'last_seen': threat.last_seen.isoformat() if threat.last_seen else None
-                }
-                self.engine.exporter.export([threat_dict], append=True)
-                self.engine.database.mark_exported([threat.ip])
-
-                self.logger.info(f"发现威胁IP: {threat.ip} - {','.join(threat.reasons)}")
+        batches: Dict[str, List[LogEntry]] = {}
+        whitelisted: List[LogEntry] = []
+        for entry in self._router.parse_lines(filepath, lines, preferred=source):
+            # 白名单过滤
+            ip = normalize_ip(entry.ip)
+            if not ip:
+                continue
+            if self.engine.whitelist_manager.is_whitelisted(ip):
+                if self.engine.access_log:
+                    whitelisted.append(entry)
+                continue
+
+            batches.setdefault(entry.source, []).append(entry)
+
+        for entries in batches.values():
+            self._analyze(entries)
+            self.engine.record_access(entries)
+        if whitelisted:
+            self.engine.record_access(whitelisted, whitelisted=True)
+
+    def _analyze(self, entries: List[LogEntry]):
+        """批量分析同一来源的日志记录，各分析器对报告威胁的IP的累计记录交给后台写入器"""
+        ips = list({threat.ip for threat in self.engine.analyze_batch(entries)})
+        if not ips:
+            return
+        for name, threats in self.engine.threat_records(ips).items():
+            for threat in threats.values():
+                self._sink.submit(name, threat)
 
     def stop(self):
         """停止"""
         if self._watcher:
             self._watcher.stop()
+        with self._lock:
+            self._save_state()
+        self._stop_sink()
+
+    def _stop_sink(self):
+        """停止后台写入器并输出延迟统计"""
+        if self._sink_stopped:
+            return
+        self._sink_stopped = True
+        self._sink.stop()
+        stats = self._sink.get_stats()
+        self.logger.info(
+            f"实时写入统计: 提交 {stats['submitted']} 次, 写入 {stats['flushed']} 个IP/{stats['batches']} 批, "
+            f"检测到导出延迟 平均 {stats['latency_avg_ms']}ms, "
+            f"P95 {stats['latency_p95_ms']}ms, 最大 {stats['latency_max_ms']}ms"
+        )
@@ -11,6 +11,7 @@ QQ: 42033223
 import os
 import sys
 import argparse
+from datetime import datetime
 
 __version__ = '1.0.0'
 __author__ = 'sinma'
@@ -25,6 +26,20 @@ from core.engine import Engine
 from core.scheduler import Scheduler, SimpleScheduler
 from core.watcher import RealtimeEngine
 from utils.logger import get_logger
+from utils.log_parser import to_utc
+
+
+def parse_time_arg(value: str) -> datetime:
+    """解析命令行时间参数（无时区时按本地时间），返回UTC时间（无时区标记）"""
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return to_utc(datetime.strptime(value, fmt))
+        except ValueError:
+            continue
+    try:
+        return to_utc(datetime.fromisoformat(value))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无法解析时间: {value}（格式如 2025-12-09 02:00）")
 
 
 def start_web_if_enabled(config: dict, database_path: str, logger):
@@ -40,12 +55,15 @@ def start_web_if_enabled(config: dict, database_path: str, logger):
         host = web_config.get('host', '0.0.0.0')
         port = web_config.get('port', 5000)
         password = web_config.get('password', '')
+        index_config = config.get('line_index', {})
+        line_index = index_config.get('path', './data/line_index') if index_config.get('enabled', False) else ''
 
         thread = start_web_server(
             host=host,
             port=port,
             database=database_path,
-            password=password
+            password=password,
+            line_index=line_index
         )
 
         logger.info(f"Web 管理界面已启动: http://{host}:{port}")
@@ -71,10 +89,14 @@ def main():
 示例:
   python main.py                    # 使用配置文件中的模式运行
   python main.py --once             # 执行一次扫描后退出
+  python main.py --since "2025-12-09 02:00" --until "2025-12-09 04:00"
+                                    # 回溯分析该时间段的日志（不改变增量读取位置）
   python main.py --mode scheduled   # 定时扫描模式
   python main.py --mode realtime    # 实时监控模式
   python main.py --export           # 导出所有威胁IP到文件
   python main.py --stats            # 显示统计信息
+  python main.py --cleanup          # 立即清理过期数据
+  python main.py --lines 1.2.3.4    # 显示该IP最近的原始日志行（需启用 line_index）
   python main.py --no-web           # 禁用Web界面
 
 作者: {__author__}
@@ -112,6 +134,18 @@ def main():
         help='全量扫描 (不使用增量)'
     )
 
+    parser.add_argument(
+        '--since',
+        type=parse_time_arg,
+        help='回溯扫描起始时间，本地时间 (如 "2025-12-09 02:00")，扫描后退出'
+    )
+
+    parser.add_argument(
+        '--until',
+        type=parse_time_arg,
+        help='回溯扫描截止时间（不含），本地时间，扫描后退出'
+    )
+
     parser.add_argument(
         '--export',
         action='store_true',
@@ -131,6 +165,25 @@ def main():
         help='显示统计信息'
     )
 
+    parser.add_argument(
+        '--cleanup',
+        action='store_true',
+        help='立即清理过期数据 (不检查 database.cleanup_interval_hours)'
+    )
+
+    parser.add_argument(
+        '--lines',
+        metavar='IP',
+        help='从日志行索引显示该IP的原始日志行 (需启用 line_index)'
+    )
+
+    parser.add_argument(
+        '--limit',
+        type=int,
+        default=200,
+        help='--lines 显示的最多行数，取最近的行 (默认: 200)'
+    )
+
     parser.add_argument(
         '--no-web',
         action='store_true',
@@ -166,6 +219,23 @@ def main():
         print(f"  - 未导出: {stats['threats']['unexported']}")
         print(f"\n输出文件中: {stats['exported_file']} 个IP")
         print(f"访问日志记录: {stats['logs']['total']} 条")
+        if 'partitions' in stats['logs']:
+            print(f"访问日志分区: {stats['logs']['partitions']} 个")
+        return
+
+    # 清理过期数据
+    if args.cleanup:
+        engine.cleanup(force=True)
+        print("过期数据清理完成")
+        return
+
+    # 显示IP的原始日志行
+    if args.lines:
+        if not engine.line_index:
+            print("未启用日志行索引，请在 config.yaml 中设置 line_index.enabled: true")
+            sys.exit(1)
+        for item in engine.lookup_lines(args.lines, limit=args.limit):
+            print(item['line'])
         return
 
     # 导出所有
@@ -174,12 +244,25 @@ def main():
         print(f"已导出 {count} 个威胁IP (等级 >= {args.min_level})")
         return
 
+    # 回溯扫描（只分析指定时间段，不改变增量读取位置）
+    if args.since or args.until:
+        if args.since and args.until and args.since >= args.until:
+            print("回溯扫描的起始时间必须早于截止时间")
+            sys.exit(1)
+        args.once = True
+
     # 单次扫描
     if args.once:
         logger.info("执行单次扫描")
-        stats = engine.scan(incremental=not args.full)
+        stats = engine.scan(incremental=not args.full, since=args.since, until=args.until)
         print(f"\n扫描完成:")
         print(f"  - 处理日志: {stats['entries_processed']} 条")
+        if stats['static_skipped']:
+            ratio = stats['static_skipped'] / stats['entries_processed']
+            print(f"  - 静态资源(跳过注入规则): {stats['static_skipped']} 条 ({ratio:.1%})")
+        if stats['sampled']:
+            print(f"  - 降载采样: 跳过 {stats['sampled']} 条静态资源请求，"
+                  f"分析 {stats['sample_rate']:.1%}（最高 1/{stats['sample_factor']}）")
         print(f"  - 发现威胁: {stats['threats_found']} 个IP")
         print(f"  - 已导出: {stats['threats_exported']} 个IP")
         return
@@ -201,7 +284,11 @@ def main():
     if mode == 'scheduled':
         # 定时扫描模式
         scheduler = Scheduler(interval_seconds=interval)
-        scheduler.start(lambda: engine.scan(incremental=True))
+        try:
+            scheduler.start(lambda: engine.scan(incremental=True))
+        finally:
+            # 保存分析器窗口状态，重启后继续累计
+            engine.save_analyzer_state()
 
     elif mode == 'realtime':
         # 实时监控模式
@@ -1,4 +1,7 @@
 from .database import Database
 from .exporter import Exporter
+from .sink import ThreatSink
+from .line_index import LineIndex
+from .access_log import AccessLogStore
 
-__all__ = ['Database', 'Exporter']
+__all__ = ['Database', 'Exporter', 'ThreatSink', 'LineIndex', 'AccessLogStore']
@@ -0,0 +1,190 @@
+"""访问日志分区存储：按日期分文件批量写入"""
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Tuple
+
+from utils.log_parser import LogEntry
+from utils.logger import get_logger
+
+
+def _utc_now() -> datetime:
+    """获取当前 UTC 时间（无时区标记）"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# 分区文件名 access_YYYYMMDD.db
+_PARTITION = re.compile(r'^access_(\d{8})\.db$')
+
+
+class AccessLogStore:
+    """
+    访问日志分区存储
+
+    每天（按日志时间，UTC）一个SQLite文件，表结构与主库的 access_logs 相同（不含 created_at）。
+    记录先在内存中累计，达到 batch_size 或检查点时按分区用 executemany 在一个事务中写入；
+    分区只追加，清理过期数据时直接删除整个分区文件，不需要逐行 DELETE。
+    检查点之间崩溃时，重新读取的日志可能在分区中重复（至少写入一次）。
+    """
+
+    def __init__(
+        self,
+        path: str = './data/access_logs',
+        batch_size: int = 5000,
+        skip_static: bool = False,
+        include_whitelisted: bool = False,
+        max_open: int = 4
+    ):
+        """
+        Args:
+            path: 分区文件目录
+            batch_size: 内存中累计的记录数达到此值时写入
+            skip_static: 不写入已标记的静态资源请求（需要启用 static_assets）
+            include_whitelisted: 是否写入白名单IP的记录
+            max_open: 保持打开的分区连接数（日志时间集中在最近几天）
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.skip_static = skip_static
+        self.include_whitelisted = include_whitelisted
+        self.max_open = max(1, max_open)
+        self.logger = get_logger()
+        self._lock = threading.Lock()
+        # 待写入 {分区日期: [行, ...]}
+        self._pending: Dict[str, List[Tuple]] = {}
+        self._pending_count = 0
+        # 已打开的分区连接（按最近使用排序）
+        self._conns: Dict[str, sqlite3.Connection] = {}
+        self.written = 0
+        os.makedirs(path, exist_ok=True)
+
+    def add(self, entry: LogEntry):
+        """累计一条记录"""
+        self.extend((entry,))
+
+    def extend(self, entries: Iterable[LogEntry]):
+        """累计一批记录（按配置跳过静态资源请求）"""
+        with self._lock:
+            for entry in entries:
+                if self.skip_static and entry.extra.get('static'):
+                    continue
+                timestamp = entry.timestamp or _utc_now()
+                day = timestamp.strftime('%Y%m%d')
+                rows = self._pending.get(day)
+                if rows is None:
+                    rows = self._pending[day] = []
+                rows.append((
+                    timestamp.isoformat(), entry.ip, entry.source, entry.method,
+                    entry.path, entry.status, entry.user_agent
+                ))
+                self._pending_count += 1
+            if self._pending_count >= self.batch_size:
+                self._flush()
+
+    def flush(self):
+        """写入内存中累计的所有记录"""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        count, self._pending_count = self._pending_count, 0
+        for day in sorted(pending):
+            try:
+                conn = self._connect(day)
+                with conn:
+                    conn.executemany('''
+                        INSERT INTO access_logs (timestamp, ip, source, method, path, status, user_agent)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', pending[day])
+            except sqlite3.Error as e:
+                count -= len(pending[day])
+                self.logger.error(f"写入访问日志分区 {day} 失败: {e}")
+        self.written += count
+
+    def _partition_path(self, day: str) -> str:
+        return os.path.join(self.path, f'access_{day}.db')
+
+    def _connect(self, day: str) -> sqlite3.Connection:
+        """取得分区连接（不存在时创建分区），超出 max_open 时关闭最久未用的连接"""
+        conn = self._conns.pop(day, None)
+        if conn is None:
+            conn = sqlite3.connect(self._partition_path(day), check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS access_logs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp DATETIME,
+                    ip TEXT,
+                    source TEXT,
+                    method TEXT,
+                    path TEXT,
+                    status INTEGER,
+                    user_agent TEXT
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_ip ON access_logs(ip)')
+            conn.commit()
+        self._conns[day] = conn
+        while len(self._conns) > self.max_open:
+            oldest = next(iter(self._conns))
+            self._conns.pop(oldest).close()
+        return conn
+
+    def partitions(self) -> List[str]:
+        """已有的分区日期（YYYYMMDD，升序）"""
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return []
+        return sorted(m.group(1) for m in map(_PARTITION.match, names) if m)
+
+    def count(self) -> int:
+        """所有分区的记录数（分区只追加，取最大行号即可，不扫描整表）"""
+        self.flush()
+        total = 0
+        for day in self.partitions():
+            try:
+                conn = sqlite3.connect(self._partition_path(day))
+                try:
+                    total += conn.execute('SELECT MAX(rowid) FROM access_logs').fetchone()[0] or 0
+                finally:
+                    conn.close()
+            except sqlite3.Error:
+                continue
+        return total
+
+    def cleanup(self, retention_days: int):
+        """删除日志日期早于保留天数的整个分区"""
+        if retention_days <= 0:
+            return
+        cutoff = (_utc_now() - timedelta(days=retention_days)).strftime('%Y%m%d')
+        with self._lock:
+            expired = [day for day in self.partitions() if day < cutoff]
+            for day in expired:
+                self._pending.pop(day, None)
+                conn = self._conns.pop(day, None)
+                if conn is not None:
+                    conn.close()
+                path = self._partition_path(day)
+                for suffix in ('', '-wal', '-shm'):
+                    try:
+                        os.remove(path + suffix)
+                    except OSError:
+                        pass
+            self._pending_count = sum(len(rows) for rows in self._pending.values())
+        if expired:
+            self.logger.info(f"清理了 {len(expired)} 个过期访问日志分区 ({expired[0]} ~ {expired[-1]})")
+
+    def close(self):
+        """写入剩余记录并关闭连接"""
+        with self._lock:
+            self._flush()
+            for conn in self._conns.values():
+                conn.close()
+            self._conns.clear()
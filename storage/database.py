@@ -1,6 +1,8 @@
 """SQLite数据库操作"""
 import os
+import gzip
 import json
+import time
 import sqlite3
 from datetime import datetime, timedelta, timezone
 from typing import Dict, List, Optional, Any
@@ -18,10 +20,19 @@ from utils.logger import get_logger
 class Database:
     """SQLite数据库管理"""
 
-    def __init__(self, db_path: str = './data/ipcollect.db', retention_days: int = 30, threat_retention_days: int = 0):
+    def __init__(
+        self,
+        db_path: str = './data/ipcollect.db',
+        retention_days: int = 30,
+        threat_retention_days: int = 0,
+        samples_per_ip: int = 10,
+        cleanup_chunk_size: int = 5000
+    ):
         self.db_path = db_path
         self.retention_days = retention_days
         self.threat_retention_days = threat_retention_days  # 0表示永久保留
+        self.samples_per_ip = samples_per_ip  # 每个IP保留的证据样本数
+        self.cleanup_chunk_size = max(1, cleanup_chunk_size)  # 清理时每个事务删除的行数
         self.logger = get_logger()
         self._init_db()
 
@@ -66,11 +77,56 @@ class Database:
                 )
             ''')
 
+            # 威胁IP的证据样本（每个IP只保留最近 samples_per_ip 条）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS threat_samples (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ip TEXT NOT NULL,
+                    timestamp TEXT NOT NULL DEFAULT '',
+                    path TEXT,
+                    status INTEGER,
+                    user_agent TEXT,
+                    rule TEXT,
+                    UNIQUE (ip, timestamp, path, rule)
+                )
+            ''')
+
+            # 收集器读取位置（与威胁记录在同一事务中提交）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS collector_state (
+                    source TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (source, path)
+                )
+            ''')
+
+            # 分析器时间窗口状态（跨扫描、跨重启保留）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS analyzer_state (
+                    name TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # 维护任务的上次执行时间
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS maintenance (
+                    task TEXT PRIMARY KEY,
+                    last_run REAL NOT NULL
+                )
+            ''')
+
             # 索引
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_threat_ip ON threat_ips(ip)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_threat_level ON threat_ips(threat_level)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_logs_ip ON access_logs(ip)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON access_logs(timestamp)')
+            # 过期清理按这两列查找
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_logs_created_at ON access_logs(created_at)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_threat_last_seen ON threat_ips(last_seen)')
 
             conn.commit()
 
@@ -86,63 +142,209 @@ class Database:
 
     def upsert_threat(self, threat: ThreatInfo, level_thresholds: Dict[str, int] = None):
         """插入或更新威胁IP"""
+        self.upsert_threats([threat], level_thresholds)
+
+    def upsert_threats(
+        self,
+        threats: List[ThreatInfo],
+        level_thresholds: Dict[str, int] = None,
+        exported: bool = False
+    ):
+        """批量插入或更新威胁IP（单个事务）
+
+        Args:
+            threats: 威胁信息列表
+            level_thresholds: 威胁等级阈值
+            exported: 写入后是否直接标记为已导出（调用方已先写入导出文件）
+        """
+        if not threats:
+            return
+
         if level_thresholds is None:
             level_thresholds = {'LOW': 2, 'MEDIUM': 4, 'HIGH': 6, 'CRITICAL': 8}
 
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+            for threat in threats:
+                self._upsert_threat(cursor, threat, level_thresholds, exported)
+            self._write_samples(cursor, threats)
+            conn.commit()
+
+    def _upsert_threat(
+        self, cursor, threat: ThreatInfo, level_thresholds: Dict[str, int], exported: bool
+    ):
+        """在给定游标上插入或更新单个威胁IP"""
         threat_level = threat.get_level(level_thresholds)
         reasons_json = json.dumps(threat.reasons, ensure_ascii=False)
 
-        with self._get_conn() as conn:
-            cursor = conn.cursor()
+        # 检查是否存在
+        cursor.execute('SELECT id, score, reasons, hit_count FROM threat_ips WHERE ip = ?', (threat.ip,))
+        existing = cursor.fetchone()
 
-            # 检查是否存在
-            cursor.execute('SELECT id, score, reasons, hit_count FROM threat_ips WHERE ip = ?', (threat.ip,))
-            existing = cursor.fetchone()
+        if not existing and not threat.reasons:
+            # 只有命中次数的增量（实时模式释放后再次命中），数据库中已没有该IP时不再插入
+            return
 
-            if existing:
-                # 更新
-                old_reasons = json.loads(existing['reasons']) if existing['reasons'] else []
-                merged_reasons = list(set(old_reasons + threat.reasons))
-                new_score = existing['score'] + threat.score
-                new_hit_count = existing['hit_count'] + threat.hit_count
+        if existing:
+            # 更新
+            old_reasons = json.loads(existing['reasons']) if existing['reasons'] else []
+            merged_reasons = list(set(old_reasons + threat.reasons))
+            new_score = existing['score'] + threat.score
+            new_hit_count = existing['hit_count'] + threat.hit_count
 
-                # 重新计算等级
-                temp_threat = ThreatInfo(ip=threat.ip, score=new_score)
-                new_level = temp_threat.get_level(level_thresholds)
+            # 重新计算等级
+            temp_threat = ThreatInfo(ip=threat.ip, score=new_score)
+            new_level = temp_threat.get_level(level_thresholds)
 
-                cursor.execute('''
-                    UPDATE threat_ips SET
-                        score = ?,
-                        threat_level = ?,
-                        reasons = ?,
-                        hit_count = ?,
-                        last_seen = ?,
-                        updated_at = CURRENT_TIMESTAMP,
-                        exported = 0
-                    WHERE ip = ?
-                ''', (
-                    new_score,
-                    new_level,
-                    json.dumps(merged_reasons, ensure_ascii=False),
-                    new_hit_count,
-                    threat.last_seen.isoformat() if threat.last_seen else _utc_now().isoformat(),
-                    threat.ip
-                ))
-            else:
-                # 插入
-                cursor.execute('''
-                    INSERT INTO threat_ips (ip, score, threat_level, reasons, hit_count, first_seen, last_seen)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    threat.ip,
-                    threat.score,
-                    threat_level,
-                    reasons_json,
-                    threat.hit_count,
-                    threat.first_seen.isoformat() if threat.first_seen else _utc_now().isoformat(),
-                    threat.last_seen.isoformat() if threat.last_seen else _utc_now().isoformat()
-                ))
+            cursor.execute('''
+                UPDATE threat_ips SET
+                    score = ?,
+                    threat_level = ?,
+                    reasons = ?,
+                    hit_count = ?,
+                    last_seen = ?,
+                    updated_at = CURRENT_TIMESTAMP,
+                    exported = ?
+                WHERE ip = ?
+            ''', (
+                new_score,
+                new_level,
+                json.dumps(merged_reasons, ensure_ascii=False),
+                new_hit_count,
+                threat.last_seen.isoformat() if threat.last_seen else _utc_now().isoformat(),
+                1 if exported else 0,
+                threat.ip
+            ))
+        else:
+            # 插入
+            cursor.execute('''
+                INSERT INTO threat_ips (ip, score, threat_level, reasons, hit_count, first_seen, last_seen, exported)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                threat.ip,
+                threat.score,
+                threat_level,
+                reasons_json,
+                threat.hit_count,
+                threat.first_seen.isoformat() if threat.first_seen else _utc_now().isoformat(),
+                threat.last_seen.isoformat() if threat.last_seen else _utc_now().isoformat(),
+                1 if exported else 0
+            ))
+
+    def _write_samples(self, cursor, threats: List[ThreatInfo]):
+        """
+        批量写入威胁IP的证据样本，再把这些IP的样本裁剪到最近 samples_per_ip 条
+
+        检查点每次带上分析器持有的全部样本，已写入的样本按唯一约束跳过
+        """
+        if self.samples_per_ip <= 0:
+            return
+        rows = [
+            (
+                threat.ip,
+                timestamp.isoformat() if timestamp else '',
+                path, status, user_agent, rule
+            )
+            for threat in threats
+            for timestamp, path, status, user_agent, rule in threat.samples
+        ]
+        if not rows:
+            return
+        cursor.executemany('''
+            INSERT OR IGNORE INTO threat_samples (ip, timestamp, path, status, user_agent, rule)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+        ips = {row[0] for row in rows}
+        cursor.executemany('''
+            DELETE FROM threat_samples WHERE ip = ? AND id NOT IN (
+                SELECT id FROM threat_samples WHERE ip = ? ORDER BY timestamp DESC, id DESC LIMIT ?
+            )
+        ''', [(ip, ip, self.samples_per_ip) for ip in ips])
+
+    def get_threat_samples(self, ip: str) -> List[Dict]:
+        """获取IP的证据样本（按日志时间从新到旧）"""
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT timestamp, path, status, user_agent, rule FROM threat_samples
+                WHERE ip = ? ORDER BY timestamp DESC, id DESC
+            ''', (ip,))
+            return [dict(row) for row in cursor.fetchall()]
 
+    def load_collector_state(self, source: str) -> Dict[str, Any]:
+        """加载收集器的文件读取位置 {path: {'offset': ..., 'inode': ...}}"""
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT path, state FROM collector_state WHERE source = ?', (source,))
+            result = {}
+            for row in cursor.fetchall():
+                try:
+                    result[row['path']] = json.loads(row['state'])
+                except (json.JSONDecodeError, TypeError):
+                    continue
+            return result
+
+    def save_collector_state(self, states: Dict[str, Dict[str, Any]]):
+        """保存收集器的文件读取位置 {source: {path: state}}"""
+        self.checkpoint([], None, states)
+
+    def load_analyzer_state(self) -> Dict[str, Dict[str, Any]]:
+        """加载分析器窗口状态 {name: snapshot}"""
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT name, state FROM analyzer_state')
+            result = {}
+            for row in cursor.fetchall():
+                try:
+                    result[row['name']] = json.loads(row['state'])
+                except (json.JSONDecodeError, TypeError):
+                    continue
+            return result
+
+    def save_analyzer_state(self, snapshots: Dict[str, Dict[str, Any]]):
+        """保存分析器窗口状态 {name: snapshot}"""
+        self.checkpoint([], None, {}, snapshots)
+
+    def checkpoint(
+        self,
+        threats: List[ThreatInfo],
+        level_thresholds: Dict[str, int],
+        states: Dict[str, Dict[str, Any]],
+        analyzer_states: Dict[str, Dict[str, Any]] = None
+    ):
+        """在同一事务中写入威胁记录、读取位置和分析器窗口状态
+
+        读取位置只覆盖已写入威胁的日志，中途崩溃后从检查点继续扫描
+        既不会重复计分，也不会遗漏数据。
+        """
+        rows = [
+            (source, path, json.dumps(state))
+            for source, paths in states.items()
+            for path, state in paths.items()
+        ]
+        analyzer_rows = [
+            (name, json.dumps(snapshot, separators=(',', ':')))
+            for name, snapshot in (analyzer_states or {}).items()
+        ]
+        if not threats and not rows and not analyzer_rows:
+            return
+
+        if level_thresholds is None:
+            level_thresholds = {'LOW': 2, 'MEDIUM': 4, 'HIGH': 6, 'CRITICAL': 8}
+
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+            for threat in threats:
+                self._upsert_threat(cursor, threat, level_thresholds, False)
+            self._write_samples(cursor, threats)
+            cursor.executemany('''
+                INSERT OR REPLACE INTO collector_state (source, path, state, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ''', rows)
+            cursor.executemany('''
+                INSERT OR REPLACE INTO analyzer_state (name, state, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+            ''', analyzer_rows)
             conn.commit()
 
     def get_threat(self, ip: str) -> Optional[Dict]:
@@ -188,6 +390,18 @@ class Database:
             cursor.execute(query, params)
             return [dict(row) for row in cursor.fetchall()]
 
+    def get_threat_ips(self, min_level: str = 'CRITICAL') -> List[str]:
+        """获取达到指定等级的威胁IP（只取IP，供扫描时快速判断）"""
+        level_order = {'LOW': 1, 'MEDIUM': 2, 'HIGH': 3, 'CRITICAL': 4}
+        min_order = level_order.get(min_level, level_order['CRITICAL'])
+        valid_levels = [l for l, o in level_order.items() if o >= min_order]
+        placeholders = ','.join(['?' for _ in valid_levels])
+
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT ip FROM threat_ips WHERE threat_level IN ({placeholders})', valid_levels)
+            return [row['ip'] for row in cursor.fetchall()]
+
     def mark_exported(self, ips: List[str]):
         """标记IP已导出
 
@@ -210,46 +424,79 @@ class Database:
                 )
             conn.commit()
 
+    def get_last_cleanup(self) -> float:
+        """上次清理过期数据的时间（时间戳，从未清理过时为0）"""
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT last_run FROM maintenance WHERE task = 'cleanup'")
+            row = cursor.fetchone()
+            return row['last_run'] if row else 0.0
+
     def cleanup_old_data(self, output_dir: str = None):
         """清理过期数据
 
+        按 created_at / last_seen 索引每次取出 cleanup_chunk_size 行删除并提交，
+        不会长时间持有写锁；过期威胁IP删除前只把这些行追加到压缩备份中。
+
         Args:
             output_dir: 备份文件输出目录（用于在清理威胁IP前导出备份）
         """
-        cutoff = _utc_now() - timedelta(days=self.retention_days)
-        cutoff_str = cutoff.isoformat()
+        cutoff_str = (_utc_now() - timedelta(days=self.retention_days)).isoformat()
 
         with self._get_conn() as conn:
             cursor = conn.cursor()
 
             # 清理访问日志
-            cursor.execute('DELETE FROM access_logs WHERE created_at < ?', (cutoff_str,))
-            logs_deleted = cursor.rowcount
+            logs_deleted = 0
+            while True:
+                cursor.execute('''
+                    DELETE FROM access_logs WHERE id IN (
+                        SELECT id FROM access_logs WHERE created_at < ? ORDER BY created_at LIMIT ?
+                    )
+                ''', (cutoff_str, self.cleanup_chunk_size))
+                conn.commit()
+                logs_deleted += cursor.rowcount
+                if cursor.rowcount < self.cleanup_chunk_size:
+                    break
 
             # 清理过期威胁IP记录（如果设置了保留天数）
             threats_deleted = 0
             if self.threat_retention_days > 0:
-                threat_cutoff = _utc_now() - timedelta(days=self.threat_retention_days)
-                threat_cutoff_str = threat_cutoff.isoformat()
-
+                threat_cutoff_str = (_utc_now() - timedelta(days=self.threat_retention_days)).isoformat()
                 self.logger.debug(f"威胁IP清理: 保留天数={self.threat_retention_days}, 截止时间={threat_cutoff_str}")
 
-                # 检查是否有即将被删除的记录
-                cursor.execute('SELECT COUNT(*) FROM threat_ips WHERE last_seen < ?', (threat_cutoff_str,))
-                expired_count = cursor.fetchone()[0]
-
-                # 如果有过期记录要删除，先备份所有威胁IP
-                if expired_count > 0 and output_dir:
-                    cursor.execute(
-                        'SELECT ip, score, threat_level, reasons, hit_count, first_seen, last_seen FROM threat_ips ORDER BY score DESC'
-                    )
-                    all_threats = cursor.fetchall()
-                    self._backup_all_threats(all_threats, output_dir)
-
-                # 执行删除
-                cursor.execute('DELETE FROM threat_ips WHERE last_seen < ?', (threat_cutoff_str,))
-                threats_deleted = cursor.rowcount
-
+                backup = None
+                try:
+                    while True:
+                        cursor.execute('''
+                            SELECT id, ip, score, threat_level, reasons, hit_count, first_seen, last_seen
+                            FROM threat_ips WHERE last_seen < ? ORDER BY last_seen LIMIT ?
+                        ''', (threat_cutoff_str, self.cleanup_chunk_size))
+                        rows = cursor.fetchall()
+                        if not rows:
+                            break
+
+                        # 先备份这一批再删除，中途失败不会丢失未备份的记录
+                        if output_dir:
+                            if backup is None:
+                                backup = self._open_backup(output_dir)
+                            self._backup_threats(backup, rows)
+
+                        cursor.executemany('DELETE FROM threat_ips WHERE id = ?', [(row['id'],) for row in rows])
+                        cursor.executemany('DELETE FROM threat_samples WHERE ip = ?', [(row['ip'],) for row in rows])
+                        conn.commit()
+                        threats_deleted += len(rows)
+                        if len(rows) < self.cleanup_chunk_size:
+                            break
+                finally:
+                    if backup is not None:
+                        backup.close()
+                        self.logger.info(f"已备份 {threats_deleted} 条过期威胁IP到 {backup.name}")
+
+            cursor.execute(
+                "INSERT OR REPLACE INTO maintenance (task, last_run) VALUES ('cleanup', ?)",
+                (time.time(),)
+            )
             conn.commit()
 
             if logs_deleted > 0:
@@ -257,29 +504,25 @@ class Database:
             if threats_deleted > 0:
                 self.logger.info(f"清理了 {threats_deleted} 条过期威胁IP记录")
 
-    def _backup_all_threats(self, threats: list, output_dir: str):
-        """在清理前备份所有威胁IP到文件
-
-        Args:
-            threats: 威胁IP记录列表
-            output_dir: 输出目录
-        """
-        if not threats:
-            return
-
+    def _open_backup(self, output_dir: str):
+        """创建本次清理的压缩备份文件 ip_expired_时间戳.tsv.gz"""
+        os.makedirs(output_dir, exist_ok=True)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_file = os.path.join(output_dir, f'ip_{timestamp}.txt')
-
-        try:
-            os.makedirs(output_dir, exist_ok=True)
-
-            with open(backup_file, 'w', encoding='utf-8') as f:
-                for row in threats:
-                    f.write(f"{row[0]}\n")
-
-            self.logger.info(f"已备份所有威胁IP ({len(threats)} 条) 到 {backup_file}")
-        except Exception as e:
-            self.logger.error(f"备份威胁IP失败: {e}")
+        backup_file = os.path.join(output_dir, f'ip_expired_{timestamp}.tsv.gz')
+        f = gzip.open(backup_file, 'wt', encoding='utf-8')
+        f.write('# ip\tthreat_level\tscore\thit_count\tfirst_seen\tlast_seen\treasons\n')
+        return f
+
+    def _backup_threats(self, backup, rows: list):
+        """把即将删除的威胁IP追加到备份（每行一个IP，制表符分隔）"""
+        for row in rows:
+            backup.write(
+                f"{row['ip']}\t{row['threat_level']}\t{row['score']}\t{row['hit_count']}\t"
+                f"{row['first_seen']}\t{row['last_seen']}\t{row['reasons'] or ''}\n"
+            )
+        # 删除前确保这一批已写入文件
+        backup.flush()
+        os.fsync(backup.fileno())
 
     def get_stats(self) -> Dict[str, Any]:
         """获取统计信息"""
@@ -21,6 +21,10 @@ class Exporter:
         self.deduplicate = deduplicate
         self.logger = get_logger()
 
+        # 已导出IP缓存，文件未被外部修改时（mtime和大小不变）不重复读取
+        self._ip_cache: Optional[set] = None
+        self._ip_cache_sig: Optional[tuple] = None
+
     def export(self, threats: List[Dict], append: bool = False) -> int:
         """
         导出威胁IP到文件
@@ -43,7 +47,7 @@ class Exporter:
         # 去重处理
         existing_ips = set()
         if self.deduplicate and os.path.exists(self.output_file):
-            existing_ips = self._read_existing_ips()
+            existing_ips = self._get_existing_ips()
 
         # 过滤已存在的IP
         new_threats = [
@@ -69,7 +73,10 @@ class Exporter:
                     line = self._format_threat(threat)
                     f.write(line + '\n')
 
-            count = len(new_threats) if self.deduplicate else len(threats)
+            written = new_threats if self.deduplicate else threats
+            self._update_ip_cache([t.get('ip') for t in written], reset=(mode == 'w'))
+
+            count = len(written)
             self.logger.info(f"导出 {count} 个威胁IP到 {self.output_file}")
             return count
 
@@ -107,6 +114,32 @@ class Exporter:
 
         return f"{ip} | {level} | {reasons_str} | {hit_count} | {first_seen} | {last_seen}"
 
+    def _file_signature(self) -> Optional[tuple]:
+        """导出文件的签名（修改时间, 大小）"""
+        try:
+            stat = os.stat(self.output_file)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _get_existing_ips(self) -> set:
+        """获取文件中已存在的IP（带缓存）"""
+        sig = self._file_signature()
+        if self._ip_cache is None or sig != self._ip_cache_sig:
+            self._ip_cache = self._read_existing_ips()
+            self._ip_cache_sig = sig
+        return self._ip_cache
+
+    def _update_ip_cache(self, ips: List[str], reset: bool = False):
+        """写入文件后同步更新缓存"""
+        if reset:
+            self._ip_cache = set()
+        elif self._ip_cache is None:
+            # 缓存未建立，下次读取时再完整加载
+            return
+        self._ip_cache.update(ip for ip in ips if ip)
+        self._ip_cache_sig = self._file_signature()
+
     def _read_existing_ips(self) -> set:
         """读取文件中已存在的IP"""
         ips = set()
@@ -136,7 +169,7 @@ class Exporter:
 
         # 去重
         if self.deduplicate and os.path.exists(self.output_file):
-            existing = self._read_existing_ips()
+            existing = self._get_existing_ips()
             ips = [ip for ip in ips if ip not in existing]
 
         if not ips:
@@ -146,6 +179,7 @@ class Exporter:
             with open(self.output_file, 'a', encoding='utf-8') as f:
                 for ip in ips:
                     f.write(ip + '\n')
+            self._update_ip_cache(ips)
 
             self.logger.info(f"导出 {len(ips)} 个IP到 {self.output_file}")
             return len(ips)
@@ -158,4 +192,4 @@ class Exporter:
         """获取已导出的IP数量"""
         if not os.path.exists(self.output_file):
             return 0
-        return len(self._read_existing_ips())
+        return len(self._get_existing_ips())
@@ -0,0 +1,464 @@
+"""日志行IP索引：IP -> (文件代次, 字节位置)"""
+import heapq
+import json
+import os
+import shutil
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from collectors.rotation import open_log, fingerprint_matches, find_rotated_file
+from utils.logger import get_logger
+
+
+# 段文件格式：
+#   记录（按IP排序）: <H 键长> <I 位置个数> 键 位置(<Q>...)
+#   稀疏键（每 SPARSE_EVERY 条记录一个）: <H 键长> <Q 记录位置> 键
+#   尾部: <Q 稀疏键开始位置> <I 稀疏键个数> <I 记录数> MAGIC
+MAGIC = b'IPLX1\n'
+_RECORD = struct.Struct('<HI')
+_SPARSE = struct.Struct('<HQ')
+_TRAILER = struct.Struct('<QII')
+SPARSE_EVERY = 64
+
+
+def _offsets_to_bytes(offsets: array) -> bytes:
+    """字节位置数组按小端序编码"""
+    if sys.byteorder != 'little':
+        offsets = array('Q', offsets)
+        offsets.byteswap()
+    return offsets.tobytes()
+
+
+def _offsets_from_bytes(data: bytes) -> array:
+    """解码小端序的字节位置"""
+    offsets = array('Q')
+    offsets.frombytes(data)
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+    return offsets
+
+
+def _write_segment(path: str, records: Iterable[Tuple[str, bytes]]) -> int:
+    """
+    写入段文件（先写临时文件再原子替换）
+
+    Args:
+        path: 段文件路径
+        records: 按IP排序的 (IP, 编码后的字节位置)
+
+    Returns:
+        记录数
+    """
+    tmp_path = f"{path}.tmp"
+    sparse = []
+    count = 0
+    with open(tmp_path, 'wb') as f:
+        for key, offsets in records:
+            encoded = key.encode()
+            if count % SPARSE_EVERY == 0:
+                sparse.append((encoded, f.tell()))
+            f.write(_RECORD.pack(len(encoded), len(offsets) // 8))
+            f.write(encoded)
+            f.write(offsets)
+            count += 1
+        footer = f.tell()
+        for encoded, position in sparse:
+            f.write(_SPARSE.pack(len(encoded), position))
+            f.write(encoded)
+        f.write(_TRAILER.pack(footer, len(sparse), count))
+        f.write(MAGIC)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+class _Segment:
+    """只读的段文件（写入后不再修改），查找时只读稀疏键定位到的一小块"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            tail = _TRAILER.size + len(MAGIC)
+            if size < tail:
+                raise ValueError(f"段文件不完整: {path}")
+            f.seek(size - tail)
+            trailer = f.read(tail)
+            if trailer[_TRAILER.size:] != MAGIC:
+                raise ValueError(f"段文件格式错误: {path}")
+            self.footer, sparse_count, self.count = _TRAILER.unpack(trailer[:_TRAILER.size])
+            f.seek(self.footer)
+            data = f.read(size - tail - self.footer)
+
+        self.keys: List[str] = []
+        self.positions: List[int] = []
+        pos = 0
+        for _ in range(sparse_count):
+            length, position = _SPARSE.unpack_from(data, pos)
+            pos += _SPARSE.size
+            self.keys.append(data[pos:pos + length].decode())
+            self.positions.append(position)
+            pos += length
+
+    def lookup(self, key: str) -> Optional[array]:
+        """IP的字节位置（升序），没有时返回None"""
+        i = bisect_right(self.keys, key) - 1
+        if i < 0:
+            return None
+        start = self.positions[i]
+        end = self.positions[i + 1] if i + 1 < len(self.positions) else self.footer
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            block = f.read(end - start)
+        for record_key, offsets in self._parse(block):
+            if record_key == key:
+                return _offsets_from_bytes(offsets)
+            if record_key > key:
+                break
+        return None
+
+    def records(self) -> Iterator[Tuple[str, bytes]]:
+        """按IP顺序遍历所有记录（合并段时使用）"""
+        with open(self.path, 'rb') as f:
+            remaining = self.footer
+            pending = b''
+            while remaining > 0 or pending:
+                chunk = f.read(min(remaining, 1024 * 1024)) if remaining > 0 else b''
+                remaining -= len(chunk)
+                data = pending + chunk
+                pos = 0
+                while pos + _RECORD.size <= len(data):
+                    length, count = _RECORD.unpack_from(data, pos)
+                    end = pos + _RECORD.size + length + count * 8
+                    if end > len(data):
+                        break
+                    key_end = pos + _RECORD.size + length
+                    yield data[pos + _RECORD.size:key_end].decode(), data[key_end:end]
+                    pos = end
+                pending = data[pos:]
+                if not chunk:
+                    break
+
+    @staticmethod
+    def _parse(block: bytes) -> Iterator[Tuple[str, bytes]]:
+        """解析一块连续的记录"""
+        pos = 0
+        while pos + _RECORD.size <= len(block):
+            length, count = _RECORD.unpack_from(block, pos)
+            key_end = pos + _RECORD.size + length
+            end = key_end + count * 8
+            yield block[pos + _RECORD.size:key_end].decode(), block[key_end:end]
+            pos = end
+
+
+class LineIndex:
+    """
+    日志行IP索引
+
+    收集器读取日志时记录每行的客户端IP和字节位置，按日志文件代次分开存放：
+    同一路径、同一inode、开头指纹一致的内容为一个代次（轮转或copytruncate后为新的代次），
+    轮转后按inode/指纹找到旧文件继续读取对应的行。
+
+    每个代次的索引由若干只追加的段文件组成：内存中累计的位置在读取位置提交之前写成一个
+    按IP排序的新段，段数超过 max_segments 时合并为一个段。目录信息（catalog.json）记录
+    各代次的路径、inode、指纹、已索引到的位置和段文件列表，段文件写完后才原子替换目录信息。
+    重复读取已索引的内容（全量扫描、崩溃后重读）时按已索引到的位置跳过。
+
+    代次按 retention_days 和对应的日志文件是否还存在清理。
+    """
+
+    CATALOG = 'catalog.json'
+
+    def __init__(self, path: str = './data/line_index', flush_postings: int = 1000000, max_segments: int = 8):
+        """
+        Args:
+            path: 索引目录
+            flush_postings: 内存中累计的位置超过此数时写入新段
+            max_segments: 每个代次的段数超过此数时合并
+        """
+        self.path = path
+        self.flush_postings = flush_postings
+        self.max_segments = max(1, max_segments)
+        self.logger = get_logger()
+        self._lock = threading.RLock()
+
+        self._catalog: Dict = {'next_id': 1, 'generations': {}}
+        self._catalog_mtime = None
+        # 未写入的位置 {代次编号: {IP: array('Q')}}
+        self._pending: Dict[str, Dict[str, array]] = {}
+        self._pending_count = 0
+        # 已打开的段文件（段文件不会修改，按路径缓存）
+        self._segments: Dict[str, _Segment] = {}
+        self._load_catalog()
+
+    # ---------- 目录信息 ----------
+
+    def _catalog_path(self) -> str:
+        return os.path.join(self.path, self.CATALOG)
+
+    def _load_catalog(self):
+        """读取目录信息（文件未变化时跳过）"""
+        path = self._catalog_path()
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._catalog_mtime:
+            return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self._catalog = json.load(f)
+            self._catalog_mtime = mtime
+        except (json.JSONDecodeError, IOError) as e:
+            self.logger.warning(f"加载日志行索引目录失败: {e}")
+
+    def _save_catalog(self):
+        """原子替换目录信息"""
+        os.makedirs(self.path, exist_ok=True)
+        path = self._catalog_path()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._catalog, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self._catalog_mtime = os.stat(path).st_mtime_ns
+
+    # ---------- 写入 ----------
+
+    def generation(self, path: str, inode: int, fingerprint: str, read_path: str = None) -> str:
+        """
+        取得（不存在时创建）日志文件内容对应的代次
+
+        Args:
+            path: 日志路径（轮转后补读旧文件时仍为原路径）
+            inode: 内容所在文件的inode
+            fingerprint: 开头指纹
+            read_path: 实际读取的文件（用于校验较短时记录的指纹）
+
+        Returns:
+            代次编号
+        """
+        with self._lock:
+            generations = self._catalog['generations']
+            for gen_id in sorted(generations, key=int, reverse=True):
+                gen = generations[gen_id]
+                if gen['path'] != path or gen['inode'] != inode:
+                    continue
+                if (not gen['fingerprint'] or gen['fingerprint'] == fingerprint or
+                        fingerprint_matches(read_path or path, gen['fingerprint'])):
+                    # 文件较短时记录的指纹随内容增长而变长
+                    if len(fingerprint) >= len(gen['fingerprint']):
+                        gen['fingerprint'] = fingerprint
+                    return gen_id
+                # 同一inode开头内容变化（copytruncate），为新的代次
+                break
+
+            gen_id = str(self._catalog['next_id'])
+            self._catalog['next_id'] += 1
+            generations[gen_id] = {
+                'path': path,
+                'inode': inode,
+                'fingerprint': fingerprint,
+                'end': 0,
+                'seq': 0,
+                'segments': [],
+                'updated': int(time.time())
+            }
+            return gen_id
+
+    def add(self, gen_id: str, ip: str, offset: int):
+        """记录一行（位置在已索引范围内的行跳过）"""
+        with self._lock:
+            gen = self._catalog['generations'].get(gen_id)
+            if gen is None or offset < gen['end']:
+                return
+            gen['end'] = offset + 1
+            postings = self._pending.setdefault(gen_id, {})
+            offsets = postings.get(ip)
+            if offsets is None:
+                offsets = postings[ip] = array('Q')
+            offsets.append(offset)
+            self._pending_count += 1
+            if self._pending_count >= self.flush_postings:
+                self.flush()
+
+    def flush(self):
+        """把内存中的位置写成新段并更新目录信息（在提交读取位置之前调用）"""
+        with self._lock:
+            if not self._pending:
+                return
+            generations = self._catalog['generations']
+            now = int(time.time())
+            for gen_id, postings in self._pending.items():
+                gen = generations.get(gen_id)
+                if gen is None:
+                    continue
+                directory = os.path.join(self.path, gen_id)
+                os.makedirs(directory, exist_ok=True)
+                gen['seq'] += 1
+                name = f"seg-{gen['seq']:06d}.idx"
+                _write_segment(
+                    os.path.join(directory, name),
+                    ((ip, _offsets_to_bytes(postings[ip])) for ip in sorted(postings))
+                )
+                gen['segments'].append(name)
+                gen['updated'] = now
+            self._pending.clear()
+            self._pending_count = 0
+            self._save_catalog()
+
+            for gen_id, gen in list(generations.items()):
+                if len(gen['segments']) > self.max_segments:
+                    self._compact(gen_id, gen)
+
+    def _compact(self, gen_id: str, gen: Dict):
+        """把代次的所有段合并为一个段"""
+        directory = os.path.join(self.path, gen_id)
+        old_names = list(gen['segments'])
+        segments = [self._segment(os.path.join(directory, name)) for name in old_names]
+        gen['seq'] += 1
+        name = f"seg-{gen['seq']:06d}.idx"
+
+        def merged() -> Iterator[Tuple[str, bytes]]:
+            # 段按写入顺序排列，同一IP的位置按段顺序拼接后仍然升序
+            current, parts = None, []
+            streams = [((key, n, offsets) for key, offsets in segment.records()) for n, segment in enumerate(segments)]
+            for key, _, offsets in heapq.merge(*streams):
+                if key != current:
+                    if current is not None:
+                        yield current, b''.join(parts)
+                    current, parts = key, []
+                parts.append(offsets)
+            if current is not None:
+                yield current, b''.join(parts)
+
+        count = _write_segment(os.path.join(directory, name), merged())
+        gen['segments'] = [name]
+        self._save_catalog()
+        for old in old_names:
+            path = os.path.join(directory, old)
+            self._segments.pop(path, None)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.logger.debug(f"日志行索引: 代次 {gen_id} 合并 {len(old_names)} 个段，{count} 个IP")
+
+    # ---------- 查询 ----------
+
+    def _segment(self, path: str) -> _Segment:
+        segment = self._segments.get(path)
+        if segment is None:
+            segment = self._segments[path] = _Segment(path)
+        return segment
+
+    def _locate(self, gen: Dict) -> Optional[str]:
+        """代次内容当前所在的文件（原路径或轮转后的旧文件）"""
+        path = gen['path']
+        try:
+            if os.stat(path).st_ino == gen['inode'] and (
+                    not gen['fingerprint'] or fingerprint_matches(path, gen['fingerprint'])):
+                return path
+        except OSError:
+            pass
+        return find_rotated_file(path, gen['inode'], gen['fingerprint'])
+
+    def postings(self, ip: str) -> List[Tuple[str, array]]:
+        """
+        IP在各代次中的字节位置（已写入的段和内存中未写入的部分）
+
+        Returns:
+            [(代次编号, 升序去重的位置), ...]，按代次创建顺序
+        """
+        with self._lock:
+            self._load_catalog()
+            result = []
+            for gen_id in sorted(self._catalog['generations'], key=int):
+                gen = self._catalog['generations'][gen_id]
+                found = set()
+                for name in gen['segments']:
+                    try:
+                        offsets = self._segment(os.path.join(self.path, gen_id, name)).lookup(ip)
+                    except (OSError, ValueError) as e:
+                        self.logger.warning(f"读取日志行索引失败 {gen_id}/{name}: {e}")
+                        continue
+                    if offsets:
+                        found.update(offsets)
+                pending = self._pending.get(gen_id, {}).get(ip)
+                if pending:
+                    found.update(pending)
+                if found:
+                    result.append((gen_id, array('Q', sorted(found))))
+            return result
+
+    def lookup(self, ip: str, limit: int = 200) -> List[Dict]:
+        """
+        读取IP的原始日志行
+
+        Args:
+            ip: IP地址
+            limit: 最多返回的行数（取最近的行）
+
+        Returns:
+            [{'file': 文件路径, 'offset': 字节位置, 'line': 原始日志行}, ...]，按读取顺序
+        """
+        selected: List[Tuple[Dict, array]] = []
+        remaining = limit
+        with self._lock:
+            for gen_id, offsets in reversed(self.postings(ip)):
+                if remaining <= 0:
+                    break
+                if len(offsets) > remaining:
+                    offsets = offsets[-remaining:]
+                remaining -= len(offsets)
+                selected.append((dict(self._catalog['generations'][gen_id]), offsets))
+
+        lines = []
+        for gen, offsets in reversed(selected):
+            path = self._locate(gen)
+            if path is None:
+                continue
+            try:
+                with open_log(path) as f:
+                    for offset in offsets:
+                        f.seek(offset)
+                        raw = f.readline()
+                        lines.append({
+                            'file': path,
+                            'offset': offset,
+                            'line': raw.decode('utf-8', errors='ignore').rstrip('\r\n')
+                        })
+            except (IOError, OSError, EOFError) as e:
+                self.logger.warning(f"读取日志行失败 {path}: {e}")
+        return lines
+
+    # ---------- 清理 ----------
+
+    def cleanup(self, retention_days: int):
+        """删除超过保留天数未更新、或日志文件已不存在的代次"""
+        with self._lock:
+            generations = self._catalog['generations']
+            cutoff = time.time() - retention_days * 86400 if retention_days > 0 else None
+            expired = [
+                gen_id for gen_id, gen in generations.items()
+                if gen_id not in self._pending and (
+                    (cutoff is not None and gen['updated'] < cutoff) or self._locate(gen) is None
+                )
+            ]
+            if not expired:
+                return
+            for gen_id in expired:
+                gen = generations.pop(gen_id)
+                directory = os.path.join(self.path, gen_id)
+                for name in gen['segments']:
+                    self._segments.pop(os.path.join(directory, name), None)
+                shutil.rmtree(directory, ignore_errors=True)
+            self._save_catalog()
+            self.logger.info(f"日志行索引: 清理 {len(expired)} 个过期或已删除的日志文件代次")
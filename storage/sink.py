@@ -0,0 +1,289 @@
+"""实时检测结果的异步写入"""
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Any, Tuple
+
+from analyzers.base import ThreatInfo
+from utils.logger import get_logger
+
+
+class ThreatSink:
+    """威胁IP异步写入器
+
+    实时模式下分析线程只把检测结果放入队列，由后台线程批量写入：
+    达到 batch_size 条或最早一条等待超过 max_latency 秒时，
+    一次追加导出文件、一个事务写入数据库。写入失败的批次留在队列中稍后重试。
+
+    分析器提交的是各自持有的累计记录，队列中每个 (分析器, IP) 只保留最新的快照，
+    写入时与已写入数据库的部分相减，只写入增量（与扫描检查点相同）。
+
+    耗时的维护任务（如清理过期数据）也可通过 run_later 交给后台线程执行，不阻塞分析线程。
+    """
+
+    # 写入失败后后台线程重试的间隔（秒）
+    RETRY_SECONDS = 1.0
+
+    def __init__(
+        self,
+        database,
+        exporter,
+        level_thresholds: Dict[str, int] = None,
+        batch_size: int = 500,
+        max_latency: float = 0.2
+    ):
+        self.database = database
+        self.exporter = exporter
+        self.level_thresholds = level_thresholds or {}
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.logger = get_logger()
+
+        # 待写入的最新快照 {(分析器, ip): ThreatInfo}，以及每项首次进入队列的时间
+        self._pending: Dict[Tuple[str, str], ThreatInfo] = {}
+        self._enqueued_at: Dict[Tuple[str, str], float] = {}
+        # 已写入数据库的部分 {(分析器, ip): (分数, 命中次数, 原因数)}
+        self._persisted: Dict[Tuple[str, str], tuple] = {}
+        self._cond = threading.Condition()
+        # 后台线程与保存状态时的写入互斥，增量按顺序相对已写入部分计算
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        # 等待在后台线程中执行的维护任务
+        self._tasks: deque = deque()
+
+        # 统计：检测到导出的延迟（秒）
+        self._latencies = deque(maxlen=1000)
+        self._latency_max = 0.0
+        self._flushed = 0
+        self._batches = 0
+        self._submitted = 0
+
+    def start(self):
+        """启动后台写入线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='threat-sink', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        """停止后台线程并写入剩余数据"""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        # 线程退出后仍有残留（如未启动线程）时同步写入
+        self.flush()
+
+    def submit(self, analyzer: str, threat: ThreatInfo):
+        """
+        提交检测结果（不阻塞分析线程）
+
+        Args:
+            analyzer: 分析器名称
+            threat: 分析器持有的累计记录（复制后替换队列中同一项的旧快照）
+        """
+        key = (analyzer, threat.ip)
+        snapshot = threat.copy()
+        with self._cond:
+            self._submitted += 1
+            if key in self._pending:
+                self._pending[key] = snapshot
+                return
+
+            was_empty = not self._pending
+            self._pending[key] = snapshot
+            self._enqueued_at[key] = time.monotonic()
+            # 队列由空变为非空时唤醒后台线程开始计时，达到批量大小时立即写入
+            if was_empty or len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def run_later(self, task: Callable[[], Any]):
+        """
+        在后台线程中执行任务（同一任务已在等待时不重复加入；停止时未执行的任务丢弃）
+
+        Args:
+            task: 无参数的函数，异常由调用方处理（这里只记录日志）
+        """
+        with self._cond:
+            if task in self._tasks:
+                return
+            self._tasks.append(task)
+            self._cond.notify()
+
+    def _run(self):
+        """后台写入循环"""
+        while True:
+            with self._cond:
+                while self._running and not self._due() and not self._tasks:
+                    self._cond.wait(timeout=self._wait_time())
+                if not self._running and not self._pending:
+                    return
+                # 只因维护任务被唤醒时不提前写入，保持批量
+                due = not self._running or self._due()
+                tasks = list(self._tasks)
+                self._tasks.clear()
+            if due and not self.flush():
+                # 写入失败：等待一段时间再重试（停止时由 stop 再同步写入一次）
+                with self._cond:
+                    if self._running:
+                        self._cond.wait(timeout=self.RETRY_SECONDS)
+            for task in tasks:
+                try:
+                    task()
+                except Exception as e:
+                    self.logger.error(f"后台任务执行失败: {e}")
+            if not self._running:
+                return
+
+    def _due(self) -> bool:
+        """是否到达写入条件（数量或延迟）"""
+        if not self._pending:
+            return False
+        if len(self._pending) >= self.batch_size:
+            return True
+        return time.monotonic() - self._oldest() >= self.max_latency
+
+    def _wait_time(self) -> Optional[float]:
+        """距离最早一条到期还需等待的时间"""
+        if not self._enqueued_at:
+            return None
+        return max(0.0, self.max_latency - (time.monotonic() - self._oldest()))
+
+    def _oldest(self) -> float:
+        """最早一条的入队时间（字典按插入顺序，第一项即最早）"""
+        return next(iter(self._enqueued_at.values()))
+
+    def flush(self) -> bool:
+        """
+        立即写入当前所有待写入数据
+
+        Returns:
+            是否写入成功（失败的批次放回队列，调用方不应保存超过这些记录的读取位置）
+        """
+        with self._flush_lock:
+            with self._cond:
+                if not self._pending:
+                    return True
+                pending, self._pending = self._pending, {}
+                enqueued_at, self._enqueued_at = self._enqueued_at, {}
+            if self._write(pending, enqueued_at):
+                return True
+            self._requeue(pending, enqueued_at)
+            return False
+
+    def _requeue(self, pending: Dict[Tuple[str, str], ThreatInfo], enqueued_at: Dict[Tuple[str, str], float]):
+        """把写入失败的批次放回队列（写入期间提交的更新快照优先，入队时间保持最早）"""
+        with self._cond:
+            for key, snapshot in self._pending.items():
+                pending[key] = snapshot
+            for key, queued in self._enqueued_at.items():
+                enqueued_at.setdefault(key, queued)
+            self._pending = pending
+            self._enqueued_at = dict(sorted(enqueued_at.items(), key=lambda item: item[1]))
+
+    def _write(self, pending: Dict[Tuple[str, str], ThreatInfo], enqueued_at: Dict[Tuple[str, str], float]) -> bool:
+        """写入一批快照的增量，返回是否成功"""
+        deltas, reported, written = self._deltas(pending)
+        if not deltas:
+            return True
+        try:
+            # 先追加导出文件（有新原因的IP的最新累计记录），再在一个事务中写入增量并标记已导出；
+            # 数据库写入失败重试时导出文件中可能重复出现这些记录
+            if reported:
+                self.exporter.export([self._to_dict(t) for t in reported], append=True)
+            self.database.upsert_threats(deltas, self.level_thresholds, exported=True)
+        except Exception as e:
+            self.logger.error(f"批量写入威胁IP失败，稍后重试: {e}")
+            return False
+
+        self._persisted.update(written)
+        now = time.monotonic()
+        for key in written:
+            latency = now - enqueued_at.get(key, now)
+            self._latencies.append(latency)
+            if latency > self._latency_max:
+                self._latency_max = latency
+        for threat in reported:
+            self.logger.info(f"发现威胁IP: {threat.ip} - {','.join(threat.reasons)}")
+
+        self._flushed += len(deltas)
+        self._batches += 1
+        self.logger.debug(f"批量写入 {len(deltas)} 个威胁IP")
+        return True
+
+    def _deltas(
+        self, pending: Dict[Tuple[str, str], ThreatInfo]
+    ) -> Tuple[List[ThreatInfo], List[ThreatInfo], Dict[Tuple[str, str], tuple]]:
+        """
+        计算各快照相对已写入部分的增量，同一IP各分析器的记录合并为一条
+
+        Returns:
+            (每个IP一条的增量, 有新原因的IP各一条最新累计记录（导出用）,
+             写入成功后要记录的 {(分析器, ip): 已写入部分})
+        """
+        deltas: Dict[str, ThreatInfo] = {}
+        latest: Dict[str, ThreatInfo] = {}
+        new_reasons = set()
+        written = {}
+        for key, snapshot in pending.items():
+            counts = (snapshot.score, snapshot.hit_count, len(snapshot.reasons))
+            prev_score, prev_hits, prev_reasons = self._persisted.get(key, (0, 0, 0))
+            if counts == (prev_score, prev_hits, prev_reasons):
+                continue
+            delta = snapshot.copy()
+            delta.score -= prev_score
+            delta.hit_count -= prev_hits
+            written[key] = counts
+            if len(snapshot.reasons) > prev_reasons:
+                new_reasons.add(snapshot.ip)
+            if snapshot.ip in deltas:
+                deltas[snapshot.ip].merge(delta)
+                latest[snapshot.ip].merge(snapshot)
+            else:
+                deltas[snapshot.ip] = delta
+                latest[snapshot.ip] = snapshot.copy()
+        reported = [latest[ip] for ip in latest if ip in new_reasons]
+        return list(deltas.values()), reported, written
+
+    def reset(self):
+        """
+        清除已写入部分的记录
+
+        分析器释放已写入的累计记录后调用（之后提交的是重新开始累计的记录），
+        调用前须已成功 flush 且期间没有新的提交
+        """
+        with self._flush_lock:
+            self._persisted.clear()
+
+    def _to_dict(self, threat: ThreatInfo) -> Dict[str, Any]:
+        """转换为导出格式"""
+        return {
+            'ip': threat.ip,
+            'threat_level': threat.get_level(self.level_thresholds),
+            'reasons': threat.reasons,
+            'hit_count': threat.hit_count,
+            'first_seen': threat.first_seen.isoformat() if threat.first_seen else None,
+            'last_seen': threat.last_seen.isoformat() if threat.last_seen else None
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取写入统计（延迟单位：毫秒）"""
+        latencies = sorted(self._latencies)
+        stats = {
+            'submitted': self._submitted,
+            'flushed': self._flushed,
+            'batches': self._batches,
+            'pending': len(self._pending),
+            'latency_avg_ms': 0.0,
+            'latency_p95_ms': 0.0,
+            'latency_max_ms': round(self._latency_max * 1000, 1),
+        }
+        if latencies:
+            stats['latency_avg_ms'] = round(sum(latencies) / len(latencies) * 1000, 1)
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            stats['latency_p95_ms'] = round(p95 * 1000, 1)
+        return stats
@@ -0,0 +1,179 @@
+"""测试公共fixture：项目根目录加入导入路径，按仓库 config.yaml 生成指向临时目录的配置"""
+import copy
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def _merge(base: dict, overrides: dict) -> dict:
+    """递归合并配置"""
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            _merge(base[key], value)
+        else:
+            base[key] = value
+    return base
+
+
+# 测试日志的起始时间（UTC）
+BASE_TIME = datetime(2026, 10, 18, 10, 0, 0)
+
+
+def format_nginx(ip: str, offset: float = 0, path: str = '/', status: int = 200,
+                 user_agent: str = 'Mozilla/5.0', method: str = 'GET') -> str:
+    """生成一行Nginx combined日志（时间为 BASE_TIME 之后 offset 秒）"""
+    stamp = (BASE_TIME + timedelta(seconds=offset)).strftime('%d/%b/%Y:%H:%M:%S +0000')
+    return f'{ip} - - [{stamp}] "{method} {path} HTTP/1.1" {status} 512 "-" "{user_agent}"'
+
+
+@pytest.fixture
+def base_time():
+    """测试日志的起始时间"""
+    return BASE_TIME
+
+
+@pytest.fixture
+def nginx_line():
+    """Nginx日志行生成函数"""
+    return format_nginx
+
+
+def format_ssh(ip: str, offset: float = 0, user: str = 'root', message: str = None) -> str:
+    """生成一行sshd日志（时间为本地时间，BASE_TIME 之后 offset 秒）"""
+    stamp = (BASE_TIME + timedelta(seconds=offset)).strftime('%b %d %H:%M:%S')
+    message = message or f'Failed password for {user} from {ip} port 22 ssh2'
+    return f'{stamp} web1 sshd[{1000 + int(offset) % 9000}]: {message}'
+
+
+# 随机流量使用的请求（权重较高的是普通请求）
+_PATHS = ['/', '/index.html', '/api/items', '/static/app.js', '/.env', '/wp-login.php',
+          '/admin.php?id=1%27%20OR%201=1', '/phpmyadmin/', '/.git/config']
+_PATH_WEIGHTS = [30, 20, 20, 10, 3, 3, 2, 2, 2]
+_STATUSES = [200, 200, 200, 304, 403, 404, 500]
+_AGENTS = ['Mozilla/5.0', 'Mozilla/5.0', 'curl/8.0', 'sqlmap/1.7']
+
+
+def make_traffic(seed: int, count: int) -> list:
+    """
+    生成确定的随机日志行：少数IP高频访问/扫描，多数IP零星访问，另有一部分SSH登录失败
+
+    Returns:
+        [(来源, 日志行), ...]，按时间顺序
+    """
+    rng = random.Random(seed)
+    heavy = [f'198.51.100.{i}' for i in range(1, 6)]
+    light = [f'203.0.113.{i}' for i in range(1, 60)] + [f'2001:db8::{i:x}' for i in range(1, 10)]
+    lines = []
+    offset = 0.0
+    for _ in range(count):
+        offset += rng.expovariate(4)
+        if rng.random() < 0.1:
+            ip = rng.choice(heavy[:3])
+            user = rng.choice(['root', 'admin', 'test', 'oracle', 'ubuntu', f'user{rng.randrange(20)}'])
+            lines.append(('ssh', format_ssh(ip, offset, user)))
+            continue
+        ip = rng.choice(heavy) if rng.random() < 0.6 else rng.choice(light)
+        path = rng.choices(_PATHS, _PATH_WEIGHTS)[0]
+        if rng.random() < 0.3:
+            path = f'/probe/{rng.randrange(500)}'
+        lines.append(('nginx', format_nginx(
+            ip, offset, path, rng.choice(_STATUSES), rng.choice(_AGENTS)
+        )))
+    return lines
+
+
+@pytest.fixture
+def traffic():
+    """随机流量生成函数"""
+    return make_traffic
+
+
+@pytest.fixture
+def analyzer_config():
+    """仓库配置（阈值调低，随机流量中能触发各类规则）"""
+    with open(os.path.join(ROOT, 'config.yaml'), 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    return _merge(config, {
+        'thresholds': {
+            'frequency': [
+                {'window_seconds': 60, 'max_requests': 40},
+                {'window_seconds': 600, 'max_requests': 200, 'score': 2},
+            ],
+            'error_rate': {'window_seconds': 120, 'max_errors': 15},
+            'path_scan': {'max_sensitive_hits': 3},
+            'distinct_paths': {'window_seconds': 600, 'max_paths': 60, 'max_404_paths': 30},
+            'ssh_bruteforce': {'window_seconds': 300, 'max_failures': 5, 'max_users': 4},
+        },
+    })
+
+
+@pytest.fixture
+def log_dir(tmp_path):
+    """测试日志目录"""
+    path = tmp_path / 'logs'
+    path.mkdir()
+    return path
+
+
+@pytest.fixture
+def make_config(tmp_path, log_dir):
+    """
+    生成测试配置文件，返回路径
+
+    数据库、状态文件、导出文件、日志等都放在临时目录；
+    Nginx 读取 log_dir/*.log，SSH 读取 log_dir/auth.log，WAF 来源关闭
+    """
+    with open(os.path.join(ROOT, 'config.yaml'), 'r', encoding='utf-8') as f:
+        base = yaml.safe_load(f)
+
+    def make(**overrides) -> str:
+        config = copy.deepcopy(base)
+        _merge(config, {
+            'log_sources': {
+                'nginx': {'enabled': True, 'paths': [str(log_dir / '*.log')], 'exclude': [str(log_dir / 'auth.log')]},
+                'waf': {'enabled': False},
+                'free_waf': {'enabled': False},
+                'ssh': {'enabled': True, 'paths': [str(log_dir / 'auth.log')]},
+            },
+            'whitelist': ['127.0.0.1'],
+            'whitelist_file': str(tmp_path / 'white.txt'),
+            'output': {'file': str(tmp_path / 'ip.txt')},
+            'database': {'path': str(tmp_path / 'data' / 'ipcollect.db')},
+            'logging': {'file': str(tmp_path / 'run.log'), 'level': 'WARNING'},
+            'state_file': str(tmp_path / 'data' / 'state.json'),
+            'access_logs': {'path': str(tmp_path / 'data' / 'access_logs')},
+            'line_index': {'path': str(tmp_path / 'data' / 'line_index')},
+        })
+        _merge(config, overrides)
+        path = tmp_path / 'config.yaml'
+        with open(path, 'w', encoding='utf-8') as f:
+            yaml.safe_dump(config, f, allow_unicode=True)
+        return str(path)
+
+    return make
+
+
+@pytest.fixture
+def make_engine(make_config):
+    """按覆盖配置创建 Engine，测试结束时停止分析进程"""
+    from core.engine import Engine
+
+    engines = []
+
+    def make(**overrides):
+        engine = Engine(make_config(**overrides))
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        if engine.shards:
+            engine.shards.close()
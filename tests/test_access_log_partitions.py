@@ -0,0 +1,76 @@
+"""访问日志按日期分区存储"""
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+from storage import AccessLogStore
+from utils.log_parser import parse_nginx_log
+
+
+def rows(store, day):
+    conn = sqlite3.connect(store._partition_path(day))
+    try:
+        return conn.execute('SELECT ip, path, status FROM access_logs ORDER BY id').fetchall()
+    finally:
+        conn.close()
+
+
+def test_entries_are_written_to_daily_partitions(tmp_path, nginx_line):
+    store = AccessLogStore(path=str(tmp_path / 'access'), batch_size=50, max_open=1)
+    # 跨越三天，每天10条
+    entries = [parse_nginx_log(nginx_line('192.0.2.1', day * 86400 + i, f'/d{day}/{i}'))
+               for day in range(3) for i in range(10)]
+    store.extend(entries)
+    store.flush()
+
+    assert store.partitions() == ['20261018', '20261019', '20261020']
+    assert rows(store, '20261019')[:2] == [('192.0.2.1', '/d1/0', 200), ('192.0.2.1', '/d1/1', 200)]
+    assert store.count() == 30
+    # 只保持 max_open 个分区连接
+    assert len(store._conns) <= 1
+    store.close()
+
+
+def test_batch_size_triggers_write(tmp_path, nginx_line):
+    store = AccessLogStore(path=str(tmp_path / 'access'), batch_size=5)
+    store.extend(parse_nginx_log(nginx_line('192.0.2.1', i)) for i in range(4))
+    assert store.written == 0
+    store.add(parse_nginx_log(nginx_line('192.0.2.1', 4)))
+    assert store.written == 5
+    store.close()
+
+
+def test_cleanup_removes_expired_partitions(tmp_path, nginx_line):
+    store = AccessLogStore(path=str(tmp_path / 'access'))
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    old = parse_nginx_log(nginx_line('192.0.2.1'))
+    old.timestamp = now - timedelta(days=40)
+    recent = parse_nginx_log(nginx_line('192.0.2.2'))
+    recent.timestamp = now
+    store.extend([old, recent])
+    store.flush()
+    assert len(store.partitions()) == 2
+
+    store.cleanup(retention_days=30)
+    assert store.partitions() == [now.strftime('%Y%m%d')]
+    assert store.count() == 1
+    store.close()
+
+
+def test_engine_records_analyzed_entries(make_engine, log_dir, nginx_line):
+    lines = [nginx_line('198.51.100.1', i, f'/page/{i}') for i in range(20)]
+    lines += [nginx_line('198.51.100.1', 20 + i, '/static/app.js') for i in range(5)]
+    lines += [nginx_line('127.0.0.1', 30 + i, '/health') for i in range(3)]
+    (log_dir / 'access.log').write_text('\n'.join(lines) + '\n')
+
+    engine = make_engine(access_logs={'enabled': True, 'skip_static': True})
+    engine.scan()
+    store = engine.access_log
+    paths = [path for _, path, _ in rows(store, '20261018')]
+    # 静态资源请求和白名单IP的记录不写入
+    assert paths == [f'/page/{i}' for i in range(20)]
+
+    engine = make_engine(access_logs={'enabled': True, 'include_whitelisted': True,
+                                      'path': str(log_dir.parent / 'access_all')})
+    engine.scan(incremental=False)
+    paths = [path for _, path, _ in rows(engine.access_log, '20261018')]
+    assert paths.count('/health') == 3 and paths.count('/static/app.js') == 5
@@ -0,0 +1,128 @@
+"""逐条、批量、NumPy 列式和多进程分片四种分析方式的结果一致"""
+import pytest
+
+from analyzers import IPStateTable, columnar
+from analyzers.frequency import FrequencyAnalyzer
+from analyzers.status_code import StatusCodeAnalyzer
+from core.sharding import create_analyzers
+from utils.log_parser import LOG_PARSERS
+
+
+def parse(lines):
+    return [(source, LOG_PARSERS[source](line)) for source, line in lines]
+
+
+def records(by_analyzer):
+    """{分析器: {ip: ThreatInfo}} 中有原因的记录 -> 可比较的值（含证据样本）"""
+    return {
+        (name, ip): (threat.score, threat.hit_count, sorted(threat.reasons), sorted(threat.samples))
+        for name, threats in by_analyzer.items()
+        for ip, threat in threats.items() if threat.reasons
+    }
+
+
+def chunks(entries, size):
+    """按批切分后再按来源拆开（与扫描时每批只含一个来源相同）"""
+    for start in range(0, len(entries), size):
+        chunk = entries[start:start + size]
+        for source in ('nginx', 'ssh'):
+            part = [entry for s, entry in chunk if s == source]
+            if part:
+                yield source, part
+
+
+def run_per_entry(config, entries):
+    analyzers = create_analyzers(config, IPStateTable())
+    for source, entry in entries:
+        for analyzer in analyzers:
+            if analyzer.accepts(source):
+                analyzer.analyze(entry)
+    return records({a.name: a.get_threats() for a in analyzers})
+
+
+def run_batches(config, entries, size):
+    analyzers = create_analyzers(config, IPStateTable())
+    for source, part in chunks(entries, size):
+        with analyzers[0].state_table.deferred_sweep():
+            for analyzer in analyzers:
+                if analyzer.accepts(source):
+                    analyzer.analyze_batch(part)
+    return records({a.name: a.get_threats() for a in analyzers})
+
+
+def run_engine(engine, entries, size):
+    for source, part in chunks(entries, size):
+        engine.analyze_batch(part, engine.analyzers_for(source))
+    return records(engine.threat_records())
+
+
+@pytest.fixture
+def entries(traffic):
+    return parse(traffic(seed=11, count=8000))
+
+
+@pytest.fixture
+def expected(analyzer_config, entries):
+    result = run_per_entry(analyzer_config, entries)
+    # 随机流量覆盖各类规则，且有带证据样本的记录
+    assert {name for name, _ in result} >= {'frequency', 'pattern', 'status_code', 'distinct_path', 'ssh_bruteforce'}
+    assert any(value[3] for value in result.values())
+    return result
+
+
+def test_python_batches_match_per_entry(analyzer_config, entries, expected):
+    config = dict(analyzer_config, batch_analysis={'numpy': False})
+    assert run_batches(config, entries, 1000) == expected
+
+
+@pytest.mark.skipif(not columnar.HAS_NUMPY, reason='需要 NumPy')
+def test_columnar_batches_match_per_entry(analyzer_config, entries, expected, monkeypatch):
+    handled = {}
+
+    def spy(cls):
+        original = cls._analyze_columnar
+
+        def analyze_columnar(self, rows):
+            found, rest = original(self, rows)
+            handled[cls.__name__] = handled.get(cls.__name__, 0) + len(rows) - len(rest)
+            return found, rest
+
+        monkeypatch.setattr(cls, '_analyze_columnar', analyze_columnar)
+
+    spy(FrequencyAnalyzer)
+    spy(StatusCodeAnalyzer)
+    config = dict(analyzer_config, batch_analysis={'numpy': True})
+    assert run_batches(config, entries, 2000) == expected
+    # 两个分析器确实按列式计算了记录（而不是全部退回逐条实现）
+    assert handled.get('FrequencyAnalyzer') and handled.get('StatusCodeAnalyzer')
+
+
+def sharded_engine(make_engine, config):
+    engine = make_engine(
+        thresholds=config['thresholds'],
+        analyzer_state=config['analyzer_state'],
+        static_assets={'enabled': False},
+        known_threats={'enabled': False},
+        batch_analysis={'workers': 2},
+    )
+    assert engine.shards is not None
+    return engine
+
+
+def test_sharded_engine_matches_per_entry(make_engine, analyzer_config, entries, expected):
+    engine = sharded_engine(make_engine, analyzer_config)
+    assert run_engine(engine, entries, 1000) == expected
+
+
+def test_state_ttl_expiry_matches_across_paths(make_engine, analyzer_config, entries, expected):
+    """零星访问的IP空闲超过 state_ttl 后敏感路径计数过期，与各路径清理状态表的时机无关"""
+    config = dict(analyzer_config, analyzer_state=dict(analyzer_config['analyzer_state'], ttl_seconds=120))
+    expired = run_per_entry(config, entries)
+    # 过期后重新计数：报告的IP和次数都与不过期时不同
+    assert expired != expected
+
+    assert run_batches(dict(config, batch_analysis={'numpy': False}), entries, 1000) == expired
+    if columnar.HAS_NUMPY:
+        assert run_batches(dict(config, batch_analysis={'numpy': True}), entries, 2000) == expired
+    engine = sharded_engine(make_engine, config)
+    assert run_engine(engine, entries, 1000) == expired
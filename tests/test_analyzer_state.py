@@ -0,0 +1,98 @@
+"""分析器窗口状态快照与恢复"""
+import json
+
+from analyzers import IPStateTable
+from core.sharding import create_analyzers
+from utils.log_parser import LOG_PARSERS
+
+
+def parse(lines):
+    return [(source, LOG_PARSERS[source](line)) for source, line in lines]
+
+
+def run(analyzers, entries, batch=100):
+    """按来源分批交给处理该来源的分析器"""
+    for start in range(0, len(entries), batch):
+        chunk = entries[start:start + batch]
+        for source in ('nginx', 'ssh'):
+            part = [entry for s, entry in chunk if s == source]
+            if not part:
+                continue
+            with analyzers[0].state_table.deferred_sweep():
+                for analyzer in analyzers:
+                    if analyzer.accepts(source):
+                        analyzer.analyze_batch(part)
+
+
+def totals(*analyzer_sets):
+    """各组分析器的威胁记录按 (分析器, IP) 合并"""
+    merged = {}
+    for analyzers in analyzer_sets:
+        for analyzer in analyzers:
+            for ip, threat in analyzer.get_threats().items():
+                key = (analyzer.name, ip)
+                if key in merged:
+                    merged[key].merge(threat)
+                else:
+                    merged[key] = threat.copy()
+    return {
+        key: (threat.score, threat.hit_count, sorted(threat.reasons))
+        for key, threat in merged.items() if threat.reasons
+    }
+
+
+def test_restored_state_continues_windows(analyzer_config, traffic):
+    entries = parse(traffic(seed=7, count=6000))
+    middle = len(entries) // 2
+
+    continuous = create_analyzers(analyzer_config, IPStateTable())
+    run(continuous, entries)
+
+    first = create_analyzers(analyzer_config, IPStateTable())
+    run(first, entries[:middle])
+    # 快照经过JSON序列化（与保存到数据库相同）
+    snapshots = {a.name: json.loads(json.dumps(a.snapshot())) for a in first}
+
+    second = create_analyzers(analyzer_config, IPStateTable())
+    for analyzer in second:
+        analyzer.restore(snapshots[analyzer.name])
+    run(second, entries[middle:])
+
+    expected = totals(continuous)
+    assert {name for name, _ in expected} >= {'frequency', 'pattern', 'status_code', 'ssh_bruteforce'}
+    assert totals(first, second) == expected
+
+
+def test_without_restore_cross_boundary_attacks_are_missed(analyzer_config, nginx_line):
+    """同一窗口内的访问被拆到两次扫描：恢复状态后才能发现"""
+    lines = [('nginx', nginx_line('198.51.100.1', i)) for i in range(60)]
+    entries = parse(lines)
+
+    first = create_analyzers(analyzer_config, IPStateTable())
+    run(first, entries[:30])
+    snapshot = {a.name: a.snapshot() for a in first}
+
+    fresh = create_analyzers(analyzer_config, IPStateTable())
+    run(fresh, entries[30:])
+    assert not any(a.get_threats() for a in fresh)
+
+    restored = create_analyzers(analyzer_config, IPStateTable())
+    for analyzer in restored:
+        analyzer.restore(snapshot[analyzer.name])
+    run(restored, entries[30:])
+    frequency = next(a for a in restored if a.name == 'frequency')
+    assert '198.51.100.1' in frequency.get_threats()
+
+
+def test_engine_saves_and_restores_state_across_scans(make_engine, log_dir, nginx_line):
+    log = log_dir / 'access.log'
+    overrides = {'thresholds': {'frequency': {'window_seconds': 300, 'max_requests': 50}}}
+    log.write_text(''.join(nginx_line('198.51.100.1', i) + '\n' for i in range(40)))
+    make_engine(**overrides).scan()
+
+    # 新进程：窗口状态从数据库恢复，跨两次扫描的高频访问被发现
+    with open(log, 'a') as f:
+        f.write(''.join(nginx_line('198.51.100.1', 40 + i) + '\n' for i in range(20)))
+    engine = make_engine(**overrides)
+    engine.scan()
+    assert engine.database.get_threat('198.51.100.1') is not None
@@ -0,0 +1,77 @@
+"""扫描检查点：只写入上次检查点以来的增量"""
+import json
+
+from analyzers.base import ThreatInfo
+
+
+def write_attack_log(path, nginx_line):
+    """两个IP的高频访问 + 敏感路径扫描，以及一个正常IP"""
+    lines = []
+    for i in range(400):
+        lines.append(nginx_line('198.51.100.7', i * 0.5, '/.env' if i % 40 == 0 else f'/page/{i}'))
+        lines.append(nginx_line('198.51.100.8', i * 0.5, '/wp-login.php' if i % 3 == 0 else '/', 404))
+        if i % 20 == 0:
+            lines.append(nginx_line('192.0.2.1', i * 0.5))
+    path.write_text('\n'.join(lines) + '\n')
+
+
+def threat_rows(engine):
+    return {
+        row['ip']: (row['score'], row['hit_count'], sorted(json.loads(row['reasons'])))
+        for row in engine.database.get_all_threats()
+    }
+
+
+def test_checkpoint_writes_only_deltas(make_engine):
+    engine = make_engine()
+    persisted = {}
+
+    threat = ThreatInfo(ip='203.0.113.5')
+    threat.add_reason('高频访问', 3)
+    threat.hit_count = 4
+    engine._checkpoint({threat.ip: threat}, persisted)
+    assert persisted[threat.ip] == (3, 4, 1)
+
+    # 累计记录继续增长：数据库中是最新的累计值，而不是两次之和
+    threat.add_reason('敏感路径扫描', 4)
+    threat.hit_count = 10
+    engine._checkpoint({threat.ip: threat}, persisted)
+    # 没有变化时不再写入
+    engine._checkpoint({threat.ip: threat}, persisted)
+
+    row = engine.database.get_threat(threat.ip)
+    assert (row['score'], row['hit_count']) == (7, 10)
+    assert sorted(json.loads(row['reasons'])) == ['敏感路径扫描', '高频访问']
+
+
+def test_frequent_checkpoints_match_single_checkpoint(make_engine, log_dir, tmp_path, nginx_line):
+    write_attack_log(log_dir / 'access.log', nginx_line)
+    common = {
+        'known_threats': {'enabled': False},
+        'batch_analysis': {'batch_size': 50},
+    }
+
+    once = make_engine(**common, checkpoint={'interval_mb': 1024, 'interval_seconds': 3600},
+                       database={'path': str(tmp_path / 'once.db')})
+    once.scan()
+
+    # 每批分析后都做一次检查点
+    often = make_engine(**common, checkpoint={'interval_mb': 0, 'interval_seconds': 0},
+                        database={'path': str(tmp_path / 'often.db')})
+    often.scan()
+
+    expected = threat_rows(once)
+    assert expected and '192.0.2.1' not in expected
+    assert threat_rows(often) == expected
+
+
+def test_incremental_rescan_does_not_recount(make_engine, log_dir, nginx_line):
+    write_attack_log(log_dir / 'access.log', nginx_line)
+    engine = make_engine(known_threats={'enabled': False}, checkpoint={'interval_mb': 0, 'interval_seconds': 0})
+    engine.scan()
+    first = threat_rows(engine)
+
+    # 读取位置与威胁在同一事务中保存，再次增量扫描没有新数据
+    stats = engine.scan()
+    assert stats['entries_processed'] == 0
+    assert threat_rows(engine) == first
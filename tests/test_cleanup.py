@@ -0,0 +1,160 @@
+"""过期数据清理：分块删除、过期威胁IP压缩备份和清理间隔"""
+import gzip
+import os
+import threading
+import time
+from datetime import timedelta
+
+from core.watcher import RealtimeEngine
+from storage.database import Database, _utc_now
+
+
+def make_database(tmp_path, **kwargs):
+    kwargs.setdefault('retention_days', 30)
+    kwargs.setdefault('threat_retention_days', 90)
+    kwargs.setdefault('cleanup_chunk_size', 7)
+    return Database(str(tmp_path / 'ipcollect.db'), **kwargs)
+
+
+def insert_logs(database, count, age_days):
+    created_at = (_utc_now() - timedelta(days=age_days)).isoformat()
+    with database._get_conn() as conn:
+        conn.executemany(
+            'INSERT INTO access_logs (ip, source, path, status, created_at) VALUES (?, ?, ?, ?, ?)',
+            [(f'192.0.2.{i % 250}', 'nginx', '/', 200, created_at) for i in range(count)]
+        )
+        conn.commit()
+
+
+def insert_threats(database, prefix, count, age_days):
+    last_seen = (_utc_now() - timedelta(days=age_days)).isoformat()
+    ips = [f'{prefix}.{i}' for i in range(count)]
+    with database._get_conn() as conn:
+        conn.executemany(
+            'INSERT INTO threat_ips (ip, score, threat_level, reasons, hit_count, first_seen, last_seen) '
+            'VALUES (?, 3, ?, ?, 5, ?, ?)',
+            [(ip, 'MEDIUM', 'path_scan', last_seen, last_seen) for ip in ips]
+        )
+        conn.executemany(
+            'INSERT INTO threat_samples (ip, timestamp, path, status, rule) VALUES (?, ?, ?, ?, ?)',
+            [(ip, last_seen, '/.env', 404, 'path_scan') for ip in ips]
+        )
+        conn.commit()
+    return ips
+
+
+def count(database, table):
+    with database._get_conn() as conn:
+        return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def test_cleanup_deletes_expired_rows_in_chunks(tmp_path):
+    database = make_database(tmp_path)
+    # 行数取块大小的整数倍，最后一次删除0行后停止
+    insert_logs(database, 21, age_days=40)
+    insert_logs(database, 5, age_days=1)
+    insert_threats(database, '198.51.100', 15, age_days=100)
+    kept = insert_threats(database, '203.0.113', 3, age_days=10)
+
+    database.cleanup_old_data(output_dir=str(tmp_path / 'out'))
+
+    assert count(database, 'access_logs') == 5
+    assert count(database, 'threat_ips') == 3
+    assert all(database.get_threat(ip) for ip in kept)
+    with database._get_conn() as conn:
+        samples = {row[0] for row in conn.execute('SELECT ip FROM threat_samples')}
+    assert samples == set(kept)
+
+
+def test_expired_threats_are_backed_up_before_delete(tmp_path):
+    database = make_database(tmp_path)
+    expired = insert_threats(database, '198.51.100', 10, age_days=100)
+    insert_threats(database, '203.0.113', 2, age_days=10)
+    out = tmp_path / 'out'
+
+    database.cleanup_old_data(output_dir=str(out))
+
+    backups = list(out.glob('ip_expired_*.tsv.gz'))
+    assert len(backups) == 1
+    with gzip.open(backups[0], 'rt', encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    assert lines[0].startswith('# ip\t')
+    rows = [line.split('\t') for line in lines[1:]]
+    # 只备份本次删除的行，每个IP一行
+    assert sorted(row[0] for row in rows) == sorted(expired)
+    assert all(row[1] == 'MEDIUM' and row[6] == 'path_scan' for row in rows)
+
+
+def test_no_backup_without_expired_threats(tmp_path):
+    database = make_database(tmp_path)
+    insert_threats(database, '203.0.113', 2, age_days=10)
+    out = tmp_path / 'out'
+    database.cleanup_old_data(output_dir=str(out))
+    assert not out.exists()
+
+
+def test_threats_are_kept_forever_by_default(tmp_path):
+    database = make_database(tmp_path, threat_retention_days=0)
+    insert_threats(database, '198.51.100', 4, age_days=1000)
+    database.cleanup_old_data(output_dir=str(tmp_path / 'out'))
+    assert count(database, 'threat_ips') == 4
+    assert not (tmp_path / 'out').exists()
+
+
+def test_cleanup_records_last_run(tmp_path):
+    database = make_database(tmp_path)
+    assert database.get_last_cleanup() == 0.0
+    before = time.time()
+    database.cleanup_old_data()
+    assert database.get_last_cleanup() >= before
+
+
+def test_engine_cleanup_follows_interval(make_engine, monkeypatch):
+    engine = make_engine(database={'cleanup_interval_hours': 24})
+    calls = []
+    original = engine.database.cleanup_old_data
+
+    def record(*args, **kwargs):
+        calls.append(kwargs.get('output_dir'))
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(engine.database, 'cleanup_old_data', record)
+
+    # 从未清理过：立即执行，备份目录为导出文件所在目录
+    assert engine.cleanup() is True
+    assert calls == [os.path.dirname(os.path.abspath(engine.exporter.output_file))]
+    # 间隔内跳过，force 时照常执行
+    assert engine.cleanup() is False
+    assert engine.cleanup(force=True) is True
+    assert len(calls) == 2
+
+
+def test_cleanup_interval_survives_restart(make_engine):
+    engine = make_engine(database={'cleanup_interval_hours': 24})
+    assert engine.cleanup() is True
+    # 新进程从数据库读取上次清理时间，未到间隔不再清理
+    restarted = make_engine(database={'cleanup_interval_hours': 24})
+    assert restarted.cleanup() is False
+    assert restarted.cleanup(force=True) is True
+
+
+def test_realtime_cleanup_runs_on_sink_thread(make_engine, monkeypatch):
+    """实时模式保存状态只安排清理，由写入器后台线程执行，不阻塞文件变化事件"""
+    engine = make_engine()
+    realtime = RealtimeEngine(engine)
+    threads = []
+    done = threading.Event()
+
+    def cleanup(force=False):
+        threads.append(threading.current_thread().name)
+        done.set()
+        return True
+
+    monkeypatch.setattr(engine, 'cleanup', cleanup)
+    realtime._save_state()
+    assert threads == []
+
+    realtime._sink.start()
+    assert done.wait(5)
+    assert threads == ['threat-sink']
+    realtime._stop_sink()
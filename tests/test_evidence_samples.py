@@ -0,0 +1,76 @@
+"""威胁证据样本环形缓冲"""
+from collections import deque
+from datetime import timedelta
+
+from analyzers import FrequencyAnalyzer, IPStateTable, ThreatInfo
+from analyzers.base import SAMPLE_FIELD_LENGTH, make_sample
+from storage import Database
+from utils.log_parser import parse_nginx_log
+
+
+def sample(base_time, seconds, path):
+    return (base_time + timedelta(seconds=seconds), path, 200, 'ua', 'rule')
+
+
+def test_copy_and_merge_keep_latest_samples(base_time):
+    a = ThreatInfo(ip='192.0.2.1', samples=deque([sample(base_time, s, f'/a{s}') for s in (1, 5, 9)], maxlen=3))
+    b = ThreatInfo(ip='192.0.2.1', samples=deque([sample(base_time, s, f'/b{s}') for s in (2, 7)], maxlen=3))
+
+    copied = a.copy()
+    assert copied.samples.maxlen == 3 and list(copied.samples) == list(a.samples)
+    copied.samples.append(sample(base_time, 10, '/c'))
+    assert len(a.samples) == 3 and a.samples[-1][1] == '/a9'
+
+    a.merge(b)
+    # 按日志时间保留两边最近的3条
+    assert [s[1] for s in a.samples] == ['/a5', '/b7', '/a9']
+    assert a.samples.maxlen == 3
+
+
+def test_sample_fields_are_truncated():
+    entry = parse_nginx_log(
+        f'192.0.2.1 - - [18/Oct/2026:10:00:00 +0000] "GET /{"x" * 2000} HTTP/1.1" 404 0 "-" "{"u" * 2000}"'
+    )
+    _, path, status, user_agent, rule = make_sample(entry, '敏感路径扫描')
+    assert len(path) == SAMPLE_FIELD_LENGTH and len(user_agent) == SAMPLE_FIELD_LENGTH
+    assert status == 404 and rule == '敏感路径扫描'
+
+
+def frequency_threat(analyzer_config, nginx_line, columnar):
+    config = dict(analyzer_config, evidence={'enabled': True, 'samples_per_ip': 4},
+                  batch_analysis={'numpy': columnar})
+    analyzer = FrequencyAnalyzer(config, state_table=IPStateTable())
+    entries = [parse_nginx_log(nginx_line('198.51.100.1', i * 0.5, f'/n/{i}')) for i in range(300)]
+    entries += [parse_nginx_log(nginx_line('203.0.113.1', i, '/')) for i in range(5)]
+    for start in range(0, len(entries), 100):
+        analyzer.analyze_batch(entries[start:start + 100])
+    return analyzer.get_threats()
+
+
+def test_analyzer_keeps_last_samples(analyzer_config, nginx_line):
+    threats = frequency_threat(analyzer_config, nginx_line, columnar=False)
+    samples = threats['198.51.100.1'].samples
+    assert samples.maxlen == 4
+    assert [s[1] for s in samples] == ['/n/296', '/n/297', '/n/298', '/n/299']
+    assert '203.0.113.1' not in threats
+
+
+def test_columnar_samples_match_stepwise(analyzer_config, nginx_line):
+    stepwise = frequency_threat(analyzer_config, nginx_line, columnar=False)
+    vectorized = frequency_threat(analyzer_config, nginx_line, columnar=True)
+    assert {ip: list(t.samples) for ip, t in vectorized.items()} == \
+        {ip: list(t.samples) for ip, t in stepwise.items()}
+
+
+def test_database_keeps_latest_samples_per_ip(tmp_path, base_time):
+    database = Database(db_path=str(tmp_path / 'samples.db'), samples_per_ip=3)
+    threat = ThreatInfo(ip='192.0.2.1', samples=deque(maxlen=3))
+    threat.add_reason('rule', 3)
+    threat.samples.extend(sample(base_time, s, f'/{s}') for s in range(3))
+    database.upsert_threats([threat])
+    # 重复写入同一样本被忽略，超出的旧样本被裁剪
+    threat.samples.extend(sample(base_time, s, f'/{s}') for s in range(2, 5))
+    database.upsert_threats([threat])
+
+    rows = database.get_threat_samples('192.0.2.1')
+    assert sorted(row['path'] for row in rows) == ['/2', '/3', '/4']
@@ -0,0 +1,83 @@
+"""实时模式按文件识别日志格式"""
+import json
+
+from core.watcher import FormatRouter
+from utils.log_parser import detect_log_format, parse_waf_log, sniff_line_format
+
+
+NGINX = '203.0.113.{n} - - [18/Oct/2026:10:00:{s:02d} +0000] "GET /index.html HTTP/1.1" 200 512 "-" "Mozilla/5.0"'
+SSH = 'Oct 18 10:00:{s:02d} web1 sshd[{n}]: Failed password for root from 198.51.100.{n} port 22 ssh2'
+FREE_WAF = '["2026-10-18 10:00:{s:02d}","192.0.2.{n}","GET","/shell.php",null,"url","规则详情","GET /shell.php"]'
+
+
+def nginx_lines(count, start=1):
+    return [NGINX.format(n=start + i, s=i % 60) for i in range(count)]
+
+
+def test_sniff_line_format():
+    assert sniff_line_format(NGINX.format(n=1, s=0)) == 'nginx'
+    assert sniff_line_format(SSH.format(n=1, s=0)) == 'ssh'
+    assert sniff_line_format(FREE_WAF.format(n=1, s=0)) == 'free_waf'
+    assert sniff_line_format(json.dumps({'ip': '192.0.2.1', 'uri': '/x'})) == 'waf'
+    assert sniff_line_format('# comment') is None
+    assert sniff_line_format('random text') is None
+
+
+def test_detect_log_format_majority_vote():
+    lines = nginx_lines(3) + [SSH.format(n=1, s=0), 'garbage']
+    assert detect_log_format(lines) == 'nginx'
+    assert detect_log_format(['garbage', '']) is None
+
+
+def test_waf_parser_rejects_free_waf_arrays():
+    assert parse_waf_log(FREE_WAF.format(n=1, s=0)) is None
+    entry = parse_waf_log(json.dumps({'ip': '192.0.2.1', 'uri': '/admin', 'status': 403}))
+    assert entry.ip == '192.0.2.1' and entry.path == '/admin'
+
+
+def test_router_sniffs_file_head_once(tmp_path, monkeypatch):
+    path = tmp_path / 'access.log'
+    lines = nginx_lines(5)
+    path.write_text('\n'.join(lines) + '\n')
+
+    router = FormatRouter()
+    heads = []
+    read_head = router._read_head
+    monkeypatch.setattr(router, '_read_head', lambda p: heads.append(p) or read_head(p))
+
+    assert [e.ip for e in router.parse_lines(str(path), lines)] == [f'203.0.113.{n}' for n in range(1, 6)]
+    assert len(router.parse_lines(str(path), nginx_lines(3, start=10))) == 3
+    assert heads == [str(path)]
+
+
+def test_router_uses_preferred_format_when_head_is_unknown(tmp_path):
+    path = tmp_path / 'auth.log'
+    path.write_text('Oct 18 10:00:00 web1 CRON[1]: session opened\n')
+    router = FormatRouter()
+    assert router.parse_lines(str(path), ['Oct 18 10:00:00 web1 CRON[1]: session opened'], preferred='ssh') == []
+    entries = router.parse_lines(str(path), [SSH.format(n=7, s=1)], preferred='ssh')
+    assert [e.source for e in entries] == ['ssh']
+
+
+def test_router_resniffs_after_format_change(tmp_path):
+    path = tmp_path / 'mixed.log'
+    path.write_text('\n'.join(nginx_lines(5)) + '\n')
+    router = FormatRouter()
+    router.parse_lines(str(path), nginx_lines(5))
+
+    # 文件改为免费WAF格式：连续失败达到阈值后重新判断，失败的行用新解析器补解析
+    waf = [FREE_WAF.format(n=i % 250 + 1, s=i % 60) for i in range(FormatRouter.MISMATCH_THRESHOLD)]
+    entries = router.parse_lines(str(path), waf)
+    assert len(entries) == len(waf)
+    assert {e.source for e in entries} == {'free_waf'}
+    assert router.parse_lines(str(path), waf[:1])[0].source == 'free_waf'
+
+
+def test_router_backs_off_when_format_is_unchanged(tmp_path):
+    path = tmp_path / 'auth.log'
+    path.write_text(SSH.format(n=1, s=0) + '\n')
+    router = FormatRouter()
+    noise = ['Oct 18 10:00:00 web1 CRON[1]: session opened'] * FormatRouter.MISMATCH_THRESHOLD
+    assert router.parse_lines(str(path), noise) == []
+    assert router._thresholds[str(path)] == FormatRouter.MISMATCH_THRESHOLD * 2
+    assert router.parse_lines(str(path), [SSH.format(n=2, s=1)])[0].source == 'ssh'
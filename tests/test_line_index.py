@@ -0,0 +1,79 @@
+"""日志行IP索引"""
+import os
+
+from storage import LineIndex
+
+
+def write_lines(path, nginx_line, start, count, mode='a'):
+    """三个IP轮流访问，路径中带行号"""
+    ips = ['198.51.100.1', '198.51.100.2', '2001:db8::5']
+    with open(path, mode) as f:
+        for i in range(start, start + count):
+            f.write(nginx_line(ips[i % 3], i, f'/n/{i}') + '\n')
+
+
+def indexed_paths(engine, ip, limit=200):
+    return [line['line'].split('"')[1].split()[1] for line in engine.lookup_lines(ip, limit=limit)]
+
+
+def test_lookup_returns_lines_of_ip(make_engine, log_dir, nginx_line):
+    write_lines(log_dir / 'access.log', nginx_line, 0, 300)
+    engine = make_engine(line_index={'enabled': True})
+    engine.scan()
+
+    assert indexed_paths(engine, '198.51.100.2') == [f'/n/{i}' for i in range(1, 300, 3)]
+    assert indexed_paths(engine, '2001:db8::5', limit=5) == [f'/n/{i}' for i in range(287, 300, 3)]
+    assert engine.lookup_lines('192.0.2.99') == []
+
+
+def test_segments_are_compacted(make_engine, log_dir, nginx_line):
+    log = log_dir / 'access.log'
+    engine = make_engine(line_index={'enabled': True, 'flush_postings': 40, 'max_segments': 2})
+    for start in range(0, 300, 60):
+        write_lines(log, nginx_line, start, 60)
+        engine.scan()
+
+    catalog = engine.line_index._catalog['generations']
+    assert all(len(gen['segments']) <= 2 for gen in catalog.values())
+    assert indexed_paths(engine, '198.51.100.1') == [f'/n/{i}' for i in range(0, 300, 3)]
+
+    # 重新打开索引目录，结果不变
+    reopened = LineIndex(path=engine.line_index.path)
+    assert [line['offset'] for line in reopened.lookup('198.51.100.1')] == \
+        [line['offset'] for line in engine.lookup_lines('198.51.100.1')]
+
+
+def test_full_rescan_does_not_duplicate(make_engine, log_dir, nginx_line):
+    write_lines(log_dir / 'access.log', nginx_line, 0, 90)
+    engine = make_engine(line_index={'enabled': True})
+    engine.scan()
+    engine.scan(incremental=False)
+    assert indexed_paths(engine, '198.51.100.1') == [f'/n/{i}' for i in range(0, 90, 3)]
+
+
+def test_lookup_follows_rotated_file(make_engine, log_dir, nginx_line):
+    log = log_dir / 'access.log'
+    write_lines(log, nginx_line, 0, 30)
+    engine = make_engine(line_index={'enabled': True})
+    engine.scan()
+
+    os.rename(log, log_dir / 'access.log.1')
+    write_lines(log, nginx_line, 30, 30)
+    engine.scan()
+
+    lines = engine.lookup_lines('198.51.100.1')
+    assert [line['line'].split('"')[1].split()[1] for line in lines] == [f'/n/{i}' for i in range(0, 60, 3)]
+    assert {os.path.basename(line['file']) for line in lines} == {'access.log', 'access.log.1'}
+
+
+def test_cleanup_drops_generations_of_deleted_files(make_engine, log_dir, nginx_line):
+    log = log_dir / 'access.log'
+    write_lines(log, nginx_line, 0, 30)
+    engine = make_engine(line_index={'enabled': True})
+    engine.scan()
+    assert engine.line_index._catalog['generations']
+
+    os.remove(log)
+    engine.line_index.cleanup(retention_days=30)
+    assert engine.line_index._catalog['generations'] == {}
+    assert engine.lookup_lines('198.51.100.1') == []
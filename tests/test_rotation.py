@@ -0,0 +1,82 @@
+"""日志轮转后补读旧文件"""
+import gzip
+import os
+import shutil
+
+import pytest
+
+from collectors import NginxCollector
+
+
+@pytest.fixture
+def make_collector(tmp_path, log_dir):
+    """读取 log_dir/access.log 的收集器（读取位置保存在JSON状态文件）"""
+    def make():
+        return NginxCollector(paths=[str(log_dir / 'access.log')], state_file=str(tmp_path / 'state.json'))
+    return make
+
+
+def write(path, lines, mode='a'):
+    with open(path, mode) as f:
+        f.write(''.join(line + '\n' for line in lines))
+
+
+def collect_paths(collector):
+    return [entry.path for entry in collector.collect()]
+
+
+def requests(nginx_line, name, count):
+    return [nginx_line('203.0.113.9', i, f'/{name}/{i}') for i in range(count)]
+
+
+def test_rename_rotation_drains_old_file(make_collector, log_dir, nginx_line):
+    log = log_dir / 'access.log'
+    write(log, requests(nginx_line, 'a', 5))
+    assert len(collect_paths(make_collector())) == 5
+
+    # 上次读取后旧文件又写入了3行，然后被改名，新文件开始写入
+    write(log, requests(nginx_line, 'b', 3))
+    os.rename(log, log_dir / 'access.log-20261018')
+    write(log, requests(nginx_line, 'c', 2))
+
+    collector = make_collector()
+    assert collect_paths(collector) == ['/b/0', '/b/1', '/b/2', '/c/0', '/c/1']
+    assert collect_paths(make_collector()) == []
+
+
+def test_gzip_rotation_drains_compressed_file(make_collector, log_dir, nginx_line):
+    log = log_dir / 'access.log'
+    write(log, requests(nginx_line, 'a', 5))
+    assert len(collect_paths(make_collector())) == 5
+
+    write(log, requests(nginx_line, 'b', 3))
+    with open(log, 'rb') as src, gzip.open(log_dir / 'access.log.1.gz', 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(log)
+    write(log, requests(nginx_line, 'c', 2))
+
+    assert collect_paths(make_collector()) == ['/b/0', '/b/1', '/b/2', '/c/0', '/c/1']
+
+
+def test_copytruncate_is_detected_by_fingerprint(make_collector, log_dir, nginx_line):
+    log = log_dir / 'access.log'
+    write(log, requests(nginx_line, 'a', 5))
+    assert len(collect_paths(make_collector())) == 5
+
+    write(log, requests(nginx_line, 'b', 3))
+    shutil.copy(log, log_dir / 'access.log.1')
+    # 截断后新文件写得比旧位置还大，只能通过开头指纹认出
+    write(log, requests(nginx_line, 'c', 12), mode='w')
+
+    paths = collect_paths(make_collector())
+    assert paths == ['/b/0', '/b/1', '/b/2'] + [f'/c/{i}' for i in range(12)]
+
+
+def test_missing_rotated_file_reads_new_file_from_start(make_collector, log_dir, nginx_line):
+    log = log_dir / 'access.log'
+    write(log, requests(nginx_line, 'a', 5))
+    assert len(collect_paths(make_collector())) == 5
+
+    os.remove(log)
+    write(log, requests(nginx_line, 'c', 2))
+    assert collect_paths(make_collector()) == ['/c/0', '/c/1']
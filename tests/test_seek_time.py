@@ -0,0 +1,65 @@
+"""按日志时间查找读取位置与回溯读取"""
+import gzip
+import shutil
+from datetime import timedelta
+
+import pytest
+
+from collectors import NginxCollector
+from utils.log_parser import parse_nginx_log
+
+
+@pytest.fixture
+def access_log(log_dir, nginx_line):
+    """约6000行、每秒一行的访问日志"""
+    path = log_dir / 'access.log'
+    path.write_text(''.join(nginx_line('203.0.113.1', i, f'/item/{i}') + '\n' for i in range(6000)))
+    return path
+
+
+@pytest.fixture
+def collector(tmp_path, access_log):
+    return NginxCollector(paths=[str(access_log)], state_file=str(tmp_path / 'state.json'))
+
+
+def first_line_after(path, offset):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        if offset:
+            f.readline()
+        return parse_nginx_log(f.readline().decode())
+
+
+@pytest.mark.parametrize('seconds', [0, 1, 100, 3000, 5999, 7000])
+def test_seek_time_lands_before_target(collector, access_log, base_time, seconds):
+    target = base_time + timedelta(seconds=seconds)
+    offset = collector.seek_time(str(access_log), target)
+    assert 0 <= offset <= access_log.stat().st_size
+    if offset:
+        assert first_line_after(access_log, offset).timestamp < target
+    # 二分查找只留下不超过 SEEK_MIN_SPAN 的顺序读取范围
+    with open(access_log, 'rb') as f:
+        data = f.read()
+    exact = data.find(f'/item/{seconds} '.encode()) if seconds < 6000 else len(data)
+    assert exact - offset <= collector.SEEK_MIN_SPAN + 200
+
+
+def test_collect_range_returns_exactly_the_range(collector, base_time):
+    since = base_time + timedelta(seconds=2500)
+    until = base_time + timedelta(seconds=2600)
+    paths = [entry.path for entry in collector.collect_range(since, until)]
+    assert paths == [f'/item/{i}' for i in range(2500, 2600)]
+
+
+def test_collect_range_keeps_saved_position(collector, base_time):
+    list(collector.collect_range(base_time + timedelta(seconds=10), base_time + timedelta(seconds=20)))
+    collector.save_state()
+    # 回溯读取不改变增量读取的位置
+    assert len(list(collector.collect())) == 6000
+
+
+def test_seek_time_reads_compressed_files_from_start(collector, access_log, log_dir, base_time):
+    gz = log_dir / 'access.log.1.gz'
+    with open(access_log, 'rb') as src, gzip.open(gz, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    assert collector.seek_time(str(gz), base_time + timedelta(seconds=3000)) == 0
@@ -0,0 +1,127 @@
+"""SSH日志解析"""
+from datetime import datetime, timedelta
+
+from analyzers.ssh_bruteforce import SSHBruteforceAnalyzer
+from utils import log_parser
+from utils.log_parser import parse_ssh_log
+
+
+HOST = 'Oct 18 10:00:01 web1 sshd[1234]: '
+
+
+def test_failed_messages_count_as_failures():
+    entry = parse_ssh_log(HOST + 'Failed password for invalid user admin from 192.168.1.100 port 22 ssh2')
+    assert entry.ip == '192.168.1.100'
+    assert entry.extra['failed'] and not entry.extra['preauth']
+    assert entry.extra['action'] == 'Failed password'
+    assert entry.extra['user'] == 'admin'
+    assert entry.status == 401
+
+    entry = parse_ssh_log(HOST + 'Failed publickey for root from 2001:db8::1 port 22 ssh2')
+    assert entry.ip == '2001:db8::1'
+    assert entry.extra['action'] == 'Failed publickey'
+
+
+def test_invalid_user_pair_is_one_failure():
+    """sshd 对同一次尝试先写 Invalid user，再写 Failed ... for invalid user，只计一次失败"""
+    entries = [
+        parse_ssh_log(HOST + 'Invalid user test from 10.0.0.5 port 51000'),
+        parse_ssh_log(HOST + 'Failed password for invalid user test from 10.0.0.5 port 51000 ssh2'),
+    ]
+    assert all(entry.ip == '10.0.0.5' and entry.extra['user'] == 'test' for entry in entries)
+    assert entries[0].extra['invalid_user'] and not entries[0].extra['failed']
+    assert [entry.extra['failed'] for entry in entries] == [False, True]
+
+
+def test_accepted_login():
+    entry = parse_ssh_log(HOST + 'Accepted publickey for deploy from 10.0.0.8 port 40000 ssh2')
+    assert entry.status == 200
+    assert not entry.extra['failed'] and not entry.extra['preauth']
+    assert entry.extra['user'] == 'deploy'
+
+
+def test_preauth_messages_are_not_failures():
+    lines = [
+        'Disconnected from authenticating user root 192.168.1.100 port 22 [preauth]',
+        'Connection closed by authenticating user root 192.168.1.100 port 22 [preauth]',
+        'Connection closed by 192.168.1.100 port 22 [preauth]',
+        'error: maximum authentication attempts exceeded for root from 192.168.1.100 port 22 ssh2 [preauth]',
+    ]
+    for line in lines:
+        entry = parse_ssh_log(HOST + line)
+        assert entry is not None, line
+        assert entry.ip == '192.168.1.100'
+        assert entry.extra['preauth'] and not entry.extra['failed'], line
+
+
+def test_non_sshd_lines_are_skipped():
+    assert parse_ssh_log('Oct 18 10:00:01 web1 CRON[99]: (root) CMD (run-parts /etc/cron.hourly)') is None
+    assert parse_ssh_log(HOST + 'Received disconnect from 192.168.1.100 port 22:11: Bye Bye') is None
+    assert parse_ssh_log('') is None
+
+
+def test_bruteforce_counts_one_failure_per_attempt():
+    """每次尝试的 Failed + preauth 断开只计一次失败"""
+    analyzer = SSHBruteforceAnalyzer({'thresholds': {'ssh_bruteforce': {'max_failures': 5}}})
+    entries = []
+    for i in range(5):
+        stamp = f'Oct 18 10:00:{i * 2:02d} web1 sshd[{100 + i}]: '
+        entries.append(parse_ssh_log(stamp + 'Failed password for root from 192.168.1.100 port 22 ssh2'))
+        entries.append(parse_ssh_log(stamp + 'Connection closed by authenticating user root 192.168.1.100 port 22 [preauth]'))
+    assert analyzer.analyze_batch(entries) == []
+
+    stamp = 'Oct 18 10:00:20 web1 sshd[200]: '
+    found = analyzer.analyze_batch([parse_ssh_log(stamp + 'Failed password for root from 192.168.1.100 port 22 ssh2')])
+    assert [threat.reasons for threat in found] == [['SSH暴力破解']]
+
+
+def invalid_user_attempts(count, ip='192.168.1.100'):
+    """sshd 对不存在用户的每次尝试写两行：Invalid user + Failed password for invalid user"""
+    entries = []
+    for i in range(count):
+        stamp = f'Oct 18 10:01:{i * 2:02d} web1 sshd[{300 + i}]: '
+        entries.append(parse_ssh_log(stamp + f'Invalid user oracle from {ip} port 22'))
+        entries.append(parse_ssh_log(stamp + f'Failed password for invalid user oracle from {ip} port 22 ssh2'))
+    return entries
+
+
+def test_bruteforce_counts_invalid_user_attempt_once():
+    config = {'thresholds': {'ssh_bruteforce': {'max_failures': 5}}}
+    for count in range(1, 6):
+        analyzer = SSHBruteforceAnalyzer(config)
+        assert analyzer.analyze_batch(invalid_user_attempts(count)) == [], count
+
+    analyzer = SSHBruteforceAnalyzer(config)
+    found = analyzer.analyze_batch(invalid_user_attempts(6))
+    assert [threat.reasons for threat in found] == [['SSH暴力破解']]
+
+
+def test_syslog_year_follows_current_date(monkeypatch):
+    """年份在解析缓存之外补上，跨年后不会沿用缓存中的旧年份"""
+    clock = {'now': datetime(2025, 12, 31, 23, 0, 0)}
+
+    class FakeDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return clock['now']
+
+    monkeypatch.setattr(log_parser, 'datetime', FakeDatetime)
+    monkeypatch.setattr(log_parser, 'to_utc', lambda dt: dt)
+    log_parser._parse_syslog_clock.cache_clear()
+
+    assert log_parser._parse_syslog_time('Dec 31 22:59:59').year == 2025
+    assert log_parser._parse_syslog_time('Jan  1 00:00:01').year == 2025
+
+    clock['now'] = datetime(2026, 1, 1, 0, 5, 0)
+    # 同一时间字符串已在缓存中，年份仍按当前日期计算
+    assert log_parser._parse_syslog_time('Jan  1 00:00:01').year == 2026
+    # 新年之后看到的12月日志属于上一年
+    assert log_parser._parse_syslog_time('Dec 31 22:59:59').year == 2025
+    log_parser._parse_syslog_clock.cache_clear()
+
+
+def test_syslog_time_with_year_is_kept():
+    """带年份的时间（如 rsyslog 高精度格式）不改动年份"""
+    dt = log_parser._parse_syslog_time('2023-10-18T10:00:01')
+    assert dt.year == 2023
+    assert abs(dt - datetime(2023, 10, 18, 10, 0, 1)) < timedelta(days=1)
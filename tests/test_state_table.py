@@ -0,0 +1,135 @@
+"""IP状态表：按日志时间清理、TTL和建议性的内存预算"""
+from datetime import datetime, timedelta
+
+from analyzers import IPStateTable, PatternAnalyzer
+from analyzers.state import MIN_SWEEP_OPS
+from core.watcher import RealtimeEngine
+from utils.log_parser import parse_nginx_log
+
+
+T0 = datetime(2026, 10, 18, 10, 0, 0)
+
+
+class _Seen:
+    """测试用状态：最近活动时间"""
+    def __init__(self):
+        self.at = None
+
+
+def make_table(max_memory_mb=512, window=60):
+    table = IPStateTable(max_memory_mb=max_memory_mb)
+    table.register('test', lambda part, latest: part.at > latest - timedelta(seconds=window))
+    return table
+
+
+def touch(table, ip, at):
+    part = table.touch(ip, 'test', _Seen, at)
+    part.at = at
+    return part
+
+
+def test_sweep_drops_only_states_outside_window():
+    table = make_table()
+    touch(table, '192.0.2.1', T0)
+    touch(table, '192.0.2.2', T0 + timedelta(seconds=50))
+    touch(table, '192.0.2.3', T0 + timedelta(seconds=90))
+    table.sweep()
+    assert '192.0.2.1' not in table
+    assert '192.0.2.2' in table and '192.0.2.3' in table
+    assert table.evicted == 1
+
+
+def test_deferred_sweep_keeps_batch_states():
+    table = make_table()
+    with table.deferred_sweep():
+        touch(table, '192.0.2.1', T0)
+        # 同一批中其他IP把时间线推进到窗口之外，批内不清理
+        for i in range(MIN_SWEEP_OPS + 1):
+            touch(table, '192.0.2.2', T0 + timedelta(seconds=120))
+        assert '192.0.2.1' in table
+    assert '192.0.2.1' not in table
+
+
+def test_budget_is_advisory_for_in_window_ips(caplog):
+    """预算只触发提前清理窗口外的IP，窗口内的IP从不淘汰"""
+    table = make_table(max_memory_mb=0.01)
+    count = 500
+    for i in range(count):
+        touch(table, f'10.0.{i // 250}.{i % 250}', T0 + timedelta(seconds=i % 30))
+    assert len(table) == count
+    assert table.evicted == 0
+    assert table.estimated_bytes() > table.max_memory_bytes
+    assert '超出预算' in caplog.text
+
+    # 时间线推进后，窗口外的IP在清理时被丢弃
+    touch(table, '10.9.9.9', T0 + timedelta(seconds=600))
+    table.sweep()
+    assert len(table) == 1
+    assert table.evicted == count
+
+
+def test_pattern_counts_expire_after_ttl(analyzer_config, nginx_line):
+    config = dict(analyzer_config, analyzer_state={'ttl_seconds': 3600})
+    analyzer = PatternAnalyzer(config, state_table=IPStateTable())
+
+    def request(ip, offset, path='/'):
+        return parse_nginx_log(nginx_line(ip, offset, path))
+
+    for i in range(2):
+        analyzer.analyze(request('198.51.100.1', i, '/.env'))
+    # 超过TTL后其他IP的活动推进了时间线，旧的敏感路径计数被丢弃
+    analyzer.analyze(request('198.51.100.2', 7200, '/.env'))
+    analyzer.trim()
+    assert analyzer.state_table.get('198.51.100.1', analyzer.name) is None
+
+    # 重新计数：两次命中达不到阈值（3），第三次才报告
+    assert analyzer.analyze(request('198.51.100.1', 7201, '/.env')) is None
+    assert analyzer.analyze(request('198.51.100.1', 7202, '/.env')) is None
+    assert analyzer.analyze(request('198.51.100.1', 7203, '/.env')) is not None
+
+
+def test_realtime_releases_threats_after_they_are_persisted(make_engine, log_dir, nginx_line):
+    engine = make_engine(known_threats={'enabled': False})
+    realtime = RealtimeEngine(engine)
+    path = str(log_dir / 'access.log')
+    lines = [nginx_line('198.51.100.1', i, '/.env', 404, 'sqlmap/1.7') for i in range(30)]
+
+    realtime._process_lines(path, lines[:10], 'nginx')
+    realtime._save_state()
+    first = engine.database.get_threat('198.51.100.1')
+    assert first is not None
+    # 写入数据库后分析器不再持有威胁记录
+    assert not any(engine.threat_records().values())
+
+    # 之后的命中只累计次数，下次保存时作为增量写入，不重复计分
+    realtime._process_lines(path, lines[10:], 'nginx')
+    realtime._save_state()
+    row = engine.database.get_threat('198.51.100.1')
+    assert row['score'] == first['score']
+    assert row['hit_count'] > first['hit_count']
+    assert not any(engine.threat_records().values())
+    realtime._stop_sink()
+
+
+def test_realtime_keeps_offsets_when_threat_write_fails(make_engine, log_dir, nginx_line, monkeypatch):
+    engine = make_engine(known_threats={'enabled': False})
+    realtime = RealtimeEngine(engine)
+    log = log_dir / 'access.log'
+    log.write_text(''.join(nginx_line('198.51.100.1', i, '/.env', 404, 'sqlmap/1.7') + '\n' for i in range(10)))
+    collector = realtime._find_collector(str(log))
+
+    def fail(*args, **kwargs):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(engine.database, 'upsert_threats', fail)
+    realtime._on_file_changed(str(log))
+    realtime._save_state()
+    assert engine.database.load_collector_state(collector.source_name) == {}
+    assert realtime._sink.get_stats()['pending'] > 0
+
+    # 写入恢复后重试：威胁和读取位置一起保存
+    monkeypatch.undo()
+    realtime._save_state()
+    assert engine.database.get_threat('198.51.100.1') is not None
+    assert engine.database.load_collector_state(collector.source_name)[str(log)]['offset'] == log.stat().st_size
+    realtime._stop_sink()
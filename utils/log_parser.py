@@ -1,7 +1,8 @@
 """日志解析工具"""
 import re
-from datetime import datetime, timezone
-from typing import Dict, Optional, Any
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
+from typing import AbstractSet, Dict, Optional, Any
 from dataclasses import dataclass, field, asdict
 
 # Nginx combined格式正则
@@ -22,6 +23,50 @@ NGINX_COMBINED_PATTERN = re.compile(
 NGINX_TIME_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
 NGINX_TIME_FORMAT_NO_TZ = '%d/%b/%Y:%H:%M:%S'
 
+# SSH日志行头: "Dec  9 10:00:00 server sshd[12345]: ..."
+# 只匹配 sshd[ 之前的部分，消息体由下面的分类正则处理
+SSH_HEADER_PATTERN = re.compile(r'(?P<time>.+?)\s+(?P<host>\S+)\s+$')
+
+# syslog默认时间格式（不带年份）
+SYSLOG_TIME_FORMAT = '%b %d %H:%M:%S'
+
+# SSH客户端地址（IPv4 / IPv6）
+_SSH_IP = r'(?P<ip>[0-9A-Fa-f:.]+)'
+
+# SSH消息分类规则: (子串, 正则, 动作名称, 类型)
+# 动作名称为None时由消息本身生成（如 Failed password / Accepted publickey）
+# 类型: failed 为一次登录尝试失败（每次尝试只有一条），accepted 为登录成功，
+#       invalid_user 为用户名不存在（之后还有同一次尝试的 Failed ... for invalid user 消息，不计为失败），
+#       preauth 为认证结束前断开/超出尝试次数（与同一次尝试的 failed 消息重复，不计为失败）
+# 示例:
+#   Failed password for root from 192.168.1.100 port 22 ssh2
+#   Failed password for invalid user admin from 2001:db8::1 port 22 ssh2
+#   Invalid user admin from 192.168.1.100 port 22
+#   Accepted publickey for root from 192.168.1.100 port 22 ssh2
+#   Disconnected from authenticating user root 192.168.1.100 port 22 [preauth]
+#   Connection closed by authenticating user root 192.168.1.100 port 22 [preauth]
+#   error: maximum authentication attempts exceeded for root from 192.168.1.100 port 22 ssh2 [preauth]
+SSH_MESSAGE_RULES = [
+    ('Failed ', re.compile(
+        r'^Failed (?P<method>\S+) for (?:invalid user )?(?P<user>.*?) from ' + _SSH_IP + r' port \d+'
+    ), None, 'failed'),
+    ('Invalid user ', re.compile(
+        r'^Invalid user (?P<user>.*?) from ' + _SSH_IP
+    ), 'Invalid user', 'invalid_user'),
+    ('Accepted ', re.compile(
+        r'^Accepted (?P<method>\S+) for (?P<user>\S+) from ' + _SSH_IP + r' port \d+'
+    ), None, 'accepted'),
+    ('maximum authentication attempts', re.compile(
+        r'maximum authentication attempts exceeded for (?:invalid user )?(?P<user>.*?) from ' + _SSH_IP + r' port \d+'
+    ), 'Maximum authentication attempts', 'preauth'),
+    ('Disconnected from ', re.compile(
+        r'^Disconnected from (?:authenticating|invalid) user (?P<user>\S*) ' + _SSH_IP + r' port \d+ \[preauth\]'
+    ), 'Disconnected from authenticating user', 'preauth'),
+    ('Connection closed by ', re.compile(
+        r'^Connection closed by (?:(?:authenticating|invalid) user (?P<user>\S*) )?' + _SSH_IP + r' port \d+ \[preauth\]'
+    ), 'Connection closed preauth', 'preauth'),
+]
+
 
 @dataclass
 class LogEntry:
@@ -168,6 +213,38 @@ def parse_nginx_log(line: str) -> Optional[LogEntry]:
     )
 
 
+@lru_cache(maxsize=4096)
+def _parse_nginx_time(time_str: str) -> Optional[datetime]:
+    """解析Nginx时间（同一秒内的大量日志共用一次解析结果）"""
+    return parse_timestamp(time_str)
+
+
+def parse_nginx_brief(line: str, ips: AbstractSet[str]) -> Optional[LogEntry]:
+    """只解析Nginx日志行的IP和时间
+
+    用于已确认威胁IP的快速路径：先取行首的IP，不在 ips 中时直接返回None，
+    在 ips 中时只再取出时间，不做完整的正则匹配。
+    IP不在 ips 中或找不到时间时返回None，由调用方完整解析。
+    """
+    line = line.lstrip()
+    end = line.find(' ')
+    if end <= 0:
+        return None
+    ip = line[:end]
+    if ip not in ips:
+        return None
+
+    start = line.find('[', end)
+    stop = line.find(']', start + 1)
+    if start < 0 or stop < 0:
+        return None
+    timestamp = _parse_nginx_time(line[start + 1:stop])
+    if not timestamp:
+        return None
+
+    return LogEntry(timestamp=timestamp, ip=ip, source='nginx')
+
+
 def parse_waf_log(line: str) -> Optional[LogEntry]:
     """解析WAF日志（JSON格式）"""
     import json
@@ -180,6 +257,10 @@ def parse_waf_log(line: str) -> Optional[LogEntry]:
     except json.JSONDecodeError:
         return None
 
+    # 免费WAF的JSON数组等非对象格式不属于付费WAF日志
+    if not isinstance(data, dict):
+        return None
+
     # WAF日志格式可能因版本不同而异，这里处理常见格式
     ip = data.get('ip') or data.get('client_ip') or data.get('remote_addr', '')
 
@@ -317,37 +398,76 @@ def parse_free_waf_log(line: str) -> Optional[LogEntry]:
     return None
 
 
+@lru_cache(maxsize=4096)
+def _parse_syslog_clock(time_str: str) -> Optional[datetime]:
+    """
+    解析syslog时间中与当前日期无关的部分（同一秒内的大量日志共用一次解析结果）
+
+    不带年份的时间返回1900年的本地时间，年份由调用方在缓存之外补上；带年份的时间直接转换为UTC
+    """
+    try:
+        return datetime.strptime(time_str.strip(), SYSLOG_TIME_FORMAT)
+    except ValueError:
+        return parse_timestamp(time_str)
+
+
+def _parse_syslog_time(time_str: str) -> Optional[datetime]:
+    """解析syslog时间，不带年份时按当前日期补上年份（跨年时12月的日志属于上一年）"""
+    dt = _parse_syslog_clock(time_str)
+    if dt is None or dt.year != 1900:
+        return dt
+    now = datetime.now()
+    dt = dt.replace(year=now.year)
+    if dt > now + timedelta(days=1):
+        dt = dt.replace(year=now.year - 1)
+    return to_utc(dt)
+
+
 def parse_ssh_log(line: str) -> Optional[LogEntry]:
-    """解析SSH日志"""
-    if not line or not line.strip():
+    """解析SSH日志
+
+    先用子串判断快速跳过非sshd行（secure/auth.log中大部分是其他服务的日志），
+    再按消息类型分派到对应的小正则，避免对每一行执行完整的回溯匹配。
+    """
+    if not line:
         return None
 
-    line = line.strip()
+    # 快速过滤：不含sshd进程标记的行直接跳过
+    pos = line.find('sshd[')
+    if pos < 0:
+        pos = line.find('sshd-session[')
+        if pos < 0:
+            return None
 
-    # 常见SSH失败日志格式:
-    # Dec  9 10:00:00 server sshd[12345]: Failed password for root from 192.168.1.100 port 22 ssh2
-    # Dec  9 10:00:00 server sshd[12345]: Failed password for invalid user admin from 192.168.1.100 port 22 ssh2
-    # Dec  9 10:00:00 server sshd[12345]: Invalid user admin from 192.168.1.100 port 22
+    msg_pos = line.find(']: ', pos)
+    if msg_pos < 0:
+        return None
 
-    failed_pattern = re.compile(
-        r'^(?P<time>\w+\s+\d+\s+[\d:]+)\s+'
-        r'(?P<host>\S+)\s+sshd\[\d+\]:\s+'
-        r'(?P<action>Failed password|Invalid user|Accepted password|Accepted publickey)'
-        r'.*?from\s+(?P<ip>\d+\.\d+\.\d+\.\d+)'
-    )
+    header = SSH_HEADER_PATTERN.match(line, 0, pos)
+    if not header:
+        return None
 
-    match = failed_pattern.search(line)
-    if not match:
+    message = line[msg_pos + 3:].rstrip()
+
+    # 按消息前缀分派到对应正则
+    for prefix, pattern, action, kind in SSH_MESSAGE_RULES:
+        if prefix in message:
+            match = pattern.search(message)
+            if match:
+                break
+    else:
         return None
 
     data = match.groupdict()
+    if action is None:
+        # Failed/Accepted 消息带认证方式，如 Failed password / Accepted publickey
+        action = f"{message.split(' ', 1)[0]} {data.get('method', '')}".strip()
 
-    timestamp = parse_timestamp(data.get('time', ''))
+    timestamp = _parse_syslog_time(header.group('time'))
     if not timestamp:
         timestamp = _utc_now()
 
-    action = data.get('action', '')
-    is_failed = action.startswith('Failed') or action.startswith('Invalid')
+    is_failed = kind == 'failed'
 
     return LogEntry(
         timestamp=timestamp,
@@ -355,12 +475,73 @@ def parse_ssh_log(line: str) -> Optional[LogEntry]:
         source='ssh',
         method='SSH',
         path='/ssh',
-        status=401 if is_failed else 200,
+        status=200 if kind == 'accepted' else 401,
         user_agent='',
-        raw=line,
+        raw=line.strip(),
         extra={
             'action': action,
             'failed': is_failed,
-            'host': data.get('host', '')
+            'preauth': kind == 'preauth',
+            'invalid_user': kind == 'invalid_user',
+            'host': header.group('host'),
+            'user': data.get('user') or ''
         }
     )
+
+
+# 日志格式 -> 解析函数
+LOG_PARSERS = {
+    'nginx': parse_nginx_log,
+    'waf': parse_waf_log,
+    'free_waf': parse_free_waf_log,
+    'ssh': parse_ssh_log,
+}
+
+
+def sniff_line_format(line: str) -> Optional[str]:
+    """判断单行日志的格式，无法判断时返回None
+
+    只使用开销很小的特征判断（首字符、子串、Nginx正则），
+    不走免费WAF解析器的"任意IP"兜底逻辑，避免误判。
+    """
+    import json
+
+    if not line:
+        return None
+
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+
+    first = line[0]
+    if first == '[' or first == '{':
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError:
+            return None
+        if isinstance(data, list) and len(data) >= 4:
+            return 'free_waf'
+        if isinstance(data, dict):
+            return 'waf'
+        return None
+
+    if 'sshd[' in line or 'sshd-session[' in line:
+        return 'ssh'
+
+    if NGINX_COMBINED_PATTERN.match(line):
+        return 'nginx'
+
+    return None
+
+
+def detect_log_format(lines) -> Optional[str]:
+    """根据样本行判断日志格式（多数表决），无法判断时返回None"""
+    votes: Dict[str, int] = {}
+    for line in lines:
+        fmt = sniff_line_format(line)
+        if fmt:
+            votes[fmt] = votes.get(fmt, 0) + 1
+
+    if not votes:
+        return None
+    return max(votes.items(), key=lambda x: x[1])[0]
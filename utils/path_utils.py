@@ -0,0 +1,80 @@
+"""路径通配符工具"""
+import os
+import re
+from functools import lru_cache
+from typing import Pattern
+
+# 通配符字符
+_GLOB_CHARS = ('*', '?', '[')
+
+
+def has_magic(path: str) -> bool:
+    """路径中是否包含通配符"""
+    return any(c in path for c in _GLOB_CHARS)
+
+
+@lru_cache(maxsize=256)
+def glob_to_regex(pattern: str) -> Pattern:
+    """
+    将glob模式转换为匹配完整路径的正则
+
+    与 glob.glob(recursive=True) 语义一致：
+    - `*` 和 `?` 不跨越目录分隔符
+    - `**/` 匹配零个或多个目录
+    - `[...]` 字符集
+    """
+    pattern = os.path.abspath(pattern)
+    i, n = 0, len(pattern)
+    parts = []
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern[i:i + 3] == '**/':
+                parts.append('(?:[^/]*/)*')
+                i += 3
+                continue
+            if pattern[i:i + 2] == '**':
+                parts.append('.*')
+                i += 2
+                continue
+            parts.append('[^/]*')
+        elif c == '?':
+            parts.append('[^/]')
+        elif c == '[':
+            j = pattern.find(']', i + 1)
+            if j < 0:
+                parts.append(re.escape(c))
+            else:
+                body = pattern[i + 1:j]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                parts.append(f'[{body}]')
+                i = j
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return re.compile(''.join(parts) + r'\Z')
+
+
+def match_glob(pattern: str, path: str) -> bool:
+    """检查路径是否匹配glob模式"""
+    return glob_to_regex(pattern).match(os.path.abspath(path)) is not None
+
+
+def glob_base_dir(pattern: str) -> str:
+    """获取glob模式中不含通配符的最长目录前缀"""
+    parts = os.path.normpath(pattern).split(os.sep)
+    base = []
+    for part in parts[:-1]:
+        if has_magic(part):
+            break
+        base.append(part)
+    if not base:
+        return '.'
+    return os.sep.join(base) or os.sep
+
+
+def is_recursive_glob(pattern: str) -> bool:
+    """glob模式是否需要递归监控（目录部分含通配符或 **）"""
+    directory = os.path.dirname(os.path.normpath(pattern))
+    return '**' in pattern or has_magic(directory)
@@ -21,14 +21,32 @@ app = Flask(__name__)
 # 全局配置（由 start_web_server 设置）
 _config = {
     'database': '',
-    'password': ''
+    'password': '',
+    'line_index': ''
 }
 
+# 日志行索引（只读，首次查询时打开）
+_line_index = None
+_line_index_lock = threading.Lock()
 
-def init_app(database: str, password: str = ''):
-    """初始化应用配置"""
+
+def init_app(database: str, password: str = '', line_index: str = ''):
+    """初始化应用配置（line_index 为日志行索引目录，空表示未启用）"""
     _config['database'] = database
     _config['password'] = password
+    _config['line_index'] = line_index
+
+
+def get_line_index():
+    """获取日志行索引（未启用时返回None）"""
+    global _line_index
+    if not _config['line_index']:
+        return None
+    with _line_index_lock:
+        if _line_index is None:
+            from storage.line_index import LineIndex
+            _line_index = LineIndex(_config['line_index'])
+        return _line_index
 
 
 def get_db():
@@ -206,10 +224,31 @@ def api_threat_detail(ip):
         except:
             threat['reasons'] = [threat['reasons']]
 
+    # 证据样本（按日志时间从新到旧）
+    cursor.execute(
+        "SELECT timestamp, path, status, user_agent, rule FROM threat_samples "
+        "WHERE ip = ? ORDER BY timestamp DESC, id DESC",
+        (ip,)
+    )
+    threat['samples'] = [dict(r) for r in cursor.fetchall()]
+
     conn.close()
     return jsonify(threat)
 
 
+@app.route('/api/threat/<ip>/lines')
+@requires_auth
+def api_threat_lines(ip):
+    """IP的原始日志行（最近 limit 行，需要启用 line_index）"""
+    index = get_line_index()
+    if index is None:
+        return jsonify({'error': 'line index disabled'}), 404
+
+    limit = max(1, min(request.args.get('limit', 200, type=int), 5000))
+    lines = index.lookup(ip, limit=limit)
+    return jsonify({'ip': ip, 'count': len(lines), 'lines': lines})
+
+
 @app.route('/api/export')
 @requires_auth
 def api_export():
@@ -257,13 +296,14 @@ def api_delete(ip):
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute("DELETE FROM threat_ips WHERE ip = ?", (ip,))
-    conn.commit()
     deleted = cursor.rowcount
+    cursor.execute("DELETE FROM threat_samples WHERE ip = ?", (ip,))
+    conn.commit()
     conn.close()
     return jsonify({'deleted': deleted})
 
 
-def start_web_server(host: str, port: int, database: str, password: str = ''):
+def start_web_server(host: str, port: int, database: str, password: str = '', line_index: str = ''):
     """
     启动 Web 服务器（在单独线程中运行）
 
@@ -272,8 +312,9 @@ def start_web_server(host: str, port: int, database: str, password: str = ''):
         port: 端口
         database: 数据库路径
         password: 访问密码
+        line_index: 日志行索引目录（空表示未启用）
     """
-    init_app(database, password)
+    init_app(database, password, line_index)
 
     # 禁用 Flask 默认日志
     import logging
@@ -316,7 +357,10 @@ if __name__ == '__main__':
     db_config = config.get('database', {})
     database = db_config.get('path', os.path.join(ROOT_DIR, 'data', 'ipcollect.db'))
 
-    init_app(database, password)
+    index_config = config.get('line_index', {})
+    line_index = index_config.get('path', './data/line_index') if index_config.get('enabled', False) else ''
+
+    init_app(database, password, line_index)
 
     print(f"启动 Web 服务: http://{host}:{port}")
     print(f"数据库: {database}")